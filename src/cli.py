@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Command line interface for scripting against a library of books, does not need GTK or a display.
+#
+#   easy-ebook-viewer-cli metadata BOOK...   prints metadata and chapters index as JSON, BOOK may be an unpacked
+#                                            ePub directory
+#   easy-ebook-viewer-cli validate BOOK...   checks books can be opened and all their files are intact
+#   easy-ebook-viewer-cli prewarm BOOK...    extracts books into cache so they open instantly in the viewer
+#   easy-ebook-viewer-cli soak [-n N]        opens N synthetic books one after another, fails if memory keeps growing
+#   easy-ebook-viewer-cli filter-benchmark [-n N]  types a query into filter of flat chapters index of N rows and
+#                                            prints how long every keystroke took and how many rows it reported
+#   easy-ebook-viewer-cli catalog URL        prints books and feeds OPDS catalog feed lists
+#   easy-ebook-viewer-cli serve-catalog DIR  serves ePub files of a directory as OPDS catalog, for trying catalogs
+#                                            out locally, --latency and --rate simulate a slow network
+#   easy-ebook-viewer-cli replay SESSION BOOK  replays navigation recorded with EASY_EBOOK_VIEWER_RECORD on BOOK in
+#                                            the viewer under Xvfb and prints latency percentiles of every action,
+#                                            --compare REPORT prints how they changed since an earlier report
+#
+# Books are processed in parallel by a pool of processes, results are printed as a JSON array. BOOK may also be
+# an http:// URL, book is then opened the way the viewer opens books from catalogs, while it downloads.
+
+import argparse
+import contextlib
+import gettext
+import gc
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree.ElementTree import ParseError
+
+from workers import config_provider as config_provider_module, content_provider as content_provider_module
+from workers import opds, profiler, session_recorder
+from workers.chapters_filter import ChaptersFilter, PENDING_CHUNK
+from workers.http_fetcher import HttpFetcher
+from workers.opds_server import CatalogServer
+from workers.scheduler import Scheduler
+from workers.validator import BookValidator
+
+# Growth of Python heap over last quarter of soak that is still a plateau. It does not grow with number of books:
+# interpreter keeps some small objects for every file opened (ie. cache markers) until its own caches fill up,
+# that is all that is left, a leak of a section of configuration per book grows past it.
+SOAK_PLATEAU_TOLERANCE = 16 * 1024
+
+# Typed into chapters filter one character at a time and then deleted the same way
+FILTER_BENCHMARK_QUERY = "chapter 1234"
+# Rows of chapters index on screen during filter benchmark
+FILTER_BENCHMARK_SCREEN = 40
+
+
+class BatchConfigProvider(config_provider_module.ConfigProvider):
+    """
+    Configuration that is only read, batch jobs running in parallel must not overwrite each other's config file
+    """
+
+    def save_configuration(self):
+        pass
+
+
+class BatchHub:
+    def __init__(self):
+        """
+        Stands in for main application window as communication hub of workers
+        """
+        self.config_provider = BatchConfigProvider()
+        self.filename = None
+        # Nothing to marshal to, results are handled on worker threads
+        self.scheduler = Scheduler()
+        self.fetcher = HttpFetcher(self.scheduler)
+
+
+def navpoint_to_dict(navpoint):
+    """
+    Converts chapters index to something JSON can serialize
+    :param navpoint: NavPoint
+    :return dictionary:
+    """
+    return {"title": navpoint.text,
+            "content": navpoint.content,
+            "chapter": navpoint.file_number,
+            "children": [navpoint_to_dict(child) for child in navpoint.children]}
+
+
+def is_url(file_path):
+    return file_path.startswith(("http://", "https://"))
+
+
+def open_book(hub, content_provider, file_path):
+    """
+    Prepares book in content provider
+    :return error message or None if book was opened:
+    """
+    hub.filename = file_path
+    download = None
+    if is_url(file_path):
+        try:
+            download = content_provider.downloads.open(file_path)
+        except OSError as e:
+            return "Could not download: %s" % e
+        file_path = download.path
+    elif not os.path.exists(file_path):
+        return "File does not exist"
+    if not content_provider.prepare_book(file_path, download):
+        return "Not a valid ePub file"
+    return None
+
+
+def metadata(hub, content_provider, file_path):
+    error = open_book(hub, content_provider, file_path)
+    if error is not None:
+        return {"file": file_path, "error": error}
+    download = content_provider.session.download
+    return {"file": file_path,
+            "md5": content_provider.book_md5,
+            # How much of book had to be downloaded to read its package and first chapter
+            "downloaded": download.progress if download is not None else None,
+            "title": content_provider.book_name,
+            "author": content_provider.book_author,
+            "chapters": content_provider.files,
+            "index": [navpoint_to_dict(child) for child in content_provider.index.children]
+            if content_provider.index is not None else []}
+
+
+def validate(hub, content_provider, file_path):
+    error = open_book(hub, content_provider, file_path)
+    if error is not None:
+        return {"file": file_path, "valid": False, "errors": [error]}
+    report = BookValidator(content_provider.session).run()
+    return {"file": file_path, "valid": report.valid, "errors": report.problems}
+
+
+def prewarm(hub, content_provider, file_path):
+    error = open_book(hub, content_provider, file_path)
+    if error is None:
+        try:
+            content_provider.extract_all()
+        except zipfile.BadZipFile as e:
+            error = str(e)
+    return {"file": file_path, "cached": error is None, "error": error}
+
+
+COMMANDS = {"metadata": metadata, "validate": validate, "prewarm": prewarm}
+
+# Every worker process keeps its own providers for all the books it gets
+worker_hub = None
+worker_content_provider = None
+
+
+def init_worker():
+    """
+    Prepares worker process
+    """
+    global worker_hub, worker_content_provider
+    # Anything workers print would end up in the middle of JSON output, background threads included
+    sys.stdout = sys.stderr
+    gettext.install('easy-ebook-viewer', '/usr/share/easy-ebook-viewer/locale')
+    worker_hub = BatchHub()
+    worker_content_provider = content_provider_module.ContentProvider(worker_hub)
+
+
+def run(command, file_path):
+    """
+    Runs command on a single book, called in worker process
+    :param command: Name of command
+    :param file_path: Path to book
+    :return JSON serializable result:
+    """
+    try:
+        if not is_url(file_path):
+            file_path = os.path.abspath(file_path)
+        return COMMANDS[command](worker_hub, worker_content_provider, file_path)
+    finally:
+        worker_content_provider.close_book()
+
+
+def soak(count):
+    """
+    Opens synthetic books one after another in this process and checks memory stops growing
+    :param count: Number of books to open
+    :return JSON serializable result:
+    """
+    tracemalloc.start()
+    with tempfile.TemporaryDirectory(prefix="easy-ebook-viewer-soak-") as directory, \
+            contextlib.redirect_stdout(sys.stderr):
+        gettext.install('easy-ebook-viewer', '/usr/share/easy-ebook-viewer/locale')
+        hub = BatchHub()
+        # Synthetic books must not end up in user's cache
+        hub.config_provider.config["Application"]["cacheDir"] = os.path.join(directory, "cache")
+        content_provider = content_provider_module.ContentProvider(hub)
+
+        heap = []
+        rss = []
+        try:
+            for number in range(count):
+                file_path = os.path.join(directory, "book.epub")
+                profiler.write_synthetic_book(file_path, number)
+                if open_book(hub, content_provider, file_path) is not None:
+                    return {"error": "Could not open synthetic book %d" % number}
+                book_md5 = content_provider.book_md5
+                content_provider.close_book()
+                # Position of every book is kept on purpose, synthetic books are not to be remembered
+                hub.config_provider.config.remove_section(book_md5)
+                # Cleanup lists the whole cache while it runs, heap is measured once it's done
+                content_provider.wait_for_cleanup()
+                gc.collect()
+                heap.append(tracemalloc.get_traced_memory()[0])
+                rss.append(profiler.rss())
+        finally:
+            # Cache cleanup still running on workers prints and removes files, it must be done before output
+            # goes back to stdout and before the directory is removed
+            content_provider.close_book()
+            hub.scheduler.shutdown(wait=True)
+            hub.fetcher.close()
+    tracemalloc.stop()
+
+    # First quarter is warm up: caches, imports, lazily created objects. Heap has to stop growing by the last
+    # quarter, any allowance per book would let a slow leak pass.
+    warm_up = count // 4
+    last_quarter = count - 1 - count // 4
+    growth = heap[-1] - heap[last_quarter]
+    return {"books": count,
+            "heap_start": heap[warm_up],
+            "heap_end": heap[-1],
+            "heap_growth_per_book": (heap[-1] - heap[warm_up]) / max(1, count - 1 - warm_up),
+            "heap_growth_last_quarter": growth,
+            "rss_start": rss[warm_up],
+            "rss_end": rss[-1],
+            "plateau": growth <= SOAK_PLATEAU_TOLERANCE}
+
+
+def filter_benchmark(count):
+    """
+    Filters flat chapters index the way typing into filter entry does, screen stays at the top of index
+    :param count: Number of rows in index
+    :return JSON serializable result:
+    """
+    chapters_filter = ChaptersFilter()
+    for number in range(count):
+        chapters_filter.append("Chapter %d" % number, -1)
+
+    queries = [FILTER_BENCHMARK_QUERY[:length] for length in range(1, len(FILTER_BENCHMARK_QUERY) + 1)]
+    queries += list(reversed(queries[:-1])) + [""]
+    keystrokes = []
+    for query in queries:
+        visible = [row for row in range(count) if chapters_filter.is_visible(row)][:FILTER_BENCHMARK_SCREEN]
+        visible_range = (visible[0], visible[-1]) if visible else (0, 0)
+        start = time.perf_counter()
+        reported = len(chapters_filter.filter(query, visible_range))
+        keystroke = {"query": query,
+                     "milliseconds": round((time.perf_counter() - start) * 1000, 3),
+                     "reported": reported,
+                     "pending": len(chapters_filter.pending_rows)}
+        # Rows left pending are reported while GTK is idle before next keystroke, in chunks as tree model does it
+        start = time.perf_counter()
+        chunks = 0
+        while chapters_filter.take_pending(PENDING_CHUNK):
+            chunks += 1
+        keystroke["pending_milliseconds"] = round((time.perf_counter() - start) * 1000, 3)
+        keystroke["pending_chunks"] = chunks
+        keystrokes.append(keystroke)
+
+    return {"rows": count,
+            "keystrokes": keystrokes,
+            "max_milliseconds": max(keystroke["milliseconds"] for keystroke in keystrokes),
+            "max_reported": max(keystroke["reported"] for keystroke in keystrokes)}
+
+
+def catalog(url):
+    """
+    Fetches and parses one feed of OPDS catalog
+    :param url: URL of feed
+    :return JSON serializable result:
+    """
+    fetcher = HttpFetcher(Scheduler())
+    try:
+        feed = opds.parse_feed(fetcher.request(url, {"Accept": opds.CATALOG_TYPE}).body, url)
+    except (OSError, ParseError) as e:
+        return {"url": url, "error": str(e)}
+    finally:
+        fetcher.close()
+    return {"url": feed.url,
+            "title": feed.title,
+            "next": feed.next_url,
+            "up": feed.up_url,
+            "entries": [{"title": entry.title,
+                         "author": entry.author,
+                         "feed": entry.feed_url,
+                         "book": entry.book_url,
+                         "cover": entry.cover_url,
+                         "thumbnail": entry.thumbnail_url} for entry in feed.entries]}
+
+
+def serve_catalog(directory, port, latency, rate):
+    """
+    Serves stand-in catalog until interrupted
+    :param directory: Directory with ePub files
+    :param port: Port to listen on
+    :param latency: Milliseconds every response is delayed by
+    :param rate: KiB per second sent to every connection, 0 for no limit
+    """
+    server = CatalogServer(directory, ("127.0.0.1", port), latency / 1000, rate * 1024 if rate > 0 else None)
+    print("Serving %d books at %s" % (len(server.books), server.url), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    print("%d requests, %d range requests, %.1f MiB sent" %
+          (server.requests, server.range_requests, server.bytes_sent / 2 ** 20), file=sys.stderr)
+
+
+def replay(session_path, book, runs, xvfb):
+    """
+    Replays recorded session in the viewer, every run starts with empty configuration and cache
+    :param session_path: Recorded session
+    :param book: Book to replay session on
+    :param runs: Number of times session is replayed, samples of all runs are put together
+    :param xvfb: True to run viewer on virtual display of xvfb-run
+    :return JSON serializable result:
+    """
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")]
+    if xvfb:
+        if shutil.which("xvfb-run") is None:
+            return {"error": "xvfb-run was not found, install Xvfb or use --no-xvfb"}
+        command = ["xvfb-run", "-a"] + command
+    report = session_recorder.LatencyReport()
+    for run in range(runs):
+        with tempfile.TemporaryDirectory(prefix="easy-ebook-viewer-replay-") as directory:
+            report_path = os.path.join(directory, "report.json")
+            environment = dict(os.environ)
+            # Viewer is neither affected by nor leaves anything in user's configuration, cache and annotations
+            for variable in ("XDG_CONFIG_HOME", "XDG_CACHE_HOME", "XDG_DATA_HOME"):
+                environment[variable] = os.path.join(directory, variable.lower())
+            environment.pop(session_recorder.RECORD_ENVIRONMENT_VARIABLE, None)
+            environment[session_recorder.REPLAY_ENVIRONMENT_VARIABLE] = os.path.abspath(session_path)
+            environment[session_recorder.REPLAY_BOOK_ENVIRONMENT_VARIABLE] = os.path.abspath(book)
+            environment[session_recorder.REPLAY_REPORT_ENVIRONMENT_VARIABLE] = report_path
+            # Viewer's own output would get mixed with JSON printed here
+            subprocess.run(command, env=environment, stdout=sys.stderr)
+            try:
+                with open(report_path, encoding="utf-8") as file:
+                    report.merge(json.load(file))
+            except (OSError, ValueError):
+                return {"error": "Viewer did not finish replay %d" % (run + 1)}
+    result = report.to_dict()
+    result["session"] = session_path
+    result["book"] = book
+    result["runs"] = runs
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="easy-ebook-viewer-cli",
+                                     description="Easy eBook Viewer batch tools, results are printed as JSON")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in sorted(COMMANDS):
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("books", nargs="+", metavar="BOOK")
+        subparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                               help="number of books processed at once")
+    subparser = subparsers.add_parser("soak")
+    subparser.add_argument("-n", "--books", type=int, default=200, help="number of books to open")
+    subparser = subparsers.add_parser("filter-benchmark")
+    subparser.add_argument("-n", "--rows", type=int, default=20000, help="number of rows in chapters index")
+    subparser = subparsers.add_parser("catalog")
+    subparser.add_argument("url", metavar="URL")
+    subparser = subparsers.add_parser("serve-catalog")
+    subparser.add_argument("directory", metavar="DIR")
+    subparser.add_argument("-p", "--port", type=int, default=8080, help="port to listen on")
+    subparser.add_argument("--latency", type=float, default=0, help="milliseconds every response is delayed by")
+    subparser.add_argument("--rate", type=float, default=0, help="KiB per second sent to every connection")
+    subparser = subparsers.add_parser("replay")
+    subparser.add_argument("session", metavar="SESSION")
+    subparser.add_argument("book", metavar="BOOK")
+    subparser.add_argument("-r", "--runs", type=int, default=3, help="number of times session is replayed")
+    subparser.add_argument("--compare", metavar="REPORT", help="earlier report to compare percentiles with")
+    subparser.add_argument("--max-regression", type=float, metavar="PERCENT",
+                           help="fail when 95th percentile of an action got slower by more than this")
+    subparser.add_argument("--no-xvfb", dest="xvfb", action="store_false", help="run viewer on current display")
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "replay":
+        result = replay(arguments.session, arguments.book, max(1, arguments.runs), arguments.xvfb)
+        failed = "error" in result or result["timeouts"] > 0
+        if arguments.compare and "error" not in result:
+            with open(arguments.compare, encoding="utf-8") as file:
+                result["changes"] = session_recorder.compare(result, json.load(file))
+            if arguments.max_regression is not None:
+                failed = failed or any(change["p95"] is not None and change["p95"] * 100 > arguments.max_regression
+                                       for change in result["changes"].values())
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 1 if failed else 0
+
+    if arguments.command == "serve-catalog":
+        serve_catalog(arguments.directory, arguments.port, arguments.latency, arguments.rate)
+        return 0
+
+    if arguments.command == "filter-benchmark":
+        json.dump(filter_benchmark(max(1, arguments.rows)), sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0
+
+    if arguments.command == "catalog":
+        result = catalog(arguments.url)
+        json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+        return 1 if "error" in result else 0
+
+    if arguments.command == "soak":
+        result = soak(max(2, arguments.books))
+        json.dump(result, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+        return 0 if result.get("plateau") else 1
+
+    with ProcessPoolExecutor(max_workers=max(1, arguments.jobs), initializer=init_worker) as executor:
+        results = list(executor.map(run, [arguments.command] * len(arguments.books), arguments.books))
+    json.dump(results, sys.stdout, indent=2, ensure_ascii=False)
+    sys.stdout.write("\n")
+
+    # Non-zero exit status tells scripts something went wrong
+    failed = any(result.get("error") or result.get("valid") is False for result in results)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import bisect
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, Gdk
+from gi.repository import Pango
+from gi.repository import GObject
+from workers.annotation_store import BOOKMARK
+
+# Characters of annotated text shown in the list
+LABEL_LENGTH = 80
+
+
+class AnnotationsModel:
+    def __init__(self, annotations=()):
+        """
+        Rows of annotations list of one book in reading order, kept with book session so it does not have to be
+        rebuilt
+        :param annotations: Annotations in reading order
+        """
+        self.store = Gtk.ListStore(GObject.TYPE_STRING, GObject.TYPE_PYOBJECT)
+        # Sort key of every row, new annotations are inserted where they belong without sorting again
+        self.sort_keys = []
+        for annotation in annotations:
+            self.store.append([self.label(annotation), annotation])
+            self.sort_keys.append(annotation.sort_key)
+
+    @staticmethod
+    def label(annotation):
+        kind = _("Bookmark") if annotation.kind == BOOKMARK else _("Highlight")
+        text = " ".join(annotation.text.split())
+        if len(text) > LABEL_LENGTH:
+            text = text[:LABEL_LENGTH] + "…"
+        return "%s, %d: %s" % (kind, annotation.chapter + 1, text)
+
+
+class AnnotationsListComponent(Gtk.TreeView):
+    def __init__(self):
+        """
+        Lists bookmarks and highlights of open book, activating a row navigates to it, Delete removes it
+        """
+        super(Gtk.TreeView, self).__init__()
+        self.set_headers_visible(False)
+
+        renderer = Gtk.CellRendererText()
+        renderer.set_property("ellipsize", Pango.EllipsizeMode.END)
+        column = Gtk.TreeViewColumn("Annotations", renderer, text=0)
+        column.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        self.append_column(column)
+        # Rows are all the same height, thousands of them don't have to be measured
+        self.set_fixed_height_mode(True)
+
+        self.connect("row-activated", self.__on_row_activated)
+        self.connect("key-press-event", self.__on_key_press)
+        self.annotations_model = None
+        self.set_annotations_model(AnnotationsModel())
+
+    def set_annotations_model(self, annotations_model):
+        """
+        Displays annotations list that was built before
+        :param annotations_model: AnnotationsModel
+        """
+        self.annotations_model = annotations_model
+        self.set_model(annotations_model.store)
+
+    def add_annotation(self, annotation):
+        """
+        Inserts new annotation at its place in reading order
+        :param annotation: Annotation
+        """
+        position = bisect.bisect_right(self.annotations_model.sort_keys, annotation.sort_key)
+        self.annotations_model.sort_keys.insert(position, annotation.sort_key)
+        treeiter = self.annotations_model.store.insert(position, [AnnotationsModel.label(annotation), annotation])
+        self.scroll_to_cell(self.annotations_model.store.get_path(treeiter), None, False, 0, 0)
+
+    def remove_annotation(self, treeiter):
+        position = self.annotations_model.store.get_path(treeiter).get_indices()[0]
+        del self.annotations_model.sort_keys[position]
+        self.annotations_model.store.remove(treeiter)
+
+    def __on_row_activated(self, treeview, path, column):
+        model = self.get_model()
+        self.emit("annotation_activated", model.get_value(model.get_iter(path), 1))
+
+    def __on_key_press(self, widget, event):
+        if Gdk.keyval_name(event.keyval) != "Delete":
+            return False
+        model, treeiter = self.get_selection().get_selected()
+        if treeiter is None:
+            return False
+        annotation = model.get_value(treeiter, 1)
+        self.remove_annotation(treeiter)
+        self.emit("annotation_removed", annotation)
+        return True
+
+# The 'annotation_activated' signal is emitted when user activates a row, 'annotation_removed' when user deletes one
+GObject.type_register(AnnotationsListComponent)
+GObject.signal_new("annotation_activated", AnnotationsListComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE,
+                   [GObject.TYPE_PYOBJECT])
+GObject.signal_new("annotation_removed", AnnotationsListComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE,
+                   [GObject.TYPE_PYOBJECT])
@@ -19,6 +19,77 @@ gi.require_version('Gtk', '3.0')
 from gi.repository import Gtk
 from gi.repository import Pango
 from gi.repository import GObject
+from gi.repository import GLib
+from workers.chapters_filter import ChaptersFilter, PENDING_CHUNK
+from workers.profiler import profiled
+
+
+# Filtering to this many matches or less expands the tree so every match can be seen
+EXPAND_MATCHES_LIMIT = 200
+
+
+class ChaptersModel:
+    def __init__(self):
+        """
+        Rows of chapters index of one book, kept with book session so it does not have to be rebuilt
+        """
+        # Text, NavPoint, number of row in order rows were added
+        self.store = Gtk.TreeStore(GObject.TYPE_STRING, GObject.TYPE_PYOBJECT, GObject.TYPE_INT)
+        # Helpers for finding the right Treeiter by chapter number and chapter anchor
+        self.chapter_number_to_iter = {}
+        self.chapter_anchor_to_iter = {}
+
+        # Which rows are shown, and Treeiter of every row by row number
+        self.chapters_filter = ChaptersFilter()
+        self.row_iters = []
+        self.filter_model = self.store.filter_new()
+        self.filter_model.set_visible_func(self.__is_visible)
+        # Idle source reporting rows off screen, None when there is nothing left to report
+        self.__pending_source = None
+
+    @property
+    def matches(self):
+        return self.chapters_filter.matches
+
+    def append(self, navpoint, parent_row):
+        """
+        Adds a row for NavPoint, parents have to be added before their children
+        :param navpoint: NavPoint
+        :param parent_row: Row number of parent, -1 for top level
+        :return row number:
+        """
+        row = self.chapters_filter.append(navpoint.text, parent_row)
+        parent_treeiter = self.row_iters[parent_row] if parent_row >= 0 else None
+        self.row_iters.append(self.store.append(parent_treeiter, [navpoint.text, navpoint, row]))
+        return row
+
+    @profiled("filter_chapters")
+    def filter(self, query, visible_range=None):
+        """
+        Shows only rows whose text contains query and their ancestors
+        TreeModelFilter is not refiltered as a whole, only rows on screen and right below it are reported at once,
+        the other changed rows are reported a chunk at a time while GTK is idle
+        :param query: Text to look for, empty shows all rows
+        :param visible_range: (first, last) row number shown in tree view, None reports every changed row at once
+        """
+        self.__notify(self.chapters_filter.filter(query, visible_range))
+        if self.chapters_filter.pending_rows and self.__pending_source is None:
+            self.__pending_source = GLib.idle_add(self.__notify_pending)
+
+    def __notify_pending(self):
+        self.__notify(self.chapters_filter.take_pending(PENDING_CHUNK))
+        if self.chapters_filter.pending_rows:
+            return True
+        self.__pending_source = None
+        return False
+
+    def __notify(self, rows):
+        for row in rows:
+            treeiter = self.row_iters[row]
+            self.store.row_changed(self.store.get_path(treeiter), treeiter)
+
+    def __is_visible(self, model, treeiter, data):
+        return self.chapters_filter.is_visible(model.get_value(treeiter, 2))
 
 
 class ChaptersTreeComponent(Gtk.TreeView):
@@ -29,41 +100,87 @@ class ChaptersTreeComponent(Gtk.TreeView):
         """
         super(Gtk.TreeView, self).__init__()
 
-        model = Gtk.TreeStore(GObject.TYPE_STRING, GObject.TYPE_PYOBJECT)
-        self.set_model(model)
         selection = self.get_selection()
         # Only one chapter can be selected at a time
         selection.set_mode(Gtk.SelectionMode.SINGLE)
         selection.connect('changed', self.__on_selection_changed)
         self.ignore_next_selection_signal = False
+        self.__query = ""
 
-        # Helpers for finding the right Treeiter by chapter number and chapter anchor
-        self.chapter_number_to_iter = {}
-        self.chapter_anchor_to_iter = {}
+        self.set_chapters_model(ChaptersModel())
 
         self.append_column(Gtk.TreeViewColumn("Navigation", Gtk.CellRendererText(), text=0))
 
 
-    def reload_treeview(self, index):
+    def clear_treeview(self):
+        """
+        Removes all chapters, to be used when opened book has no chapters index
+        """
+        self.set_chapters_model(ChaptersModel())
+
+    def set_chapters_model(self, chapters_model):
         """
-        Reloads all List Box element by first removing them and then calling __populate_treeview()
+        Displays chapters index that was built before
+        :param chapters_model: ChaptersModel
         """
-        children = self.get_children()
-        for element in children:
-            self.remove(element)
+        self.chapters_model = chapters_model
+        chapters_model.filter(self.__query)
+        self.set_model(chapters_model.filter_model)
+        self.__expand_matches()
+        self.chapter_number_to_iter = chapters_model.chapter_number_to_iter
+        self.chapter_anchor_to_iter = chapters_model.chapter_anchor_to_iter
 
+    @profiled("reload_treeview")
+    def reload_treeview(self, index):
+        """
+        Replaces all List Box elements with a new model populated by __populate_recursive()
+        :param index: Root NavPoint of chapters index
+        :return ChaptersModel that can be displayed again later with set_chapters_model():
+        """
+        # Rows and iters of previous book are dropped together with its model
+        chapters_model = ChaptersModel()
         for child in index.children:
-            self.__populate_recursive(child, None)
+            self.__populate_recursive(chapters_model, child, -1)
+        self.set_chapters_model(chapters_model)
         self.show_all()
+        return chapters_model
+
+    def filter(self, query):
+        """
+        Shows only chapters whose title contains query, chapters they are nested in stay shown too
+        :param query: Text typed by user, empty shows all chapters
+        """
+        self.__query = query
+        self.chapters_model.filter(query, self.__visible_rows())
+        self.__expand_matches()
 
-    def __populate_recursive(self, navpoint, parent_treeiter):
+    def __visible_rows(self):
+        """
+        Returns row numbers of first and last row on screen, (0, 0) when no row is
+        :return (first, last):
+        """
+        found, start_path, end_path = self.get_visible_range()
+        if not found:
+            return 0, 0
         model = self.get_model()
-        treeiter = model.append(parent_treeiter, [navpoint.text, navpoint])
-        self.chapter_anchor_to_iter[navpoint.content] = treeiter
-        if navpoint.file_number not in self.chapter_number_to_iter:
-            self.chapter_number_to_iter[navpoint.file_number] = treeiter
+        return model.get_value(model.get_iter(start_path), 2), model.get_value(model.get_iter(end_path), 2)
+
+    def __expand_matches(self):
+        """
+        Expands filtered tree so matches are not hidden in collapsed rows, unless there is too many of them
+        """
+        matches = self.chapters_model.matches
+        if matches is not None and len(matches) <= EXPAND_MATCHES_LIMIT:
+            self.expand_all()
+
+    def __populate_recursive(self, chapters_model, navpoint, parent_row):
+        row = chapters_model.append(navpoint, parent_row)
+        treeiter = chapters_model.row_iters[row]
+        chapters_model.chapter_anchor_to_iter[navpoint.content] = treeiter
+        if navpoint.file_number not in chapters_model.chapter_number_to_iter:
+            chapters_model.chapter_number_to_iter[navpoint.file_number] = treeiter
         for child in navpoint.children:
-            self.__populate_recursive(child, treeiter)
+            self.__populate_recursive(chapters_model, child, row)
 
     # Check if an item for the given URI is present and select it.
     # If no such item exists, the selection will be cleared.
@@ -93,12 +210,38 @@ class ChaptersTreeComponent(Gtk.TreeView):
         else:
             self.__set_selection(None)
 
+    def choose_anchor(self, anchor):
+        """
+        Selects chapter as if user clicked on it, 'chapter_changed' signal is emitted
+        :param anchor: Content of chapters index entry
+        :return False when there is no such chapter or it's hidden by filter:
+        """
+        treeiter = self.chapter_anchor_to_iter.get(anchor)
+        if treeiter is None:
+            return False
+        treepath = self.chapters_model.filter_model.convert_child_path_to_path(
+            self.chapters_model.store.get_path(treeiter))
+        if treepath is None:
+            return False
+        self.expand_to_path(treepath)
+        self.get_selection().unselect_all()
+        self.ignore_next_selection_signal = False
+        self.get_selection().select_path(treepath)
+        return True
+
     # Helper for setting the selection.
     # Expands the items in the view such that the selected item is visible,
     # and makes sure that we don't respond to the selection 'changed' signal by emitting a 'chapter_changed'
+    # Items hidden by filter are not selected.
     def __set_selection(self, treeiter):
         self.ignore_next_selection_signal = True
 
+        if treeiter:
+            # Iters of the store have to be converted to iters of filter shown in the view
+            treepath = self.chapters_model.filter_model.convert_child_path_to_path(
+                self.chapters_model.store.get_path(treeiter))
+            treeiter = self.get_model().get_iter(treepath) if treepath is not None else None
+
         if treeiter:
             parentiter = self.get_model().iter_parent(treeiter)
             if parentiter:
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
+
+class ComicViewer(Gtk.Viewport):
+    def __init__(self, scrollable):
+        """
+        Displays pages of comic archives, takes place of WebKit Viewer while a comic is open
+        :param scrollable: Scrolled window hosting the viewer
+        """
+        Gtk.Viewport.__init__(self)
+        self.scrollable = scrollable
+        self.image = Gtk.Image()
+        self.add(self.image)
+
+    @property
+    def page_width(self):
+        """
+        Returns width pages should be scaled to, that is width of the scrolled window
+        :return width in pixels:
+        """
+        return max(1, self.scrollable.get_allocated_width())
+
+    def show_page(self, pixbuf):
+        """
+        Displays decoded page and scrolls back to its top
+        :param pixbuf:
+        """
+        if pixbuf is None:
+            self.image.clear()
+        else:
+            self.image.set_from_pixbuf(pixbuf)
+        self.scrollable.get_vadjustment().set_value(0)
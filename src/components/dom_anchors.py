@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+# Converts positions in WebKit DOM to anchors that survive reloading a chapter and back.
+#
+# An anchor is (element path, offset): path is "/" separated indexes of element children from <html> down to
+# the element, offset counts characters of all text inside of the element. Highlights are displayed by wrapping
+# highlighted text in marks, marks are transparent to anchors so highlighting does not move other anchors.
+
+ELEMENT_NODE = 1
+TEXT_NODE = 3
+
+MARK_CLASS = "easy-ebook-viewer-highlight"
+MARK_STYLE = "background-color: rgba(255, 210, 0, 0.4);"
+
+
+def is_mark(node):
+    return node.get_node_type() == ELEMENT_NODE and node.get_attribute("class") == MARK_CLASS
+
+
+def element_children(element):
+    """
+    Returns element children of an element, children of marks count as children of element containing the mark
+    :param element:
+    :return generator of elements:
+    """
+    child = element.get_first_child()
+    while child is not None:
+        if child.get_node_type() == ELEMENT_NODE:
+            if is_mark(child):
+                yield from element_children(child)
+            else:
+                yield child
+        child = child.get_next_sibling()
+
+
+def text_nodes(node):
+    """
+    Returns all text nodes inside of node in document order
+    :param node:
+    :return generator of text nodes:
+    """
+    child = node.get_first_child()
+    while child is not None:
+        if child.get_node_type() == TEXT_NODE:
+            yield child
+        elif child.get_node_type() == ELEMENT_NODE:
+            yield from text_nodes(child)
+        child = child.get_next_sibling()
+
+
+def anchor_element(node):
+    """
+    Returns closest element that contains node and is not a mark
+    :param node:
+    :return element or None:
+    """
+    while node is not None and (node.get_node_type() != ELEMENT_NODE or is_mark(node)):
+        node = node.get_parent_node()
+    return node
+
+
+def element_path(document, element):
+    """
+    Returns path of element
+    :param document: DOMDocument of chapter
+    :param element: Element that is not a mark
+    :return path:
+    """
+    root = document.get_document_element()
+    indexes = []
+    while element is not None and not element.is_same_node(root):
+        parent = anchor_element(element.get_parent_node())
+        if parent is None:
+            break
+        for index, child in enumerate(element_children(parent)):
+            if child.is_same_node(element):
+                indexes.append(str(index))
+                break
+        element = parent
+    return "/".join(reversed(indexes))
+
+
+def resolve_element(document, path):
+    """
+    Finds element path points to
+    :param document: DOMDocument of chapter
+    :param path:
+    :return element or None when chapter does not have it:
+    """
+    element = document.get_document_element()
+    for index in path.split("/"):
+        if not index:
+            continue
+        children = list(element_children(element))
+        if int(index) >= len(children):
+            return None
+        element = children[int(index)]
+    return element
+
+
+def make_anchor(document, node, offset):
+    """
+    Converts DOM position, ie. start of a selection, to an anchor
+    :param document: DOMDocument of chapter
+    :param node: Container node of position
+    :param offset: Offset in container, characters for text nodes and children for elements
+    :return (path, offset):
+    """
+    if node.get_node_type() != TEXT_NODE:
+        # Position between children is the end of text that comes before it
+        texts = []
+        child = node.get_first_child()
+        for i in range(offset):
+            if child is None:
+                break
+            if child.get_node_type() == TEXT_NODE:
+                texts.append(child)
+            else:
+                texts.extend(text_nodes(child))
+            child = child.get_next_sibling()
+        if not texts:
+            return element_path(document, anchor_element(node)), 0
+        node, offset = texts[-1], texts[-1].get_length()
+
+    element = anchor_element(node.get_parent_node())
+    text_offset = 0
+    for text in text_nodes(element):
+        if text.is_same_node(node):
+            break
+        text_offset += text.get_length()
+    return element_path(document, element), text_offset + offset
+
+
+def resolve_anchor(document, path, offset):
+    """
+    Converts anchor back to DOM position
+    :param document: DOMDocument of chapter
+    :param path:
+    :param offset:
+    :return (node, offset) or None when chapter does not have element anchor points to:
+    """
+    element = resolve_element(document, path)
+    if element is None:
+        return None
+    last = None
+    for text in text_nodes(element):
+        length = text.get_length()
+        if offset <= length:
+            return text, offset
+        offset -= length
+        last = text
+    if last is not None:
+        return last, last.get_length()
+    return element, 0
+
+
+def mark_ranges(document, ranges):
+    """
+    Wraps text of every range in marks, text of each text node is wrapped separately so no element is moved
+    :param document: DOMDocument of chapter
+    :param ranges: List of (start path, start offset, end path, end offset)
+    """
+    texts = list(text_nodes(document.get_document_element()))
+    positions = {text: i for i, text in enumerate(texts)}
+
+    # Highlighted intervals of every text node, overlapping highlights are merged
+    intervals = {}
+    for start_path, start_offset, end_path, end_offset in ranges:
+        start = resolve_anchor(document, start_path, start_offset)
+        end = resolve_anchor(document, end_path, end_offset)
+        if start is None or end is None or start[0] not in positions or end[0] not in positions:
+            continue
+        first, last = positions[start[0]], positions[end[0]]
+        for i in range(first, last + 1):
+            interval_start = start[1] if i == first else 0
+            interval_end = end[1] if i == last else texts[i].get_length()
+            if interval_start < interval_end:
+                intervals.setdefault(i, []).append((interval_start, interval_end))
+
+    for i, text_intervals in intervals.items():
+        merged = []
+        for interval_start, interval_end in sorted(text_intervals):
+            if merged and interval_start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], interval_end))
+            else:
+                merged.append((interval_start, interval_end))
+        text = texts[i]
+        if not text.get_data().strip():
+            # Whitespace between block elements, a mark there could end up where no inline element belongs
+            continue
+        # From the end, so splitting text off does not move intervals that are still to be wrapped
+        for interval_start, interval_end in reversed(merged):
+            if interval_end < text.get_length():
+                text.split_text(interval_end)
+            marked = text.split_text(interval_start) if interval_start > 0 else text
+            mark = document.create_element("span")
+            mark.set_attribute("class", MARK_CLASS)
+            mark.set_attribute("style", MARK_STYLE)
+            marked.get_parent_node().insert_before(mark, marked)
+            mark.append_child(marked)
+
+
+def unmark(document):
+    """
+    Removes all marks, their text is put back where it was
+    :param document: DOMDocument of chapter
+    """
+    marks = []
+    pending = [document.get_document_element()]
+    while pending:
+        node = pending.pop()
+        child = node.get_first_child()
+        while child is not None:
+            if child.get_node_type() == ELEMENT_NODE:
+                if is_mark(child):
+                    marks.append(child)
+                pending.append(child)
+            child = child.get_next_sibling()
+    for mark in marks:
+        parent = mark.get_parent_node()
+        while mark.get_first_child() is not None:
+            parent.insert_before(mark.get_first_child(), mark)
+        parent.remove_child(mark)
+        # Joins text split by marking, anchors don't depend on it but repeated marking stays cheap
+        parent.normalize()
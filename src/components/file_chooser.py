@@ -20,6 +20,9 @@ gi.require_version('Gtk', '3.0')
 from os import path
 from gi.repository import Gtk
 
+# Response of button opening selected folder as unpacked ePub
+OPEN_FOLDER_RESPONSE = 1
+
 
 class FileChooserWindow(Gtk.Window):
     def show_dialog(self, importing=False):
@@ -37,8 +40,15 @@ class FileChooserWindow(Gtk.Window):
         # TODO: Filter list for all conversion supported ebooks
         self.__add_filters(dialog, importing)
 
+        # Unpacked ePub is opened as the folder it's in
+        dialog.add_button(_("Open folder"), OPEN_FOLDER_RESPONSE)
+
         response = dialog.run()
         filename = dialog.get_filename()
+        if response == OPEN_FOLDER_RESPONSE:
+            if filename is None or not path.isdir(filename):
+                filename = dialog.get_current_folder()
+            response = Gtk.ResponseType.OK
         dialog.destroy()
 
         return response, filename
@@ -101,6 +101,16 @@ class HeaderBarComponent(Gtk.HeaderBar):
         self.show_index_button.connect("toggled", lambda button: self.emit('navigation_toggled', button.get_active()))
         self.pack_start(self.show_index_button)
 
+        # Adds Recent books context settings menu item, switches to books that are still open in the background
+        self.__recent_menu_item = Gtk.MenuItem(_("Recent books"))
+        self.__recent_menu_item.set_sensitive(False)
+        self.__menu.append(self.__recent_menu_item)
+
+        # Adds Catalog context settings menu item, opens books from OPDS catalog
+        catalog_menu_item = Gtk.MenuItem(_("Browse catalog"))
+        catalog_menu_item.connect("activate", lambda item: self.emit("catalog_clicked"))
+        self.__menu.append(catalog_menu_item)
+
         # Adds Preferences context settings menu item
         preferences_menu_item = Gtk.MenuItem(_("Preferences"))
         preferences_menu_item.connect("activate", lambda item: self.emit("preferences_clicked"))
@@ -184,6 +194,21 @@ class HeaderBarComponent(Gtk.HeaderBar):
         self.chapter_count = n
         self.number_pages_entry.set_placeholder_text(_("of %s") % (str(n)))
 
+    def set_recent_books(self, books):
+        """
+        Fills Recent books submenu
+        :param books: List of (title, file path) tuples, most recent first
+        """
+        recent_menu = Gtk.Menu()
+        for title, file_path in books:
+            menu_item = Gtk.MenuItem(title)
+            menu_item.set_tooltip_text(file_path)
+            menu_item.connect("activate", lambda item, path: self.emit("recent_book_clicked", path), file_path)
+            recent_menu.append(menu_item)
+        recent_menu.show_all()
+        self.__recent_menu_item.set_submenu(recent_menu)
+        self.__recent_menu_item.set_sensitive(len(books) > 0)
+
     def show_jumping_navigation(self):
         """
         Enables entry based navigation, to be used when book is loaded
@@ -196,6 +221,18 @@ class HeaderBarComponent(Gtk.HeaderBar):
         """
         self.pages_box.hide()
 
+    def clear(self):
+        """
+        Disables all chapter navigation and shows window title, to be used when book could not be opened
+        """
+        self.hide_jumping_navigation()
+        self.set_chapter_count(0)
+        self.selected_chapter = 0
+        self.left_arrow_button.set_sensitive(False)
+        self.right_arrow_button.set_sensitive(False)
+        self.set_title(None)
+        self.set_subtitle(None)
+
 GObject.type_register(HeaderBarComponent)
 # We register a bunch of custom signals for this class:
 # emitted when the user choose a different chapter in the header bar.
@@ -204,7 +241,11 @@ GObject.signal_new("chapter_changed", HeaderBarComponent, GObject.SIGNAL_RUN_LAS
 GObject.signal_new("open_clicked", HeaderBarComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [])
 # emitted when user clicks 'about' option in menu
 GObject.signal_new("about_clicked", HeaderBarComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [])
+# emitted when user clicks 'browse catalog' option in menu
+GObject.signal_new("catalog_clicked", HeaderBarComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [])
 # emitted when user clicks 'preferences' option in menu
 GObject.signal_new("preferences_clicked", HeaderBarComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [])
+# emitted when user picks a book in 'recent books' menu
+GObject.signal_new("recent_book_clicked", HeaderBarComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [GObject.TYPE_STRING])
 # emitted when 'show navigation' is toggled
 GObject.signal_new("navigation_toggled", HeaderBarComponent, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [GObject.TYPE_BOOLEAN])
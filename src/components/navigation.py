@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import time
+
+from gi.repository import GLib
+
+# Requests coming closer to each other than this many milliseconds are a burst, ie. a held arrow key
+BURST_INTERVAL = 120
+
+# How a navigation request selects chapter in chapters tree
+SELECT_CHAPTER = 0
+SELECT_URI = 1
+SELECT_NOTHING = 2
+
+
+class NavigationRequest:
+    def __init__(self, chapter, path, scroll_to_set=None, tree_selection=SELECT_CHAPTER, displayed=False,
+                 history_entry=None, push_history=True):
+        """
+        Chapter that should be displayed
+        :param chapter: Chapter number
+        :param path: Path of chapter file, may contain anchor
+        :param scroll_to_set: Scroll position, page or anchor to show once chapter is loaded
+        :param tree_selection: SELECT_CHAPTER, SELECT_URI or SELECT_NOTHING when user selected it in tree already
+        :param displayed: True when viewer shows the chapter already, ie. user followed a link
+        :param history_entry: HistoryEntry when going back or forward in history
+        :param push_history: False when chapter should not be recorded in history
+        """
+        self.chapter = chapter
+        self.path = path
+        self.scroll_to_set = scroll_to_set
+        self.tree_selection = tree_selection
+        self.displayed = displayed
+        self.history_entry = history_entry
+        self.push_history = push_history and history_entry is None
+
+
+class NavigationDispatcher:
+    def __init__(self, preview, load, cancel):
+        """
+        Single way chapters get displayed. Every request is previewed right away (ie. chapter number in header bar),
+        a burst of requests is coalesced so only its last request is loaded, once the burst is over.
+        :param preview: Called with every NavigationRequest, must be cheap
+        :param load: Called with NavigationRequest that should really be displayed
+        :param cancel: Called to stop loading a chapter that was superseded
+        """
+        self.__preview = preview
+        self.__load = load
+        self.__cancel = cancel
+        self.__pending = None
+        self.__timeout = None
+        self.__last_request = 0.0
+
+    @property
+    def busy(self):
+        """
+        Tells if a request is waiting for its burst to end, displayed chapter is not the requested one then
+        :return True while requests are being coalesced:
+        """
+        return self.__pending is not None
+
+    def navigate(self, request):
+        """
+        Requests chapter to be displayed, first request of a burst is loaded right away
+        :param request: NavigationRequest
+        """
+        if request.displayed:
+            # Viewer shows the chapter already, it replaces whatever was pending
+            self.clear()
+            self.__preview(request)
+            self.__load(request)
+            return
+        now = time.monotonic()
+        burst = (now - self.__last_request) * 1000 < BURST_INTERVAL
+        self.__last_request = now
+        self.__preview(request)
+        if not burst and self.__pending is None:
+            self.__load(request)
+            return
+        if self.__pending is None:
+            # Chapter loading for previous request of burst is already outdated
+            self.__cancel()
+        self.__pending = request
+        if self.__timeout is not None:
+            GLib.source_remove(self.__timeout)
+        self.__timeout = GLib.timeout_add(BURST_INTERVAL, self.__flush)
+
+    def clear(self):
+        """
+        Forgets pending request, to be used when another book is opened
+        """
+        self.__pending = None
+        if self.__timeout is not None:
+            GLib.source_remove(self.__timeout)
+            self.__timeout = None
+
+    def __flush(self):
+        self.__timeout = None
+        request = self.__pending
+        self.__pending = None
+        if request is not None:
+            self.__load(request)
+        return False
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+from xml.etree.ElementTree import ParseError
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GdkPixbuf, GLib
+from gi.repository import Pango
+from gi.repository import GObject
+from workers import opds
+from workers.scheduler import INTERACTIVE, PREFETCH
+
+# Height covers are scaled to in the list
+COVER_HEIGHT = 64
+
+
+class OpdsBrowserWindow(Gtk.Window):
+    def __init__(self, window):
+        """
+        Browses OPDS catalog, feeds are fetched first and their covers after them, several at once
+        :param window: Main application window reference, serves as communication hub
+        """
+        Gtk.Window.__init__(self)
+        self.__window = window
+        self.set_default_size(480, 600)
+        self.set_transient_for(window)
+        # Window is only hidden when closed, catalog stays where user left it
+        self.connect("delete-event", lambda widget, event: self.hide_on_delete())
+
+        # Feeds visited before current one, for back button
+        self.__back_urls = []
+        self.__feed = None
+        self.__feed_task = None
+        self.__cover_tasks = []
+        # Covers already fetched, URL: Pixbuf
+        self.__covers = {}
+
+        header_bar = Gtk.HeaderBar()
+        header_bar.set_show_close_button(True)
+        header_bar.props.title = _("Catalog")
+        self.set_titlebar(header_bar)
+        self.__back_button = Gtk.Button()
+        self.__back_button.add(Gtk.Image.new_from_icon_name("go-previous-symbolic", Gtk.IconSize.SMALL_TOOLBAR))
+        self.__back_button.set_sensitive(False)
+        self.__back_button.connect("clicked", self.__on_back_clicked)
+        header_bar.pack_start(self.__back_button)
+        self.__spinner = Gtk.Spinner()
+        header_bar.pack_end(self.__spinner)
+
+        box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.__url_entry = Gtk.Entry()
+        self.__url_entry.set_placeholder_text(_("Catalog address"))
+        self.__url_entry.set_text(window.config_provider.config["Application"]["opdsCatalog"])
+        self.__url_entry.connect("activate", self.__on_url_activate)
+        box.pack_start(self.__url_entry, False, False, 0)
+        self.__error_label = Gtk.Label()
+        self.__error_label.set_line_wrap(True)
+        box.pack_start(self.__error_label, False, False, 0)
+        scrollable_window = Gtk.ScrolledWindow()
+        scrollable_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.__list_box = Gtk.ListBox()
+        self.__list_box.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.__list_box.connect("row-activated", self.__on_row_activated)
+        scrollable_window.add(self.__list_box)
+        box.pack_start(scrollable_window, True, True, 0)
+        self.add(box)
+
+    def show_catalog(self):
+        """
+        Shows window, catalog from configuration is loaded the first time
+        """
+        self.show_all()
+        self.__error_label.hide()
+        if self.__feed is None and self.__feed_task is None and self.__url_entry.get_text().strip():
+            self.__load_feed(self.__url_entry.get_text().strip())
+        self.present()
+
+    def __load_feed(self, url, append=False):
+        """
+        Fetches and shows feed, replaces feed being fetched
+        :param url:
+        :param append: True to add entries of feed to the list (next page of the same feed)
+        """
+        if self.__feed_task is not None:
+            self.__feed_task.cancel()
+        self.__spinner.start()
+        self.__feed_task = self.__window.scheduler.submit(lambda: self.__fetch_feed(url), INTERACTIVE,
+                                                          on_finished=lambda result: self.__show_feed(result,
+                                                                                                      append))
+
+    def __fetch_feed(self, url):
+        """
+        Fetches and parses feed, runs on worker thread
+        :return (Feed, None) or (None, error message):
+        """
+        try:
+            response = self.__window.fetcher.request(url, {"Accept": opds.CATALOG_TYPE})
+            return opds.parse_feed(response.body, response.url), None
+        except (OSError, ParseError) as e:
+            print("Could not load catalog: ", url, e)
+            return None, str(e)
+
+    def __show_feed(self, result, append):
+        feed, error = result
+        self.__feed_task = None
+        self.__spinner.stop()
+        if feed is None:
+            self.__error_label.set_text(_("Could not load catalog: %s") % error)
+            self.__error_label.show()
+            return
+        self.__error_label.hide()
+        if not append:
+            for task in self.__cover_tasks:
+                task.cancel()
+            self.__cover_tasks = []
+            for row in self.__list_box.get_children():
+                self.__list_box.remove(row)
+            self.get_titlebar().props.title = feed.title or _("Catalog")
+        else:
+            # "More" row of previous page
+            rows = self.__list_box.get_children()
+            if rows and rows[-1].next_url is not None:
+                self.__list_box.remove(rows[-1])
+        self.__feed = feed
+        for entry in feed.entries:
+            self.__list_box.add(self.__create_row(entry))
+        if feed.next_url is not None:
+            row = Gtk.ListBoxRow()
+            row.entry = None
+            row.next_url = feed.next_url
+            row.add(Gtk.Label(_("More…")))
+            self.__list_box.add(row)
+        self.__list_box.show_all()
+
+    def __create_row(self, entry):
+        """
+        Creates row for a book or a feed, its cover is fetched in the background
+        :param entry: opds.Entry
+        :return Gtk.ListBoxRow:
+        """
+        row = Gtk.ListBoxRow()
+        row.entry = entry
+        row.next_url = None
+        box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=10)
+        box.set_border_width(5)
+        image = Gtk.Image.new_from_icon_name("x-office-document" if entry.book_url else "folder",
+                                             Gtk.IconSize.DIALOG)
+        image.set_size_request(COVER_HEIGHT * 2 // 3, COVER_HEIGHT)
+        box.pack_start(image, False, False, 0)
+        labels = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        title_label = Gtk.Label(xalign=0)
+        title_label.set_markup("<b>%s</b>" % GLib.markup_escape_text(entry.title))
+        title_label.set_ellipsize(Pango.EllipsizeMode.END)
+        labels.pack_start(title_label, False, False, 0)
+        author_label = Gtk.Label(entry.author or entry.summary, xalign=0)
+        author_label.set_ellipsize(Pango.EllipsizeMode.END)
+        labels.pack_start(author_label, False, False, 0)
+        box.pack_start(labels, True, True, 0)
+        if entry.book_url is not None:
+            open_button = Gtk.Button(_("Open"))
+            open_button.set_valign(Gtk.Align.CENTER)
+            open_button.connect("clicked", lambda button: self.__open_book(entry))
+            box.pack_end(open_button, False, False, 0)
+        row.add(box)
+
+        cover_url = entry.thumbnail_url or entry.cover_url
+        if cover_url in self.__covers:
+            image.set_from_pixbuf(self.__covers[cover_url])
+        elif cover_url is not None:
+            self.__cover_tasks.append(self.__window.scheduler.submit(
+                lambda: self.__fetch_cover(cover_url), PREFETCH,
+                on_finished=lambda pixbuf: self.__show_cover(image, cover_url, pixbuf)))
+        return row
+
+    def __fetch_cover(self, url):
+        """
+        Fetches and decodes cover, runs on worker thread
+        :return Pixbuf scaled to list, None when cover could not be loaded:
+        """
+        try:
+            data = self.__window.fetcher.request(url).body
+            loader = GdkPixbuf.PixbufLoader()
+            loader.write(data)
+            loader.close()
+            pixbuf = loader.get_pixbuf()
+        except (OSError, GLib.Error) as e:
+            print("Could not load cover: ", url, e)
+            return None
+        width = max(1, pixbuf.get_width() * COVER_HEIGHT // max(1, pixbuf.get_height()))
+        return pixbuf.scale_simple(width, COVER_HEIGHT, GdkPixbuf.InterpType.BILINEAR)
+
+    def __show_cover(self, image, url, pixbuf):
+        if pixbuf is not None:
+            self.__covers[url] = pixbuf
+            image.set_from_pixbuf(pixbuf)
+
+    def __open_book(self, entry):
+        self.hide()
+        self.emit("book_chosen", entry.book_url)
+
+    def __on_row_activated(self, list_box, row):
+        if row.next_url is not None:
+            self.__load_feed(row.next_url, append=True)
+        elif row.entry.feed_url is not None:
+            self.__back_urls.append(self.__feed.url)
+            self.__back_button.set_sensitive(True)
+            self.__load_feed(row.entry.feed_url)
+        elif row.entry.book_url is not None:
+            self.__open_book(row.entry)
+
+    def __on_back_clicked(self, button):
+        if self.__back_urls:
+            self.__load_feed(self.__back_urls.pop())
+        button.set_sensitive(len(self.__back_urls) > 0)
+
+    def __on_url_activate(self, entry):
+        url = entry.get_text().strip()
+        if not url:
+            return
+        if "://" not in url:
+            url = "http://" + url
+            entry.set_text(url)
+        # Catalog is opened again next time
+        self.__window.config_provider.config["Application"]["opdsCatalog"] = url
+        self.__window.config_provider.save_configuration()
+        self.__back_urls = []
+        self.__back_button.set_sensitive(False)
+        self.__load_feed(url)
+
+GObject.type_register(OpdsBrowserWindow)
+# Emitted with URL of book user chose to open
+GObject.signal_new("book_chosen", OpdsBrowserWindow, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [GObject.TYPE_STRING])
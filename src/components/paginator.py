@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import os
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GObject, GLib
+from components import viewer
+from workers.page_map import PageMapStore
+from workers.scheduler import INDEXING
+
+# Milliseconds layout is given to settle after chapter finished loading, before its pages are counted
+SETTLE_DELAY = 50
+
+# Page map is saved every this many chapters so progress is not lost when application is closed
+SAVE_INTERVAL = 10
+
+
+class Paginator(GObject.GObject):
+    def __init__(self, window):
+        """
+        Builds page map of open book in the background by laying out chapters one by one in a hidden viewer
+        :param window: Main application window reference, serves as communication hub
+        """
+        super(Paginator, self).__init__()
+        self.__window = window
+        config = window.config_provider.config["Application"]
+        self.__store = PageMapStore(os.path.join(os.path.expanduser(config["cacheDir"]), "page-maps"))
+
+        # Hidden viewer has the same size as visible one, so it lays chapters out the same way
+        self.__offscreen_window = Gtk.OffscreenWindow()
+        self.__scrollable = Gtk.ScrolledWindow()
+        self.__viewer = viewer.Viewer(window, self.__scrollable)
+        self.__scrollable.add(self.__viewer)
+        self.__offscreen_window.add(self.__scrollable)
+        self.__offscreen_window.show_all()
+        self.__viewer.connect("load-finished", self.__on_load_finished)
+
+        self.page_map = None
+        self.__chapter_paths = []
+        # Chapter being measured, None when nothing is
+        self.__chapter = None
+
+    def start(self, book_md5, chapter_paths, page_size, zoom, theme):
+        """
+        Loads saved page map and measures chapters it's missing, nothing is done if it's already built
+        :param book_md5: Identity of book content, see BookSession.content_version
+        :param chapter_paths: Path of every chapter file
+        :param page_size: (width, height) of a page in pixels
+        :param zoom: Zoom level of visible viewer
+        :param theme: Name of stylesheet
+        """
+        width, height = page_size
+        key = PageMapStore.make_key(book_md5, width, height, zoom, theme)
+        if self.page_map is not None and self.page_map.key == key:
+            return
+        self.stop()
+        self.page_map = self.__store.load(key, len(chapter_paths))
+        self.__chapter_paths = chapter_paths
+
+        self.__scrollable.set_size_request(width, height)
+        self.__viewer.set_zoom_level(zoom)
+        if theme == "Day":
+            self.__viewer.set_style_day()
+        else:
+            self.__viewer.set_style_night()
+        self.__viewer.set_paginated(page_size)
+
+        self.emit("page_map_changed")
+        GLib.idle_add(self.__measure_next, self.page_map)
+
+    def stop(self):
+        """
+        Stops measuring and forgets page map, to be used when another book is opened or pagination is turned off
+        """
+        if self.page_map is not None and not self.page_map.complete:
+            self.__store.save(self.page_map)
+        self.page_map = None
+        self.__chapter_paths = []
+        if self.__chapter is not None:
+            self.__chapter = None
+            self.__viewer.clear()
+
+    def __measure_next(self, page_map):
+        """
+        Loads next chapter page map is missing into hidden viewer
+        """
+        if page_map is not self.page_map:
+            return False
+        chapter = page_map.next_unmeasured
+        if chapter is None:
+            self.__store.save(page_map)
+            print("Page map complete: %d pages" % page_map.page_count)
+            self.emit("page_map_changed")
+            return False
+        self.__chapter = chapter
+        self.__viewer.load_path(self.__chapter_paths[chapter], priority=INDEXING)
+        return False
+
+    def __on_load_finished(self, emitting_viewer, frame):
+        if self.__chapter is not None:
+            GLib.timeout_add(SETTLE_DELAY, self.__measure, self.page_map, self.__chapter)
+
+    def __measure(self, page_map, chapter):
+        """
+        Counts pages of chapter in hidden viewer, then moves on to next one
+        """
+        if page_map is not self.page_map or chapter != self.__chapter:
+            return False
+        page_map.set_chapter_pages(chapter, self.__viewer.page_count)
+        self.__chapter = None
+        if chapter % SAVE_INTERVAL == SAVE_INTERVAL - 1:
+            self.__store.save(page_map)
+        GLib.idle_add(self.__measure_next, page_map)
+        return False
+
+# The 'page_map_changed' signal is emitted when another page map is started and when page map is complete
+GObject.type_register(Paginator)
+GObject.signal_new("page_map_changed", Paginator, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [])
@@ -53,6 +53,33 @@ class PreferencesDialog(Gtk.Window):
         theme_label = Gtk.Label(_("Application theme") ,xalign=0)
         hbox_theme.pack_start(theme_label, False, True, 0)
         vbox.pack_start(hbox_theme, False, True, 0)
+
+        hbox_page_cache = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=50)
+        self.page_cache_spin = Gtk.SpinButton.new_with_range(0, 100, 1)
+        self.page_cache_spin.set_value(int(self.window.config_provider.config["Application"]["pageCacheSize"]))
+        hbox_page_cache.pack_end(self.page_cache_spin, False, True, 0)
+        page_cache_label = Gtk.Label(_("Recent pages kept in memory"), xalign=0)
+        hbox_page_cache.pack_start(page_cache_label, False, True, 0)
+        hbox_page_cache.set_margin_top(10)
+        vbox.pack_start(hbox_page_cache, False, True, 0)
+
+        hbox_paginated = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=50)
+        self.paginated_switch = Gtk.Switch()
+        self.paginated_switch.set_active(self.window.config_provider.config["Application"]["paginated"] == "True")
+        hbox_paginated.pack_end(self.paginated_switch, False, True, 0)
+        paginated_label = Gtk.Label(_("Show book in pages"), xalign=0)
+        hbox_paginated.pack_start(paginated_label, False, True, 0)
+        hbox_paginated.set_margin_top(10)
+        vbox.pack_start(hbox_paginated, False, True, 0)
+
+        hbox_watch_book = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=50)
+        self.watch_book_switch = Gtk.Switch()
+        self.watch_book_switch.set_active(self.window.config_provider.config["Application"]["watchBook"] == "True")
+        hbox_watch_book.pack_end(self.watch_book_switch, False, True, 0)
+        watch_book_label = Gtk.Label(_("Reload book when its file changes"), xalign=0)
+        hbox_watch_book.pack_start(watch_book_label, False, True, 0)
+        hbox_watch_book.set_margin_top(10)
+        vbox.pack_start(hbox_watch_book, False, True, 0)
         try:
             vbox.set_margin_start(20)
             vbox.set_margin_end(20)
@@ -105,15 +132,31 @@ class HeaderBarComponent(Gtk.HeaderBar):
         if self.__window.window.config_provider.config["Application"]["stylesheet"] == "Day" and self.__window.themes_combo.get_active_text() == "Night (dark)":
             self.__window.window.config_provider.config["Application"]["stylesheet"] = "Night"
             self.__window.window.config_provider.save_configuration()
-            self.__window.window.viewer.set_style_night()
+            self.__window.window.viewer_pool.set_style_night()
             self.__window.window.settings.set_property("gtk-application-prefer-dark-theme", True)
             self.__window.window.show_all()
         elif self.__window.window.config_provider.config["Application"]["stylesheet"] == "Night" and self.__window.themes_combo.get_active_text() == "Day (light)":
             self.__window.window.config_provider.config["Application"]["stylesheet"] = "Day"
             self.__window.window.config_provider.save_configuration()
-            self.__window.window.viewer.set_style_day()
+            self.__window.window.viewer_pool.set_style_day()
             self.__window.window.settings.set_property("gtk-application-prefer-dark-theme", False)
             self.__window.window.show_all()
+        page_cache_size = self.__window.page_cache_spin.get_value_as_int()
+        if self.__window.window.config_provider.config["Application"]["pageCacheSize"] != str(page_cache_size):
+            self.__window.window.config_provider.config["Application"]["pageCacheSize"] = str(page_cache_size)
+            self.__window.window.config_provider.save_configuration()
+            self.__window.window.viewer_pool.set_page_cache_size(page_cache_size)
+        paginated = self.__window.paginated_switch.get_active()
+        if self.__window.window.config_provider.config["Application"]["paginated"] != str(paginated):
+            self.__window.window.config_provider.config["Application"]["paginated"] = str(paginated)
+            self.__window.window.config_provider.save_configuration()
+        # Page map depends on theme too
+        self.__window.window.set_paginated(paginated)
+        watch_book = self.__window.watch_book_switch.get_active()
+        if self.__window.window.config_provider.config["Application"]["watchBook"] != str(watch_book):
+            self.__window.window.config_provider.config["Application"]["watchBook"] = str(watch_book)
+            self.__window.window.config_provider.save_configuration()
+            self.__window.window.set_watch_book(watch_book)
         self.__window.destroy()
 
 
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import json
+import os
+import time
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, Gdk, GLib
+from workers import session_recorder
+
+# Milliseconds window gets to be mapped and laid out before first action
+STARTUP_DELAY = 1000
+# Pause between actions is the one user made, but never longer than this many seconds
+MAX_THINK_TIME = 2.0
+# Seconds an action may take until it's given up on
+ACTION_TIMEOUT = 20.0
+# Seconds after which action that did not load anything is counted as skipped
+NO_LOAD_TIMEOUT = 2.0
+# Milliseconds between checks whether viewer swapped in a chapter laid out ahead of time
+POLL_INTERVAL = 10
+
+
+class SessionReplayer:
+    def __init__(self, window, actions, book, report_path=None):
+        """
+        Does recorded navigation again through the same widgets user used and measures how long it took from
+        each action until the page was laid out. Next action starts only once the previous one is done.
+        :param window: Main application window reference, serves as communication hub
+        :param actions: Recorded actions, see session_recorder.read_session
+        :param book: Book to replay actions on, recorded book is opened when None
+        :param report_path: File latency report is written to, it's printed when None
+        """
+        self.__window = window
+        self.__book = book
+        self.__report_path = report_path
+        self.__report = session_recorder.LatencyReport()
+        self.__actions = list(actions)
+        # Session starts with opening the book, it's opened first even when recording started later
+        if not self.__actions or self.__actions[0]["action"] != session_recorder.OPEN:
+            self.__actions.insert(0, {"time": 0, "action": session_recorder.OPEN})
+        self.__index = 0
+        # Action being measured: its kind, viewer that was visible before it and perf_counter time it started at
+        self.__pending = None
+        self.__poll_timeout = None
+        self.__last_latency = 0
+        window.viewer_pool.connect("load-finished", self.__on_load_finished)
+
+    def start(self):
+        GLib.timeout_add(STARTUP_DELAY, self.__next_action)
+
+    def __next_action(self):
+        """
+        Performs next action, quits application once all were done
+        """
+        if self.__index >= len(self.__actions):
+            self.__finish()
+            return False
+        action = self.__actions[self.__index]
+        self.__index += 1
+        window = self.__window
+        self.__pending = {"action": action["action"], "viewer": window.viewer, "start": time.perf_counter()}
+        if not self.__perform(action):
+            self.__pending = None
+            self.__report.skipped += 1
+            self.__schedule(action)
+            return False
+        if self.__pending is not None:
+            self.__poll_timeout = GLib.timeout_add(POLL_INTERVAL, self.__poll)
+        return False
+
+    def __perform(self, action):
+        """
+        Performs action the way user did
+        :param action: Recorded action
+        :return True when action was performed, False when it can't be done in this book:
+        """
+        window = self.__window
+        kind = action["action"]
+        if kind == session_recorder.OPEN:
+            book = self.__book or action.get("book")
+            if not book or not os.path.exists(book):
+                return False
+            window.load_book(book)
+            return window.content_provider.status and not window.comic_mode
+        if not window.content_provider.status or window.comic_mode:
+            return False
+        if kind in (session_recorder.NEXT, session_recorder.PREVIOUS):
+            forward = kind == session_recorder.NEXT
+            chapter = window.current_chapter + (1 if forward else -1)
+            if not 0 <= chapter < window.content_provider.chapter_count:
+                return False
+            if action.get("via") == "key":
+                key = Gdk.KEY_Right if forward else Gdk.KEY_Left
+                if Gtk.test_widget_send_key(window, key, 0):
+                    return True
+                print("Could not send key, button is clicked instead")
+            header_bar = window.header_bar_component
+            button = header_bar.right_arrow_button if forward else header_bar.left_arrow_button
+            button.clicked()
+            return True
+        if kind == session_recorder.CHAPTER:
+            entry = window.header_bar_component.current_page_entry
+            entry.set_text(str(action.get("number", "")))
+            entry.activate()
+            return True
+        if kind == session_recorder.TOC:
+            return window.chapters_tree_component.choose_anchor(action.get("anchor", ""))
+        if kind == session_recorder.LINK:
+            path, hash_sign, anchor = action.get("path", "").partition("#")
+            path = os.path.join(window.content_provider.session.cache_path, path)
+            if not os.path.isfile(path):
+                return False
+            # Link is followed in the visible viewer the way a click on it is
+            window.viewer.follow_link(GLib.filename_to_uri(path, None) + hash_sign + anchor)
+            return True
+        return False
+
+    def __on_load_finished(self, viewer, frame):
+        if self.__pending is not None and viewer is self.__window.viewer_pool.active:
+            self.__settle(time.perf_counter())
+
+    def __poll(self):
+        """
+        Checks whether action finished without a load, ie. when chapter laid out ahead of time was shown
+        """
+        # Source is removed by returning False, __settle must not remove it
+        source_id = self.__poll_timeout
+        self.__poll_timeout = None
+        if self.__pending is None:
+            return False
+        window = self.__window
+        now = time.perf_counter()
+        elapsed = now - self.__pending["start"]
+        if not window.navigator.busy and window.viewer.page_finished:
+            if window.viewer is not self.__pending["viewer"]:
+                self.__settle(now)
+                return False
+            if elapsed > NO_LOAD_TIMEOUT:
+                # Nothing was loaded, ie. anchor in chapter that was already shown
+                print("Action did not load anything: ", self.__pending["action"])
+                self.__report.skipped += 1
+                self.__settle(None)
+                return False
+        if elapsed > ACTION_TIMEOUT:
+            print("Action timed out: ", self.__pending["action"])
+            self.__report.timeouts += 1
+            self.__settle(None)
+            return False
+        self.__poll_timeout = source_id
+        return True
+
+    def __settle(self, end):
+        """
+        Finishes measuring of pending action and schedules next one
+        :param end: perf_counter time page was laid out at, None when it's not measured
+        """
+        pending = self.__pending
+        self.__pending = None
+        if self.__poll_timeout is not None:
+            GLib.source_remove(self.__poll_timeout)
+            self.__poll_timeout = None
+        self.__last_latency = 0
+        if end is not None:
+            self.__last_latency = end - pending["start"]
+            self.__report.add(pending["action"], self.__last_latency * 1000)
+        self.__schedule(self.__actions[self.__index - 1])
+
+    def __schedule(self, action):
+        """
+        Waits as long as user did before next action, less the time the previous action took now
+        :param action: Action that was just done
+        """
+        think_time = 0
+        if self.__index < len(self.__actions):
+            gap = self.__actions[self.__index].get("time", 0) - action.get("time", 0)
+            think_time = min(max(0, gap - self.__last_latency), MAX_THINK_TIME)
+        GLib.timeout_add(int(think_time * 1000), self.__next_action)
+
+    def __finish(self):
+        """
+        Writes report and quits application the way user closing its window does
+        """
+        report = self.__report.to_dict()
+        report["book"] = self.__book
+        if self.__report_path:
+            with open(self.__report_path, "w", encoding="utf-8") as file:
+                json.dump(report, file, indent=2)
+        else:
+            print(json.dumps({"actions": report["actions"], "all": report["all"]}, indent=2))
+        self.__window.close()
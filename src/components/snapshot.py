@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import json
+import os
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gdk, GdkPixbuf, GLib
+
+
+class StartupSnapshot:
+    def __init__(self, path):
+        """
+        Picture of the viewer taken on exit, shown on next start until resumed chapter is laid out again
+        :param path: Directory snapshot is kept in
+        """
+        self.__image_path = os.path.join(path, "snapshot.png")
+        self.__tags_path = os.path.join(path, "snapshot.json")
+
+    def save(self, widget, tags):
+        """
+        Saves picture of what widget displays
+        :param widget: Visible widget
+        :param tags: Dictionary describing what is displayed, ie. book, chapter, position and theme
+        """
+        allocation = widget.get_allocation()
+        # Widgets without own window are placed in their parent's window
+        x, y = (0, 0) if widget.get_has_window() else (allocation.x, allocation.y)
+        pixbuf = Gdk.pixbuf_get_from_window(widget.get_window(), x, y, allocation.width, allocation.height)
+        if pixbuf is None:
+            self.discard()
+            return
+        tags = dict(tags, width=allocation.width, height=allocation.height)
+        try:
+            pixbuf.savev(self.__image_path + ".tmp", "png", [], [])
+            with open(self.__tags_path + ".tmp", "w") as file:
+                json.dump(tags, file)
+            os.replace(self.__image_path + ".tmp", self.__image_path)
+            os.replace(self.__tags_path + ".tmp", self.__tags_path)
+        except (GLib.Error, OSError) as e:
+            print("Could not save snapshot: ", e)
+            self.discard()
+
+    def load(self, tags):
+        """
+        Returns saved picture when it displays exactly what tags describe, snapshot that does not is discarded
+        :param tags: Dictionary describing what is going to be displayed, size is checked by caller against
+        size of the picture
+        :return Pixbuf or None:
+        """
+        try:
+            with open(self.__tags_path) as file:
+                saved_tags = json.load(file)
+            if {name: saved_tags.get(name) for name in tags} != tags:
+                raise ValueError("Snapshot shows something else")
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(self.__image_path)
+        except (IOError, ValueError, GLib.Error):
+            self.discard()
+            return None
+        if (pixbuf.get_width(), pixbuf.get_height()) != (saved_tags.get("width"), saved_tags.get("height")):
+            self.discard()
+            return None
+        return pixbuf
+
+    def discard(self):
+        for file_path in (self.__image_path, self.__tags_path):
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
@@ -13,12 +13,50 @@
 # Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
 # Fifth Floor, Boston, MA 02110-1301, USA.
 
+import base64
+
 import gi
 
 gi.require_version('Gtk', '3.0')
 gi.require_version('WebKit', '3.0')
+from gi.repository import Gtk
 from gi.repository import GObject
+from gi.repository import Gio, GLib
 from gi.repository import WebKit
+from components import dom_anchors
+from workers.encoding import decode_document
+from workers.scheduler import INTERACTIVE
+
+# Keeps recently visited pages laid out in memory so going back to them is instant
+WebKit.set_cache_model(WebKit.CacheModel.DOCUMENT_BROWSER)
+
+# Characters of element text kept with a bookmark
+ANCHOR_TEXT_LENGTH = 200
+
+# CSS pixels between probes looking for element at the top of visible area
+POSITION_PROBE_STEP = 20
+
+# Added on top of theme stylesheet in paginated mode, lays chapter out in columns exactly one viewer wide and high.
+# Sizes are in CSS pixels, ie. viewer size divided by zoom level.
+PAGINATION_CSS = """
+html {
+    box-sizing: border-box !important;
+    height: %(height)dpx !important;
+    padding-top: 25px !important;
+    padding-bottom: 25px !important;
+    -webkit-column-width: %(width)dpx !important;
+    -webkit-column-gap: 0 !important;
+    -webkit-column-fill: auto !important;
+}
+body {
+    margin-top: 0 !important;
+    margin-bottom: 0 !important;
+}
+img, svg, video {
+    max-width: 100% !important;
+    max-height: %(image_height)dpx !important;
+}
+"""
 
 
 class Viewer(WebKit.WebView):
@@ -39,7 +77,7 @@ class Viewer(WebKit.WebView):
         settings = self.get_settings()
         settings.props.enable_scripts = False
         settings.props.enable_plugins = False
-        settings.props.enable_page_cache = False
+        settings.props.enable_page_cache = True
         settings.props.enable_java_applet = False
         try:
             settings.props.enable_webgl = False
@@ -56,63 +94,362 @@ class Viewer(WebKit.WebView):
 
         self.connect('context-menu', self.callback)
         self.connect('load-finished', self.__on_load_finished)
+        self.connect('resource-request-starting', self.__on_resource_request_starting)
+        self.connect('navigation-policy-decision-requested', self.__on_navigation_policy_decision_requested)
         self.ignore_next_load_finished_signal = False
 
-        self.scrollable = scrollable
+        self.scrollable = None
+        self.__adjustment_handler = None
+        self.set_scrollable(scrollable)
         self.scroll_to_set = None
+        self.page_finished = False
+
+        # Pages in back / forward list are the ones kept in page cache
+        self.set_maintains_back_forward_list(True)
+        self.set_page_cache_size(int(window.config_provider.config["Application"]["pageCacheSize"]))
 
         self.__window = window
+        # Cancels cleaning up and reading of a file that is no longer wanted because another one was requested
+        self.__cancellable = None
+        self.__transform_task = None
+
+        # Theme stylesheet and, in paginated mode, size of a page
+        self.__stylesheet_path = None
+        self.__page_size = None
 
     # Load a file in the view. Will not cause a 'chapter_changed' event to be emitted.
-    def load_path(self, path, scroll_to_set = None):
+    # File is read asynchronously, it shows up once reading is done.
+    # Hidden viewers load with lower priority than the one user waits for.
+    def load_path(self, path, scroll_to_set = None, priority=INTERACTIVE):
         self.ignore_next_load_finished_signal = True
-        if scroll_to_set:
-            self.scroll_to_set = scroll_to_set
+        self.scroll_to_set = scroll_to_set
+        self.page_finished = False
+        self.__cancel_reading()
+        self.__cancellable = Gio.Cancellable()
+        file = path.split('#')[0]
+        cancellable = self.__cancellable
+        self.__transform_task = self.__window.content_provider.transform_chapter(
+            file, priority, lambda transformed_file: self.__read_file(path, transformed_file, cancellable))
+
+    def promote_loading(self):
+        """
+        Lets file that is still being cleaned up jump the queue, to be used when hidden viewer is shown
+        """
+        if self.__transform_task is not None:
+            self.__transform_task.promote(INTERACTIVE)
+
+    def __cancel_reading(self):
+        if self.__transform_task is not None:
+            self.__transform_task.cancel()
+            self.__transform_task = None
+        if self.__cancellable is not None:
+            self.__cancellable.cancel()
+            self.__cancellable = None
+
+    def __read_file(self, path, transformed_file, cancellable):
+        """
+        Reads chapter once it was cleaned up, it is displayed with uri of the original file
+        """
+        self.__transform_task = None
+        if not cancellable.is_cancelled():
+            Gio.File.new_for_path(transformed_file).load_contents_async(cancellable, self.__on_file_read,
+                                                                        (path, cancellable))
+
+    def __on_file_read(self, file, result, data):
+        """
+        Displays file once it was read, encoding is taken from the file itself and not from the locale
+        """
+        path, cancellable = data
         try:
-            file = path.split('#')[0]
-            with open(file) as file_open:
-                self.load_html_string(file_open.read(), "file://" + path)
-                print("Loaded: " + path)
-        except IOError:
-            print("Could not read: ", path)
+            success, contents, etag = file.load_contents_finish(result)
+        except GLib.Error as e:
+            if not e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.CANCELLED):
+                print("Could not read: ", path, e.message)
+            return
+        if cancellable.is_cancelled():
+            return
+        self.__cancellable = None
+        self.load_string(decode_document(contents), "text/html", "UTF-8", "file://" + path)
+        print("Loaded: " + path)
 
 
+    # Show a previously visited page, straight from page cache if WebKit still has it there.
+    # Will not cause a 'chapter_changed' event to be emitted.
+    def load_history_path(self, path, scroll_to_set):
+        uri = "file://" + path
+        back_forward_list = self.get_back_forward_list()
+        limit = back_forward_list.get_limit()
+        items = back_forward_list.get_back_list_with_limit(limit) + back_forward_list.get_forward_list_with_limit(limit)
+        for item in items:
+            if item.get_uri() == uri:
+                # Page cache restores scroll position by itself, page is not finished until it's back
+                self.page_finished = False
+                self.__cancel_reading()
+                self.ignore_next_load_finished_signal = True
+                self.scroll_to_set = None
+                self.go_to_back_forward_item(item)
+                print("Restored from page cache: " + path)
+                return
+        self.load_path(path, scroll_to_set)
+
+    def set_scrollable(self, scrollable):
+        """
+        Sets scrolled window hosting the viewer, to be called when viewer is moved to another one
+        :param scrollable:
+        """
+        if self.scrollable is not None:
+            self.scrollable.get_vadjustment().disconnect(self.__adjustment_handler[0])
+            self.scrollable.get_hadjustment().disconnect(self.__adjustment_handler[1])
+        self.scrollable = scrollable
+        # Layout keeps growing after 'load-finished', scroll is applied as soon as page is long (or wide) enough
+        self.__adjustment_handler = (
+            scrollable.get_vadjustment().connect("changed", lambda adjustment: self.__apply_scroll()),
+            scrollable.get_hadjustment().connect("changed", lambda adjustment: self.__apply_scroll()))
+
+    def cancel_loading(self):
+        """
+        Stops reading and laying out a file that is no longer wanted, viewer keeps showing what it shows
+        """
+        self.__cancel_reading()
+        self.stop_loading()
+
+    def clear(self):
+        """
+        Stops loading, shows a blank page and forgets visited pages so page cache lets go of them
+        """
+        self.cancel_loading()
+        self.scroll_to_set = None
+        self.ignore_next_load_finished_signal = True
+        self.load_uri("about:blank")
+        self.get_back_forward_list().clear()
+
+    def set_page_cache_size(self, size):
+        """
+        Sets number of recently visited pages kept in page cache
+        :param size:
+        """
+        self.get_back_forward_list().set_limit(size)
+
     def set_style_day(self):
         """
         Sets style to day CSS
         """
-        settings = self.get_settings()
-        settings.props.user_stylesheet_uri = "file:///usr/share/easy-ebook-viewer/css/day.css"
+        self.__stylesheet_path = "/usr/share/easy-ebook-viewer/css/day.css"
         # TODO: Prefix location of day.css so it can be set during install
+        self.__update_stylesheet()
 
     def set_style_night(self):
         """
         Sets style to night CSS
         """
-        settings = self.get_settings()
-        settings.props.user_stylesheet_uri = "file:///usr/share/easy-ebook-viewer/css/night.css"
+        self.__stylesheet_path = "/usr/share/easy-ebook-viewer/css/night.css"
         # TODO: Prefix location of night.css so it can be set during install
+        self.__update_stylesheet()
+
+    def set_paginated(self, page_size):
+        """
+        Switches between continuous scrolling and pages laid out side by side
+        :param page_size: (width, height) of a page in pixels, None for continuous scrolling
+        """
+        if page_size == self.__page_size:
+            return
+        self.__page_size = page_size
+        if page_size is None:
+            self.scrollable.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        else:
+            # Pages are turned, not scrolled, scrollbars would only take space from them
+            self.scrollable.set_policy(Gtk.PolicyType.EXTERNAL, Gtk.PolicyType.EXTERNAL)
+        self.__update_stylesheet()
+
+    @property
+    def paginated(self):
+        return self.__page_size is not None
+
+    @property
+    def page_count(self):
+        """
+        Returns number of pages displayed chapter takes in paginated mode
+        :return number of pages:
+        """
+        adjustment = self.scrollable.get_hadjustment()
+        if adjustment.get_page_size() <= 0:
+            return 1
+        return max(1, int(round(adjustment.get_upper() / adjustment.get_page_size())))
+
+    @property
+    def current_page(self):
+        """
+        Returns page of displayed chapter that is visible in paginated mode
+        :return page number counted from beginning of chapter:
+        """
+        adjustment = self.scrollable.get_hadjustment()
+        if adjustment.get_page_size() <= 0:
+            return 0
+        return int(round(adjustment.get_value() / adjustment.get_page_size()))
+
+    def show_page(self, page):
+        """
+        Turns to page of displayed chapter in paginated mode
+        :param page: Page number counted from beginning of chapter, negative counts from the end
+        """
+        if page < 0:
+            page += self.page_count
+        adjustment = self.scrollable.get_hadjustment()
+        adjustment.set_value(max(0, min(page, self.page_count - 1)) * adjustment.get_page_size())
+
+    def get_selection_anchors(self):
+        """
+        Returns anchors of selected text
+        :return (start path, start offset, end path, end offset, selected text) or None when nothing is selected:
+        """
+        document = self.get_dom_document()
+        if document is None or not self.has_selection():
+            return None
+        selection = document.get_default_view().get_selection()
+        if selection is None or selection.get_range_count() == 0:
+            return None
+        dom_range = selection.get_range_at(0)
+        start_path, start_offset = dom_anchors.make_anchor(document, dom_range.get_start_container(),
+                                                           dom_range.get_start_offset())
+        end_path, end_offset = dom_anchors.make_anchor(document, dom_range.get_end_container(),
+                                                       dom_range.get_end_offset())
+        return start_path, start_offset, end_path, end_offset, dom_range.to_string()
+
+    def get_position_anchor(self):
+        """
+        Returns anchor of element at the top of visible area
+        :return (path, offset, beginning of element text) or None when nothing is displayed:
+        """
+        document = self.get_dom_document()
+        if document is None or document.get_document_element() is None:
+            return None
+        zoom = self.get_zoom_level()
+        allocation = self.scrollable.get_allocation()
+        x = int(allocation.width / zoom / 2)
+        # Top of visible area may be a margin, anything inside of body is better than the whole body
+        for y in range(POSITION_PROBE_STEP, int(allocation.height / zoom), POSITION_PROBE_STEP):
+            element = document.element_from_point(x, y)
+            if element is not None and element.get_tag_name().lower() not in ("html", "body"):
+                element = dom_anchors.anchor_element(element)
+                text = " ".join((element.get_text_content() or "").split())
+                return dom_anchors.element_path(document, element), 0, text[:ANCHOR_TEXT_LENGTH]
+        return "", 0, ""
+
+    def show_anchor(self, path, offset):
+        """
+        Scrolls, or turns pages, to element anchor points to
+        :param path:
+        :param offset:
+        """
+        document = self.get_dom_document()
+        if document is None:
+            return
+        position = dom_anchors.resolve_anchor(document, path, offset)
+        if position is None:
+            return
+        dom_anchors.anchor_element(position[0]).scroll_into_view(True)
+        if self.paginated:
+            # Element may start anywhere on a page, scroll snaps back to page boundary
+            self.show_page(self.current_page)
+
+    def show_highlights(self, ranges):
+        """
+        Marks highlighted text of displayed chapter, highlights marked before are removed
+        :param ranges: List of (start path, start offset, end path, end offset)
+        """
+        document = self.get_dom_document()
+        if document is None or document.get_document_element() is None:
+            return
+        dom_anchors.unmark(document)
+        dom_anchors.mark_ranges(document, ranges)
+
+    def __update_stylesheet(self):
+        """
+        Applies theme stylesheet, in paginated mode together with column layout
+        """
+        if self.__stylesheet_path is None:
+            return
+        uri = "file://" + self.__stylesheet_path
+        if self.__page_size is not None:
+            zoom = self.get_zoom_level()
+            width, height = self.__page_size
+            css = '@import url("%s");\n' % uri + PAGINATION_CSS % {"width": width / zoom,
+                                                                    "height": height / zoom,
+                                                                    "image_height": height / zoom - 50}
+            uri = "data:text/css;charset=utf-8;base64," + base64.b64encode(css.encode("utf-8")).decode("ascii")
+        self.get_settings().props.user_stylesheet_uri = uri
 
     def callback(self, webview, context_menu, hit_result_event, event):
         self.__window.show_menu()
 
+    def __on_resource_request_starting(self, webview, frame, resource, request, response):
+        """
+        Makes sure stylesheets, images and linked chapters are extracted before WebKit reads them, obfuscated fonts
+        are read from their de-obfuscated copy
+        """
+        uri = request.get_uri()
+        if uri is not None and uri.startswith("file://"):
+            self.__window.content_provider.ensure_resource(uri)
+            resource_uri = self.__window.content_provider.resource_uri(uri)
+            if resource_uri != uri:
+                request.set_uri(resource_uri)
+
+    def follow_link(self, uri):
+        """
+        Goes to file link points to, it's loaded with load_path like any other chapter
+        :param uri: file:// URI, may end with an anchor
+        """
+        self.emit('chapter_changed', uri)
+
+    def __on_navigation_policy_decision_requested(self, webview, frame, request, action, decision):
+        """
+        Clicked links to files of the book are not followed by WebKit, file would be shown without cleaning up
+        and its DOM would differ from the one annotations were made in. Links within shown file only scroll it.
+        """
+        uri = request.get_uri()
+        if action.get_reason() != WebKit.WebNavigationReason.LINK_CLICKED or frame is not self.get_main_frame() or \
+                uri is None or not uri.startswith("file://"):
+            return False
+        current_uri = frame.get_uri()
+        if current_uri is not None and current_uri.split("#")[0] == uri.split("#")[0]:
+            return False
+        decision.ignore()
+        self.follow_link(uri)
+        return True
+
+    def __apply_scroll(self):
+        """
+        Scrolls to requested position once page is loaded and laid out far enough
+        """
+        if self.scroll_to_set is None or not self.page_finished:
+            return
+        if isinstance(self.scroll_to_set, tuple):
+            # Scroll to set is an anchor
+            self.show_anchor(*self.scroll_to_set)
+            self.scroll_to_set = None
+            return
+        if self.paginated:
+            # Scroll to set is a page number
+            page = int(self.scroll_to_set)
+            if page < 0 or page < self.page_count:
+                self.show_page(page)
+                self.scroll_to_set = None
+            return
+        adjustment = self.scrollable.get_vadjustment()
+        if adjustment.get_upper() - adjustment.get_page_size() >= float(self.scroll_to_set):
+            adjustment.set_value(float(self.scroll_to_set))
+            self.scroll_to_set = None
+
     def __on_load_finished(self, webview, event):
-        # Currently disabled, wasn't stable:
-        #
-        # if self.scroll_to_set:
-        #     print("setting scroll")
-        #     old_adjustment = self.scrollable.get_vadjustment()
-        #     old_adjustment.set_value(float(self.scroll_to_set))
-        #     print("scroll set to")
-        #     print(old_adjustment.get_value())
-        #     # self.scrollable.set_vadjustment(old_adjustment)
-        #     self.scroll_to_set = None
+        self.page_finished = True
+        self.__apply_scroll()
 
         if self.ignore_next_load_finished_signal:
             self.ignore_next_load_finished_signal = False
         else:
             self.emit('chapter_changed', event.get_uri())
 
-# The 'chapter_changed' signal is emitted when the user navigated to a different page by clicking on a link.
+# The 'chapter_changed' signal is emitted when the user clicked a link to a different page. Files of the book are
+# not loaded yet then, pages WebKit loaded by itself (ie. web pages) are reported once they are displayed.
 GObject.type_register(Viewer)
 GObject.signal_new("chapter_changed", Viewer, GObject.SIGNAL_RUN_LAST, GObject.TYPE_NONE, [GObject.TYPE_STRING])
\ No newline at end of file
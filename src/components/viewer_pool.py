@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import gi
+
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk, GLib
+from components import viewer
+from workers.scheduler import PREFETCH
+
+# Rough amount of memory taken by a WebView with a laid out chapter, used to turn memory budget into pool size
+VIEWER_MEMORY = 40 * 1024 * 1024
+
+
+class ViewerPool:
+    def __init__(self, window, scrollable, memory_budget):
+        """
+        Keeps a few Viewers around, the visible one plus hidden ones that lay out chapters ahead of the reader
+        :param window: Main application window reference, serves as communication hub
+        :param scrollable: Scrolled window hosting visible Viewer
+        :param memory_budget: Bytes pool may use, there is always at least the visible Viewer
+        """
+        self.__window = window
+        self.__scrollable = scrollable
+        self.__prerender_path = None
+
+        # The visible viewer
+        self.active = viewer.Viewer(window, scrollable)
+        scrollable.add(self.active)
+
+        # Hidden viewers live in an offscreen window, so WebKit lays them out as if they were on screen
+        self.__offscreen_window = Gtk.OffscreenWindow()
+        offscreen_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.__offscreen_window.add(offscreen_box)
+        # Least recently shown first
+        self.__spares = []
+        for i in range(max(1, memory_budget // VIEWER_MEMORY) - 1):
+            spare_scrollable = Gtk.ScrolledWindow()
+            spare_scrollable.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+            spare = viewer.Viewer(window, spare_scrollable)
+            spare_scrollable.add(spare)
+            offscreen_box.pack_start(spare_scrollable, False, False, 0)
+            self.__spares.append(spare)
+        self.__offscreen_window.show_all()
+
+        # File each viewer has loaded, None when it's unknown (ie. user followed a link)
+        self.__paths = {}
+        for pooled_viewer in self.viewers:
+            pooled_viewer.connect("chapter_changed", self.__on_chapter_changed)
+            pooled_viewer.connect("load-finished", self.__on_load_finished)
+
+    @property
+    def viewers(self):
+        """
+        Returns all viewers in pool, visible one first
+        :return list of Viewers:
+        """
+        return [self.active] + self.__spares
+
+    def connect(self, signal, handler):
+        """
+        Connects handler to a signal of every viewer, only visible viewer emits 'chapter_changed'
+        :param signal:
+        :param handler:
+        """
+        for pooled_viewer in self.viewers:
+            pooled_viewer.connect(signal, handler)
+
+    def load_path(self, path, scroll_to_set=None):
+        """
+        Shows a file, swaps in a hidden viewer instead of loading when one has it laid out already
+        :param path:
+        :param scroll_to_set:
+        """
+        if scroll_to_set is None:
+            for spare in self.__spares:
+                if self.__paths.get(spare) == path:
+                    self.__swap(spare)
+                    print("Shown prerendered: " + path)
+                    return
+        self.active.load_path(path, scroll_to_set)
+        self.__paths[self.active] = path
+
+    def load_history_path(self, path, scroll_to_set):
+        """
+        Shows a previously visited file in visible viewer
+        :param path:
+        :param scroll_to_set:
+        """
+        self.active.load_history_path(path, scroll_to_set)
+        self.__paths[self.active] = path
+
+    def prerender(self, path):
+        """
+        Lays out a file in a hidden viewer once visible viewer finished loading
+        :param path:
+        """
+        if not self.__spares or path in self.__paths.values():
+            return
+        self.__prerender_path = path
+        if self.active.page_finished:
+            GLib.idle_add(self.__start_prerender)
+
+    def cancel(self):
+        """
+        Stops loading a file into visible viewer and forgets pending prerender, both were for a chapter user
+        already went past
+        """
+        self.__prerender_path = None
+        if not self.active.page_finished:
+            self.active.cancel_loading()
+            self.__paths[self.active] = None
+
+    def clear(self):
+        """
+        Empties every viewer, to be used when book is not going to be shown again
+        """
+        self.__prerender_path = None
+        self.__paths = {}
+        for pooled_viewer in self.viewers:
+            pooled_viewer.clear()
+
+    def suspend(self):
+        """
+        Keeps page of the book that is being left laid out in a hidden viewer, together with pages in its page
+        cache and chapters prerendered for it. Least recently shown hidden viewer becomes the visible one.
+        :return state to give to restore() once book is open again, None when page could not be kept:
+        """
+        self.__prerender_path = None
+        for pooled_viewer in self.viewers:
+            if not pooled_viewer.page_finished:
+                pooled_viewer.cancel_loading()
+                self.__paths[pooled_viewer] = None
+        active = self.active
+        path = self.__paths.get(active)
+        if not self.__spares or path is None:
+            self.clear()
+            return None
+        # Page being left moves into this spare's place, same size keeps it laid out as it was shown
+        allocation = self.__scrollable.get_allocation()
+        self.__spares[0].scrollable.set_size_request(allocation.width, allocation.height)
+        self.__swap(self.__spares[0])
+        # Whatever it had laid out is not shown while another book opens
+        self.active.clear()
+        self.__paths[self.active] = None
+        return active, path
+
+    def restore(self, state):
+        """
+        Shows page a book was left at, when hidden viewer still has it laid out
+        :param state: What suspend() returned when book was left, None
+        :return True when page is shown, False when it has to be loaded:
+        """
+        if state is None:
+            return False
+        pooled_viewer, path = state
+        if pooled_viewer not in self.__spares or self.__paths.get(pooled_viewer) != path:
+            # Hidden viewer was used for something else since
+            return False
+        self.__swap(pooled_viewer)
+        return True
+
+    def forget_prerendered(self):
+        """
+        Empties hidden viewers, to be used when files they have laid out changed
+        """
+        self.__prerender_path = None
+        self.__paths = {}
+        for spare in self.__spares:
+            spare.clear()
+
+    def set_style_day(self):
+        for pooled_viewer in self.viewers:
+            pooled_viewer.set_style_day()
+
+    def set_style_night(self):
+        for pooled_viewer in self.viewers:
+            pooled_viewer.set_style_night()
+
+    def set_paginated(self, page_size):
+        for pooled_viewer in self.viewers:
+            pooled_viewer.set_paginated(page_size)
+
+    def set_page_cache_size(self, size):
+        for pooled_viewer in self.viewers:
+            pooled_viewer.set_page_cache_size(size)
+
+    def __start_prerender(self):
+        """
+        Loads pending file into least recently shown hidden viewer
+        """
+        path = self.__prerender_path
+        self.__prerender_path = None
+        if path is None or path in self.__paths.values():
+            return False
+        spare = self.__spares.pop(0)
+        self.__spares.append(spare)
+        # Same size as visible viewer so the layout can be reused as is
+        allocation = self.__scrollable.get_allocation()
+        spare.scrollable.set_size_request(allocation.width, allocation.height)
+        spare.load_path(path, priority=PREFETCH)
+        self.__paths[spare] = path
+        print("Prerendering: " + path)
+        return False
+
+    def __swap(self, spare):
+        """
+        Moves hidden viewer into visible scrolled window and visible one into its place
+        :param spare:
+        """
+        active = self.active
+        spare_scrollable = spare.scrollable
+        self.__scrollable.remove(active)
+        spare_scrollable.remove(spare)
+        self.__scrollable.add(spare)
+        spare_scrollable.add(active)
+        spare.set_scrollable(self.__scrollable)
+        active.set_scrollable(spare_scrollable)
+        spare.show()
+        spare.promote_loading()
+        self.__spares.remove(spare)
+        self.__spares.append(active)
+        self.active = spare
+
+    def __on_chapter_changed(self, emitting_viewer, uri):
+        # User followed a link, viewer shows something else than what was loaded into it
+        self.__paths[emitting_viewer] = None
+
+    def __on_load_finished(self, emitting_viewer, event):
+        if emitting_viewer is self.active and self.__prerender_path is not None:
+            GLib.idle_add(self.__start_prerender)
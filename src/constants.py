@@ -1,3 +1,3 @@
 IMPORTABLES = [".AZW", ".AZW3", ".AZW4", ".CBZ", ".CBR", ".CBC", ".CHM", ".DJVU", ".DOCX", ".EPUB", ".FB2", ".HTML", ".HTMLZ", ".LIT", ".LRF", ".MOBI",
                ".ODT", ".PDF", ".PRC", ".PDB", ".PML", ".RB", ".RTF", ".SNB", ".TCR", ".TXT", ".TXTZ"]
-NATIVE = [".EPUB"]
\ No newline at end of file
+NATIVE = [".EPUB", ".CBZ"]
\ No newline at end of file
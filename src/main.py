@@ -19,14 +19,19 @@ import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import GLib, Gio, Gtk, GObject, Gdk
 from main_window import MainWindow
-from components import about_dialog
+from components import about_dialog, session_replayer
+from workers import session_recorder
 
 
 class Application(Gtk.Application):
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, application_id="easy-ebook-viewer",
-                         flags=Gio.ApplicationFlags.HANDLES_COMMAND_LINE,
-                         **kwargs)
+        # Replayed session runs in its own instance, it must not be handed over to one user has open
+        replay_path = os.environ.get(session_recorder.REPLAY_ENVIRONMENT_VARIABLE)
+        flags = Gio.ApplicationFlags.HANDLES_COMMAND_LINE
+        if replay_path:
+            flags |= Gio.ApplicationFlags.NON_UNIQUE
+        super().__init__(*args, application_id="easy-ebook-viewer", flags=flags, **kwargs)
+        self.replay_path = replay_path
         self.window = None
         self.file_path = None
         GLib.set_application_name('Easy eBook Viewer')
@@ -57,11 +62,18 @@ class Application(Gtk.Application):
         self.window.show_all()
         if not self.window.book_loaded:
             self.window.header_bar_component.hide_jumping_navigation()
+        if self.replay_path:
+            replayer = session_replayer.SessionReplayer(
+                self.window, session_recorder.read_session(self.replay_path),
+                os.environ.get(session_recorder.REPLAY_BOOK_ENVIRONMENT_VARIABLE),
+                os.environ.get(session_recorder.REPLAY_REPORT_ENVIRONMENT_VARIABLE))
+            replayer.start()
         Gtk.main()
 
     def do_command_line(self, command_line):
         # If book came from arguments ie. was oppened using "Open with..." method etc.
-        if len(sys.argv) > 1:
+        # Replayed session opens its book itself, so opening it is measured too
+        if len(sys.argv) > 1 and not self.replay_path:
             # Check if that file really exists
             if os.path.exists(sys.argv[1]):
                 self.file_path = sys.argv[1]
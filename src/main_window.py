@@ -12,18 +12,37 @@
 # You should have received a copy of the GNU General Public Licence along with
 # Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
 # Fifth Floor, Boston, MA 02110-1301, USA.
+import sqlite3
 import threading
+import time
+import urllib.parse
 import constants
 import gi
 
 gi.require_version('Gtk', '3.0')
-from gi.repository import Gtk, Gdk, GObject
-from components import header_bar, viewer, chapters_tree, about_dialog, file_chooser, preferences_dialog
+from gi.repository import Gtk, Gdk, GObject, GLib, Gio
+from components import header_bar, viewer_pool, comic_viewer, chapters_tree, about_dialog, file_chooser, preferences_dialog
+from components import paginator, annotations_list, snapshot, navigation, opds_browser
 from workers import config_provider as config_provider_module, content_provider as content_provider_module
+from workers import comic_provider as comic_provider_module
+from workers import annotation_store as annotation_store_module
+from workers import scheduler as scheduler_module
+from workers import http_fetcher as http_fetcher_module
+from workers import session_recorder
+from workers.profiler import profiled
 import sys
 import os
 from pathlib import Path
 
+# Milliseconds after last resize before book is paginated again for new viewer size
+RESIZE_DELAY = 300
+# Viewer smaller than this in any direction is not laid out yet and is not paginated
+MINIMAL_PAGE_SIZE = 100
+# Milliseconds after last change of book file before book is reloaded, rebuilding a book writes it in many steps
+WATCH_DELAY = 500
+# Problems listed in info bar, the rest is in its tooltip
+MAX_REPORTED_PROBLEMS = 3
+
 
 class MainWindow(Gtk.ApplicationWindow):
     def __init__(self, file_path=None):
@@ -32,6 +51,8 @@ class MainWindow(Gtk.ApplicationWindow):
         self.set_border_width(0)
         self.set_default_size(800, 800)
         self.connect("destroy", self.__on_exit)
+        # Window is still on screen when it's asked to close, snapshot of the viewer is taken then
+        self.connect("delete-event", self.__on_delete)
         self.connect("key-press-event", self.__on_keypress_viewer)
 
         # Use panned to display book on the right and toggle chapter & bookmarks on the left
@@ -50,9 +71,22 @@ class MainWindow(Gtk.ApplicationWindow):
             error_dialog.run()
             exit()
 
+        # Background work of all workers runs on one pool by priority, results come back on GTK thread
+        self.scheduler = scheduler_module.Scheduler(marshal=GLib.idle_add)
+        # Catalogs, covers and downloads share pooled connections
+        self.fetcher = http_fetcher_module.HttpFetcher(self.scheduler)
+        # Navigation is recorded for replaying it later when EASY_EBOOK_VIEWER_RECORD names a file
+        self.recorder = session_recorder.SessionRecorder(os.environ.get(session_recorder.RECORD_ENVIRONMENT_VARIABLE))
+        # Catalog browser, created when it's shown for the first time
+        self.__opds_browser = None
+
         # Gets application content from ContentProvider
         self.content_provider = content_provider_module.ContentProvider(self)
 
+        # Gets comic archives content from ComicProvider, comics are displayed instead of ePubs when comic_mode is set
+        self.comic_provider = comic_provider_module.ComicProvider(self)
+        self.comic_mode = False
+
         # Creates and sets HeaderBarComponent that handles and populates Gtk.HeaderBar
         self.header_bar_component = header_bar.HeaderBarComponent(self)
         self.header_bar_component.connect("chapter_changed", self.__on_header_bar_chapter_changed)
@@ -60,11 +94,20 @@ class MainWindow(Gtk.ApplicationWindow):
         self.header_bar_component.connect("navigation_toggled", self.__on_navigation_toggled)
         self.header_bar_component.connect("preferences_clicked", self.__on_preferences_clicked)
         self.header_bar_component.connect("about_clicked", self.__on_about_clicked)
+        self.header_bar_component.connect("catalog_clicked", self.__on_catalog_clicked)
+        self.header_bar_component.connect("recent_book_clicked", lambda header_bar, path: self.load_book(path))
         self.set_titlebar(self.header_bar_component)
+        self.header_bar_component.right_arrow_button.connect(
+            "clicked", lambda button: self.recorder.record(session_recorder.NEXT, via="button"))
+        self.header_bar_component.left_arrow_button.connect(
+            "clicked", lambda button: self.recorder.record(session_recorder.PREVIOUS, via="button"))
+        self.header_bar_component.current_page_entry.connect(
+            "activate", lambda entry: self.recorder.record(session_recorder.CHAPTER, number=entry.get_text()))
 
         # Prepares scollable window to host WebKit Viewer
         self.right_scrollable_window = Gtk.ScrolledWindow()
         self.right_scrollable_window.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        self.right_scrollable_window.get_vadjustment().connect("value-changed", self.__on_scroll_changed)
         # self.right_scrollable_window.get_vscrollbar().connect("show", self.__restore_scroll_position)
         self.right_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
         self.paned.pack2(self.right_box, True, True)  # Add to right panned
@@ -72,22 +115,106 @@ class MainWindow(Gtk.ApplicationWindow):
         # Prepares scollable window to host Chapters and Bookmarks
         self.left_scrollable_window = Gtk.ScrolledWindow()
         self.left_scrollable_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        self.annotations_scrollable_window = Gtk.ScrolledWindow()
+        self.annotations_scrollable_window.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
+        # Chapters and annotations share left side, switcher on top tells which one is shown
+        self.left_stack = Gtk.Stack()
+        # Entry filtering chapters as user types sits above them
+        self.chapters_filter_entry = Gtk.SearchEntry()
+        self.chapters_filter_entry.set_placeholder_text(_("Filter chapters"))
+        self.chapters_filter_entry.connect("changed", self.__on_chapters_filter_changed)
+        chapters_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        chapters_box.pack_start(self.chapters_filter_entry, False, False, 0)
+        chapters_box.pack_start(self.left_scrollable_window, True, True, 0)
+        self.left_stack.add_titled(chapters_box, "chapters", _("Chapters"))
+        self.left_stack.add_titled(self.annotations_scrollable_window, "annotations", _("Annotations"))
+        left_stack_switcher = Gtk.StackSwitcher()
+        left_stack_switcher.set_stack(self.left_stack)
+        left_stack_switcher.set_halign(Gtk.Align.CENTER)
+        self.left_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        self.left_box.pack_start(left_stack_switcher, False, False, 0)
+        self.left_box.pack_start(self.left_stack, True, True, 0)
+
+        # Bookmarks and highlights of all books
+        try:
+            self.annotation_store = annotation_store_module.AnnotationStore(annotation_store_module.DEFAULT_PATH)
+        except (sqlite3.Error, OSError) as e:
+            # Annotations still work, they are just not kept once application is closed
+            print("Could not open annotations database: ", e)
+            self.annotation_store = annotation_store_module.AnnotationStore(":memory:")
 
-        # Adds WebKit viewer component from Viewer component
-        self.viewer = viewer.Viewer(self, self.right_scrollable_window)
+        # Adds WebKit viewer components, the visible one and hidden ones laying out next chapter ahead of time
+        self.viewer_pool = viewer_pool.ViewerPool(self, self.right_scrollable_window,
+                                                  int(self.config_provider.config["Application"]["viewerPoolMemory"])
+                                                  * 1024 * 1024)
         print("Displaying blank page.")
         self.viewer.load_uri("about:blank")  # Display a blank page
-        self.viewer.connect("chapter_changed", self.__on_viewer_chapter_changed)
-        self.right_box.pack_end(self.right_scrollable_window, True, True, 0)
+        self.viewer_pool.connect("chapter_changed", self.__on_viewer_chapter_changed)
+
+        # Every way of moving to another chapter goes through navigator, holding an arrow key loads one chapter
+        self.navigator = navigation.NavigationDispatcher(self.__preview_navigation, self.__navigate,
+                                                         self.viewer_pool.cancel)
+
+        # In paginated mode chapters are laid out in pages, page map of the book is built in the background
+        self.paginated = self.config_provider.config["Application"]["paginated"] == "True"
+        self.paginator = paginator.Paginator(self)
+        self.paginator.connect("page_map_changed", lambda paginator: self.__update_page_numbering())
+        self.__page_size = None
+        self.__pagination_timeout = None
+        # Downloaded book being prepared on a worker, None when no book is being opened
+        self.__open_task = None
+        self.right_scrollable_window.get_hadjustment().connect("value-changed", self.__on_page_turned)
+
+        # Authors rebuilding a book can have it reloaded whenever its file changes
+        self.watch_book = self.config_provider.config["Application"]["watchBook"] == "True"
+        self.__book_monitor = None
+        self.__reload_timeout = None
+
+        # Takes place of WebKit viewer when a comic is open
+        self.comic_viewer = comic_viewer.ComicViewer(self.right_scrollable_window)
+        self.__comic_page_width = 0
+        # Page and width comic viewer waits for, pages decoded for anything else are not shown
+        self.__comic_page_request = None
+        self.right_scrollable_window.connect("size-allocate", self.__on_right_scrollable_window_size_allocate)
+
+        # Picture of the page book was left at covers the viewer on start, until the page is laid out again
+        self.startup_snapshot = snapshot.StartupSnapshot(
+            os.path.expanduser(self.config_provider.config["Application"]["cacheDir"]))
+        self.snapshot_image = Gtk.Image(halign=Gtk.Align.START, valign=Gtk.Align.START)
+        self.snapshot_image.set_no_show_all(True)
+        self.right_overlay = Gtk.Overlay()
+        self.right_overlay.add(self.right_scrollable_window)
+        self.right_overlay.add_overlay(self.snapshot_image)
+        self.right_box.pack_end(self.right_overlay, True, True, 0)
+
+        # Tells about missing or damaged files found in open book without getting in the way of reading it
+        self.info_bar = Gtk.InfoBar()
+        self.info_bar.set_message_type(Gtk.MessageType.WARNING)
+        self.info_bar.set_show_close_button(True)
+        self.info_bar.connect("response", lambda info_bar, response: info_bar.hide())
+        self.info_bar_label = Gtk.Label(xalign=0)
+        self.info_bar_label.set_line_wrap(True)
+        self.info_bar_label.show()
+        self.info_bar.get_content_area().add(self.info_bar_label)
+        self.info_bar.set_no_show_all(True)
+        self.right_box.pack_start(self.info_bar, False, False, 0)
+        # Book is validated once its first chapter is displayed
+        self.viewer_pool.connect("load-finished", self.__on_viewer_load_finished)
+        # Highlights are marked in every viewer, hidden ones included
+        self.viewer_pool.connect("load-finished", self.__show_highlights)
 
         # Create Chapters List component and pack it on the left
         self.chapters_tree_component = chapters_tree.ChaptersTreeComponent()
         self.chapters_tree_component.connect("chapter_changed", self.__on_treeview_chapter_changed)
 
-        self.right_scrollable_window.add(self.viewer)
-
         self.left_scrollable_window.add(self.chapters_tree_component)
 
+        # Create Annotations List component and pack it next to chapters
+        self.annotations_list_component = annotations_list.AnnotationsListComponent()
+        self.annotations_list_component.connect("annotation_activated", self.__on_annotation_activated)
+        self.annotations_list_component.connect("annotation_removed", self.__on_annotation_removed)
+        self.annotations_scrollable_window.add(self.annotations_list_component)
+
         self.spinner = Gtk.Spinner()
         self.spinner.set_margin_top(50)
         self.spinner.set_size_request(50, 50)
@@ -100,6 +227,12 @@ class MainWindow(Gtk.ApplicationWindow):
         menu_item = Gtk.MenuItem("Copy")
         menu_item.connect("activate", self.__on_copy_activate)
         self.menu.append(menu_item)
+        self.highlight_menu_item = Gtk.MenuItem(_("Highlight"))
+        self.highlight_menu_item.connect("activate", self.__on_highlight_activate)
+        self.menu.append(self.highlight_menu_item)
+        self.bookmark_menu_item = Gtk.MenuItem(_("Add bookmark"))
+        self.bookmark_menu_item.connect("activate", self.__on_add_bookmark_activate)
+        self.menu.append(self.bookmark_menu_item)
         self.menu.show_all()
 
         # Initial book load
@@ -114,11 +247,28 @@ class MainWindow(Gtk.ApplicationWindow):
             # Reload last book
             if "lastBook" in self.config_provider.config['Application']:
                 last_book_file = Path(self.config_provider.get_last_book())
-                if last_book_file.is_file():
+                if last_book_file.exists():
                     # Load new book
                     self.load_book(self.config_provider.get_last_book())
                     self.book_loaded = True
 
+    @property
+    def viewer(self):
+        """
+        Returns Viewer that is currently visible
+        :return Viewer:
+        """
+        return self.viewer_pool.active
+
+    @property
+    def history(self):
+        """
+        Returns back / forward navigation of open book
+        :return History or None if no book is open:
+        """
+        session = self.content_provider.session
+        return session.history if session is not None else None
+
     @property
     def __scroll_position(self):
         """
@@ -141,10 +291,74 @@ class MainWindow(Gtk.ApplicationWindow):
         """
 
         # Save book data
-        if self.content_provider.status:
+        self.__save_position()
+        self.content_provider.downloads.cancel()
+        self.scheduler.shutdown()
+        self.fetcher.close()
+        self.recorder.close()
+        report = self.scheduler.report()
+        if report:
+            print(report)
+
+    def __on_delete(self, window, event):
+        self.__save_snapshot()
+        return False
+
+    @property
+    def __snapshot_tags(self):
+        """
+        Returns what the snapshot of the viewer shows, apart from its size
+        :return dictionary:
+        """
+        position = self.viewer.current_page if self.viewer.paginated else self.__scroll_position
+        return {"book": self.content_provider.book_md5,
+                "chapter": self.current_chapter,
+                "position": position,
+                "theme": self.config_provider.config["Application"]["stylesheet"],
+                "paginated": self.viewer.paginated,
+                "zoom": self.viewer.get_zoom_level()}
+
+    def __save_snapshot(self):
+        """
+        Takes picture of displayed page to be shown on next start
+        """
+        if self.snapshot_image.get_visible():
+            # Page was not laid out yet, snapshot from last time still shows it
+            return
+        if self.comic_mode or not self.content_provider.status or not self.viewer.page_finished:
+            self.startup_snapshot.discard()
+        else:
+            self.startup_snapshot.save(self.right_scrollable_window, self.__snapshot_tags)
+
+    def __show_snapshot(self, chapter, position):
+        """
+        Covers viewer with picture of the page it's going to display, if there is a picture of it
+        :param chapter: Chapter that is going to be displayed
+        :param position: Scroll position, or page in paginated mode, that is going to be displayed
+        """
+        tags = dict(self.__snapshot_tags, chapter=chapter, position=position, paginated=self.paginated)
+        pixbuf = self.startup_snapshot.load(tags)
+        if pixbuf is not None:
+            self.snapshot_image.set_from_pixbuf(pixbuf)
+            self.snapshot_image.show()
+
+    def __hide_snapshot(self):
+        if self.snapshot_image.get_visible():
+            self.snapshot_image.hide()
+            self.snapshot_image.clear()
+        return False
+
+    def __save_position(self):
+        """
+        Saves chapter and scroll position of open book
+        """
+        if self.comic_mode:
+            self.config_provider.save_chapter_position(self.comic_provider.book_md5, self.current_chapter, 0.0)
+        elif self.content_provider.status:
             self.config_provider.save_chapter_position(self.content_provider.book_md5,
                                                        self.current_chapter,
-                                                       self.__scroll_position)
+                                                       self.__scroll_position,
+                                                       self.viewer.current_page if self.viewer.paginated else 0)
 
     # There are 4 ways a navigation action can be initiated:
     #
@@ -154,55 +368,309 @@ class MainWindow(Gtk.ApplicationWindow):
     #      -> when the left/right button is clicked in the header bar, or
     #      -> when a new chapter number is entered followed by 'enter'
     #  3. The Viewer emitting a 'chapter_changed' event
-    #      -> when the user clicks a link
+    #      -> when the user clicks a link, before the file it points to is loaded
     #  4. By pressing the Left/Right arrow keys on the keyboard
     #
     # The handlers for those events are below:
 
     def __on_header_bar_chapter_changed(self, header_bar, chapter_number):
+        if self.comic_mode:
+            self.__show_comic_page(chapter_number)
+            return
+        if not self.content_provider.status:
+            return
+        chapter_page = None
+        if self.__page_numbering:
+            # Header bar counts pages, not chapters
+            chapter_number, chapter_page = self.paginator.page_map.locate(chapter_number)
+            if chapter_number == self.current_chapter and not self.navigator.busy:
+                self.viewer.show_page(chapter_page)
+                return
         chapter_file = self.content_provider.get_chapter_file_path(chapter_number)
-        self.chapters_tree_component.select_chapter(chapter_number)
-        self.viewer.load_path(chapter_file)
-        self.current_chapter = chapter_number
+        self.navigator.navigate(navigation.NavigationRequest(chapter_number, chapter_file, chapter_page))
 
     def __on_treeview_chapter_changed(self, treeview, chapter_number, navpoint):
+        if not self.content_provider.status or self.comic_mode:
+            return
+        self.recorder.record(session_recorder.TOC, anchor=navpoint.content, chapter=navpoint.file_number)
         chapter_file = self.content_provider.complete_chapter_file_path(navpoint.content)
-        self.header_bar_component.select_chapter(navpoint.file_number)
-        self.viewer.load_path(chapter_file)
-        self.current_chapter = navpoint.file_number
+        self.navigator.navigate(navigation.NavigationRequest(navpoint.file_number, chapter_file,
+                                                             tree_selection=navigation.SELECT_NOTHING))
+
+    def __on_chapters_filter_changed(self, entry):
+        self.chapters_tree_component.filter(entry.get_text())
+        # Current chapter gets selected again if filter left it shown
+        if self.content_provider.status and not self.comic_mode:
+            self.chapters_tree_component.select_chapter(self.current_chapter)
 
     def __on_viewer_chapter_changed(self, viewer, uri):
-        if not uri == "about:blank":
+        if not uri == "about:blank" and self.content_provider.status:
             chapter_number = self.content_provider.uri_to_chapter(uri)
+            if chapter_number is None:
+                # Files outside reading order (ie. footnotes, images) and web pages are shown within the chapter that
+                # linked them, it stays current one in header bar and history
+                chapter_number = self.current_chapter
+            path = urllib.parse.unquote(uri[len("file://"):]) if uri.startswith("file://") else uri
+            if self.recorder.enabled and uri.startswith("file://"):
+                # Book is extracted elsewhere when session is replayed, link is recorded relative to it
+                parts = urllib.parse.urlsplit(uri)
+                link = os.path.relpath(urllib.parse.unquote(parts.path), self.content_provider.session.cache_path)
+                self.recorder.record(session_recorder.LINK, path=link + ("#" + parts.fragment if parts.fragment else ""))
+            # Files of the book are loaded like any other chapter, cleaned up, only other pages are displayed already
+            self.navigator.navigate(navigation.NavigationRequest(chapter_number, path,
+                                                                 displayed=not uri.startswith("file://"),
+                                                                 tree_selection=navigation.SELECT_URI,
+                                                                 push_history=uri.startswith("file://")))
+
+    # Going back and forward in history is the fifth way, it's initiated by Alt+Left / Alt+Right
+
+    def __on_history_navigation(self, entry):
+        """
+        Displays page from history at the scroll position it was left at
+        :param entry: HistoryEntry to display
+        """
+        # Page number is kept in paginated mode, scroll position otherwise, entry left in the other mode starts over
+        scroll = entry.scroll
+        if self.viewer.paginated != (type(scroll) is int):
+            scroll = 0 if self.viewer.paginated else 0.0
+        self.navigator.navigate(navigation.NavigationRequest(entry.chapter, entry.path, scroll,
+                                                             tree_selection=navigation.SELECT_URI,
+                                                             history_entry=entry))
+
+    def __preview_navigation(self, request):
+        """
+        Shows where navigation is going right away, even when chapter itself is loaded later
+        :param request: NavigationRequest
+        """
+        chapter_page = request.scroll_to_set if type(request.scroll_to_set) is int else 0
+        self.__select_in_header_bar(request.chapter, chapter_page)
+        self.current_chapter = request.chapter
+
+    def __navigate(self, request):
+        """
+        Displays chapter navigator decided on, the one user ended up at
+        :param request: NavigationRequest
+        """
+        if not self.content_provider.status or self.comic_mode:
+            return
+        if request.tree_selection == navigation.SELECT_CHAPTER:
+            self.chapters_tree_component.select_chapter(request.chapter)
+        elif request.tree_selection == navigation.SELECT_URI:
+            self.chapters_tree_component.select_uri(request.path)
+        if request.history_entry is not None:
+            self.viewer_pool.load_history_path(request.path, request.scroll_to_set)
+        elif not request.displayed:
+            self.viewer_pool.load_path(request.path, request.scroll_to_set)
+        if request.push_history:
+            self.history.push(request.chapter, request.path)
+        self.__prerender_next_chapter()
+
+    def __prerender_next_chapter(self):
+        """
+        Lets a hidden viewer lay out chapter following the current one
+        """
+        if self.current_chapter is not None and self.current_chapter + 1 < self.content_provider.chapter_count:
+            self.viewer_pool.prerender(self.content_provider.get_chapter_file_path(self.current_chapter + 1))
+
+    def __on_scroll_changed(self, adjustment):
+        """
+        Remembers scroll position of current page in history
+        :param adjustment:
+        """
+        # Scroll jumps around while next page is loading, that's not where the user left previous page
+        if self.history is not None and self.viewer.page_finished and not self.viewer.paginated:
+            self.history.set_scroll(adjustment.get_value())
+
+    @property
+    def __page_numbering(self):
+        """
+        Tells if header bar counts pages of whole book instead of chapters
+        :return True in paginated mode once page map is complete:
+        """
+        return (not self.comic_mode and self.viewer.paginated and self.paginator.page_map is not None
+                and self.paginator.page_map.complete)
+
+    def __select_in_header_bar(self, chapter_number, chapter_page=0):
+        """
+        Shows chapter, or page of book in paginated mode, in header bar
+        :param chapter_number:
+        :param chapter_page: Page counted from beginning of chapter
+        """
+        if self.__page_numbering:
+            if chapter_page < 0:
+                # Negative pages count from the end of chapter
+                chapter_page = max(self.paginator.page_map.chapter_pages[chapter_number] + chapter_page, 0)
+            self.header_bar_component.select_chapter(self.paginator.page_map.page_of(chapter_number, chapter_page))
+        else:
             self.header_bar_component.select_chapter(chapter_number)
-            self.chapters_tree_component.select_uri(uri)
-            self.current_chapter = chapter_number
+
+    def __update_page_numbering(self):
+        """
+        Switches header bar between counting chapters and pages
+        """
+        if self.comic_mode or not self.content_provider.status:
+            return
+        if self.__page_numbering:
+            self.header_bar_component.set_chapter_count(self.paginator.page_map.page_count)
+            self.__select_in_header_bar(self.current_chapter, self.viewer.current_page)
+        else:
+            self.header_bar_component.set_chapter_count(self.content_provider.chapter_count)
+            self.header_bar_component.select_chapter(self.current_chapter)
+
+    def __on_page_turned(self, adjustment):
+        if not self.viewer.page_finished:
+            return
+        # Page is remembered in history the way scroll position is in continuous mode
+        if self.history is not None and self.viewer.paginated:
+            self.history.set_scroll(self.viewer.current_page)
+        if self.__page_numbering:
+            self.__select_in_header_bar(self.current_chapter, self.viewer.current_page)
+
+    def set_paginated(self, paginated):
+        """
+        Switches between continuous scrolling and paginated mode
+        :param paginated: True to lay chapters out in pages
+        """
+        self.paginated = paginated
+        self.update_pagination()
+
+    def update_pagination(self):
+        """
+        Lays chapters out in pages as big as the viewer and starts building page map, to be called whenever
+        book, viewer size, zoom or theme changes
+        """
+        self.__pagination_timeout = None
+        allocation = self.right_scrollable_window.get_allocation()
+        if not self.paginated or self.comic_mode or not self.content_provider.status:
+            self.__page_size = None
+            self.viewer_pool.set_paginated(None)
+            self.paginator.stop()
+        # Window is not laid out yet, size-allocate will be back with real size
+        elif allocation.width >= MINIMAL_PAGE_SIZE and allocation.height >= MINIMAL_PAGE_SIZE:
+            self.__page_size = (allocation.width, allocation.height)
+            self.viewer_pool.set_paginated(self.__page_size)
+            self.paginator.start(self.content_provider.session.content_version,
+                                 [self.content_provider.get_chapter_file_path(i)
+                                  for i in range(self.content_provider.chapter_count)],
+                                 self.__page_size, self.viewer.get_zoom_level(),
+                                 self.config_provider.config["Application"]["stylesheet"])
+        self.__update_page_numbering()
+        return False
 
     def __on_keypress_viewer(self, wiget, data):
         """
-        Handles Left and Right arrow key presses
+        Handles Left and Right arrow key presses, with Alt moves back and forward in history
         :param wiget:
         :param data:
         """
+        # Arrow keys move cursor in chapters filter while user types into it
+        if self.chapters_filter_entry.has_focus():
+            return
+
+        if self.comic_mode:
+            key_value = Gdk.keyval_name(data.keyval)
+            if key_value == "Right" and self.current_chapter + 1 < self.comic_provider.page_count:
+                self.header_bar_component.select_chapter(self.current_chapter + 1)
+                self.__show_comic_page(self.current_chapter + 1)
+            elif key_value == "Left" and self.current_chapter > 0:
+                self.header_bar_component.select_chapter(self.current_chapter - 1)
+                self.__show_comic_page(self.current_chapter - 1)
+            return
+
         if self.content_provider.status:
             chapter = -1
             key_value = Gdk.keyval_name(data.keyval)
+            if data.state & Gdk.ModifierType.MOD1_MASK and key_value in ("Left", "Right"):
+                entry = self.history.back() if key_value == "Left" else self.history.forward()
+                if entry is not None:
+                    self.__on_history_navigation(entry)
+                return
+            chapter_page = None
+            # While arrow key is held, pages of chapters that are skipped over are not turned
+            turn_page = self.viewer.paginated and not self.navigator.busy
             if key_value == "Right":
+                # In paginated mode next chapter comes after last page of current one
+                if turn_page and self.viewer.current_page + 1 < self.viewer.page_count:
+                    self.viewer.show_page(self.viewer.current_page + 1)
+                    return
                 chapter = self.current_chapter + 1
                 if chapter >= self.content_provider.chapter_count:
                     return
             elif key_value == "Left":
+                if turn_page and self.viewer.current_page > 0:
+                    self.viewer.show_page(self.viewer.current_page - 1)
+                    return
                 chapter = self.current_chapter - 1
                 if chapter < 0:
                     return
+                if self.viewer.paginated:
+                    chapter_page = -1
             else:
                 return
 
-        self.header_bar_component.select_chapter(chapter)
-        self.chapters_tree_component.select_chapter(chapter)
-        chapter_file = self.content_provider.get_chapter_file_path(chapter)
-        self.viewer.load_path(chapter_file)
-        self.current_chapter = chapter
+            self.recorder.record(session_recorder.NEXT if key_value == "Right" else session_recorder.PREVIOUS,
+                                 via="key")
+            chapter_file = self.content_provider.get_chapter_file_path(chapter)
+            self.navigator.navigate(navigation.NavigationRequest(chapter, chapter_file, chapter_page))
+
+    def __show_comic_page(self, page_number):
+        """
+        Displays comic page, pages around it are decoded in the background
+        :param page_number:
+        """
+        width = self.comic_viewer.page_width
+        self.__comic_page_request = (page_number, width)
+        # Previous page stays shown while page that was not decoded ahead of time is decoded
+        pixbuf = self.comic_provider.get_page(page_number, width,
+                                              lambda page: self.__on_comic_page_decoded(page_number, width, page))
+        if pixbuf is not None:
+            self.comic_viewer.show_page(pixbuf)
+        self.__comic_page_width = width
+        self.current_chapter = page_number
+
+    def __on_comic_page_decoded(self, page_number, width, pixbuf):
+        """
+        Displays comic page decoded in the background, unless user went on to another page meanwhile
+        """
+        if self.comic_mode and self.__comic_page_request == (page_number, width):
+            self.comic_viewer.show_page(pixbuf)
+
+    def __on_right_scrollable_window_size_allocate(self, widget, allocation):
+        # Snapshot taken at another window size does not show what will be displayed
+        pixbuf = self.snapshot_image.get_pixbuf()
+        if self.snapshot_image.get_visible() and pixbuf is not None and \
+                (pixbuf.get_width(), pixbuf.get_height()) != (allocation.width, allocation.height):
+            GLib.idle_add(self.__hide_snapshot)
+            self.startup_snapshot.discard()
+        # Comic pages are scaled to window width
+        if self.comic_mode and self.comic_viewer.page_width != self.__comic_page_width:
+            self.__comic_page_width = self.comic_viewer.page_width
+            GLib.idle_add(self.__refresh_comic_page)
+        # Pages are as big as the viewer, book is paginated again once resizing stops
+        elif self.paginated and (allocation.width, allocation.height) != self.__page_size:
+            if self.__pagination_timeout is not None:
+                GLib.source_remove(self.__pagination_timeout)
+            self.__pagination_timeout = GLib.timeout_add(RESIZE_DELAY, self.update_pagination)
+
+    def __refresh_comic_page(self):
+        self.__show_comic_page(self.current_chapter)
+        return False
+
+    def __set_comic_mode(self, comic_mode):
+        """
+        Swaps WebKit viewer and comic viewer
+        :param comic_mode: True to display comics
+        """
+        if comic_mode == self.comic_mode:
+            return
+        if comic_mode:
+            self.right_scrollable_window.remove(self.viewer)
+            self.right_scrollable_window.add(self.comic_viewer)
+        else:
+            self.right_scrollable_window.remove(self.comic_viewer)
+            self.right_scrollable_window.add(self.viewer)
+        self.right_scrollable_window.show_all()
+        self.comic_mode = comic_mode
 
     def __on_open_clicked(self, widget):
         # Loads file chooser component
@@ -213,12 +681,45 @@ class MainWindow(Gtk.ApplicationWindow):
             print("File selected: " + filename)
             self.load_book(filename)
 
+    def __on_catalog_clicked(self, widget):
+        if self.__opds_browser is None:
+            self.__opds_browser = opds_browser.OpdsBrowserWindow(self)
+            self.__opds_browser.connect("book_chosen", self.__on_catalog_book_chosen)
+        self.__opds_browser.show_catalog()
+
+    def __on_catalog_book_chosen(self, browser, url):
+        """
+        Starts downloading book, it's opened as soon as its beginning is known
+        :param browser:
+        :param url: URL of book
+        """
+        print("Book chosen: " + url)
+
+        def open_download():
+            try:
+                return self.content_provider.downloads.open(url)
+            except OSError as e:
+                print("Could not download: ", url, e)
+                return None
+
+        self.scheduler.submit(open_download, scheduler_module.INTERACTIVE, on_finished=self.__on_download_opened)
+
+    def __on_download_opened(self, download):
+        if download is None:
+            error_dialog = Gtk.MessageDialog(self, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.OK,
+                                             _("Could not download the book."))
+            error_dialog.format_secondary_text(_("Make sure the catalog can be reached and try again."))
+            error_dialog.run()
+            error_dialog.destroy()
+            return
+        self.load_book(download.path, download)
+
     def __on_navigation_toggled(self, widget, is_active):
         if is_active:
-            self.paned.pack1(self.left_scrollable_window, False, False)  # Add to right panned
+            self.paned.pack1(self.left_box, False, False)  # Add to right panned
             self.paned.show_all()
         else:
-            self.paned.remove(self.left_scrollable_window)
+            self.paned.remove(self.left_box)
             self.paned.show_all()
 
     def __on_about_clicked(self, widget):
@@ -234,10 +735,10 @@ class MainWindow(Gtk.ApplicationWindow):
         """
         self.settings = Gtk.Settings.get_default()
         if self.config_provider.config["Application"]["stylesheet"] == "Day":
-            self.viewer.set_style_day()
+            self.viewer_pool.set_style_day()
             self.settings.set_property("gtk-application-prefer-dark-theme", False)
         else:
-            self.viewer.set_style_night()
+            self.viewer_pool.set_style_night()
             self.settings.set_property("gtk-application-prefer-dark-theme", True)
 
     def __on_copy_activate(self, widget):
@@ -251,11 +752,22 @@ class MainWindow(Gtk.ApplicationWindow):
         # Can get selection from anywhere in the system, no real way to tell
         selection_clipboard.set_text(primary_selection.wait_for_text(), -1)
 
-    def load_book(self, filename):
+    @profiled("load_book")
+    def load_book(self, filename, download=None):
         """
         Loads book to Viwer and moves to correct chapter and scroll position
         :param filename:
+        :param download: Download of book from catalog, book is opened while it downloads
         """
+        self.recorder.record(session_recorder.OPEN, book=os.path.abspath(filename))
+        start = time.perf_counter()
+        # Content provider opens one book at a time, downloaded book still being prepared is given up on
+        if self.__open_task is not None:
+            self.__open_task.cancel()
+            self.__open_task.wait()
+            self.__open_task = None
+        # Previous book is reopened at the same place when switched back to
+        self.__save_position()
         self.spinner.start()
         self.viewer.hide()
         self.right_box.add(self.spinner)
@@ -263,16 +775,92 @@ class MainWindow(Gtk.ApplicationWindow):
         self.spinner.stop()
         self.viewer.show()
         self.right_box.remove(self.spinner)
-         # Try to load book, returns true when book loaded without errors
-        if self.content_provider.prepare_book(filename):
-            # If book loaded without errors
+        self.navigator.clear()
+        # Page of previous book stays laid out in a hidden viewer, with its page cache and prerendered chapters,
+        # switching back to the book shows it right away
+        if self.content_provider.session is not None and not self.comic_mode:
+            self.content_provider.session.views["viewer_pool"] = self.viewer_pool.suspend()
+        self.info_bar.hide()
+        self.__hide_snapshot()
+        # Comic archives are zip files of images, they don't need to be extracted
+        if download is None and self.comic_provider.prepare_book(filename):
+            self.__set_comic_mode(True)
+            self.content_provider.suspend_book()
+            self.update_pagination()
+            self.chapters_tree_component.clear_treeview()
+            self.annotations_list_component.set_annotations_model(annotations_list.AnnotationsModel())
+            recent_page = int(self.config_provider.config[self.comic_provider.book_md5]["chapter"])
+            if not 0 <= recent_page < self.comic_provider.page_count:
+                recent_page = 0
+            self.header_bar_component.set_chapter_count(self.comic_provider.page_count)
+            self.header_bar_component.select_chapter(recent_page)
+            self.header_bar_component.set_title(self.comic_provider.book_name)
+            self.header_bar_component.set_subtitle("")
+            self.__show_comic_page(recent_page)
+            self.__watch_book()
+            self.config_provider.save_last_book(self.filename)
+            self.__update_recent_books()
+        elif download is not None:
+            # Book that is still downloading is read over the network, window must not wait for it
+            self.__set_comic_mode(False)
+            self.content_provider.suspend_book()
+            self.update_pagination()
+            self.chapters_tree_component.clear_treeview()
+            self.header_bar_component.clear()
+            self.__open_task = self.scheduler.submit(
+                lambda: self.__prepare_download(filename, download), scheduler_module.INTERACTIVE,
+                on_finished=lambda prepared: self.__show_book(prepared, start))
+        else:
+            self.__show_book(self.content_provider.prepare_book(filename), start)
+
+    def __prepare_download(self, filename, download):
+        """
+        Prepares book that is opened while it downloads, runs on a worker thread
+        :return True when book loaded successfully:
+        """
+        try:
+            return self.content_provider.prepare_book(filename, download)
+        except Exception as e:
+            print("Could not open: ", filename, e)
+            return False
 
-            # Update chapter list
-            self.chapters_tree_component.reload_treeview(self.content_provider.index)
+    def __show_book(self, prepared, start):
+        """
+        Displays ePub content provider prepared, or tells user it could not be opened
+        :param prepared: True when book loaded without errors
+        :param start: perf_counter time opening started at
+        """
+        self.__open_task = None
+        if prepared:
+            self.__set_comic_mode(False)
+
+            # Update chapter list, book opened recently has it built already
+            session = self.content_provider.session
+            if "chapters" in session.views:
+                self.chapters_tree_component.set_chapters_model(session.views["chapters"])
+            else:
+                session.views["chapters"] = self.chapters_tree_component.reload_treeview(session.index)
+            if "annotations" not in session.views:
+                session.views["annotations"] = annotations_list.AnnotationsModel(
+                    self.annotation_store.book_annotations(session.book_md5))
+            self.annotations_list_component.set_annotations_model(session.views["annotations"])
+
+            # Book opened recently may have been validated already
+            if session.validator is not None and session.validator.report is not None:
+                self.__show_validation_report(session, session.validator.report)
 
-            # Load recent chapter and scroll
+            # Load recent chapter and scroll, chapters that are missing in archive are not counted
             recent_chapter = int(self.config_provider.config[self.content_provider.book_md5]["chapter"])
+            if not 0 <= recent_chapter < self.content_provider.chapter_count:
+                recent_chapter = 0
             recent_scroll = float(self.config_provider.config[self.content_provider.book_md5]["position"])
+            if self.paginated:
+                # Position in paginated mode is a page of chapter
+                recent_scroll = int(self.config_provider.config[self.content_provider.book_md5].get("page", "0"))
+
+            # On start, picture of the page is shown until it is laid out
+            if not self.book_loaded:
+                self.__show_snapshot(recent_chapter, recent_scroll)
 
             recent_file = self.content_provider.files[recent_chapter]
             recent_path = self.content_provider.complete_chapter_file_path(recent_file)
@@ -281,7 +869,13 @@ class MainWindow(Gtk.ApplicationWindow):
             self.header_bar_component.set_chapter_count(self.content_provider.chapter_count)
             self.header_bar_component.select_chapter(recent_chapter)
             self.chapters_tree_component.select_chapter(recent_chapter)
-            self.viewer.load_path(recent_path, recent_scroll)
+            self.update_pagination()
+            if self.viewer_pool.restore(session.views.pop("viewer_pool", None)):
+                print("Showed page of hot book in %.1f ms" % ((time.perf_counter() - start) * 1000))
+            else:
+                self.viewer_pool.load_path(recent_path, recent_scroll)
+            self.history.push(recent_chapter, recent_path)
+            self.__prerender_next_chapter()
 
             # Open book on viewer
             self.header_bar_component.set_title(self.content_provider.book_name)
@@ -290,8 +884,20 @@ class MainWindow(Gtk.ApplicationWindow):
             # Show to bar pages jumping navigation
             self.header_bar_component.hide_jumping_navigation()
 
+            self.__watch_book()
+
             self.config_provider.save_last_book(self.filename)
+            self.__update_recent_books()
         else:
+            # Previous book was put away, nothing is left to navigate in until another book is opened
+            self.__set_comic_mode(False)
+            self.update_pagination()
+            self.chapters_tree_component.clear_treeview()
+            self.annotations_list_component.set_annotations_model(annotations_list.AnnotationsModel())
+            self.header_bar_component.clear()
+            self.current_chapter = 0
+            self.__watch_book()
+
             # If book could not be loaded display dialog
             # TODO: Migrate to custom dialog designed in line with elementary OS Human Interface Guidelines
             error_dialog = Gtk.MessageDialog(self, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.OK,
@@ -301,9 +907,225 @@ class MainWindow(Gtk.ApplicationWindow):
             error_dialog.run()
             error_dialog.destroy()
 
+    def set_watch_book(self, watch_book):
+        """
+        Turns reloading of open book whenever its file changes on or off
+        :param watch_book:
+        """
+        self.watch_book = watch_book
+        self.__watch_book()
+
+    def __watch_book(self):
+        """
+        Starts monitoring file of open book, monitor of previous book is stopped
+        """
+        if self.__book_monitor is not None:
+            self.__book_monitor.cancel()
+            self.__book_monitor = None
+        if self.watch_book and not self.comic_mode and self.content_provider.status and \
+                not self.content_provider.session.unpacked and self.content_provider.session.download is None:
+            book_file = Gio.File.new_for_path(self.content_provider.session.file_path)
+            self.__book_monitor = book_file.monitor_file(Gio.FileMonitorFlags.NONE, None)
+            self.__book_monitor.connect("changed", self.__on_book_file_changed)
+
+    def __on_book_file_changed(self, monitor, file, other_file, event_type):
+        if event_type == Gio.FileMonitorEvent.DELETED:
+            # Book is being replaced, file shows up again once it's written
+            return
+        if self.__reload_timeout is not None:
+            GLib.source_remove(self.__reload_timeout)
+        self.__reload_timeout = GLib.timeout_add(WATCH_DELAY, self.__reload_book)
+
+    def __reload_book(self):
+        """
+        Updates open book to new version of its file, keeps reading position. Chapter being read is displayed
+        again only when it or a file it links to changed.
+        """
+        self.__reload_timeout = None
+        if self.comic_mode or not self.content_provider.status:
+            return False
+        # Chapter navigator was about to load is loaded from new version of the book instead
+        navigating = self.navigator.busy
+        self.navigator.clear()
+        old_md5 = self.content_provider.book_md5
+        old_files = list(self.content_provider.files)
+        old_file = old_files[self.current_chapter]
+        scroll = self.viewer.current_page if self.viewer.paginated else self.__scroll_position
+        changed = self.content_provider.reload_book()
+        if not changed:
+            return False
+        session = self.content_provider.session
+
+        # Annotations and chapters index follow the book, annotations are kept with their chapter file and not with
+        # its position in reading order
+        chapters = {}
+        for old_chapter, chapter_file in enumerate(old_files):
+            if chapter_file in self.content_provider.files:
+                chapters[old_chapter] = self.content_provider.files.index(chapter_file)
+        left_behind = self.annotation_store.move_book(old_md5, session.book_md5, chapters)
+        if left_behind:
+            print("Annotations of chapters that are gone were not moved: %d" % left_behind)
+        if "chapters" in session.views:
+            self.chapters_tree_component.set_chapters_model(session.views["chapters"])
+        elif session.index is not None:
+            session.views["chapters"] = self.chapters_tree_component.reload_treeview(session.index)
+        else:
+            self.chapters_tree_component.clear_treeview()
+        session.views["annotations"] = annotations_list.AnnotationsModel(
+            self.annotation_store.book_annotations(session.book_md5))
+        self.annotations_list_component.set_annotations_model(session.views["annotations"])
+
+        # Chapter being read may have moved in reading order or may be gone
+        chapter_moved = navigating
+        if self.content_provider.files[self.current_chapter:self.current_chapter + 1] != [old_file]:
+            chapter_moved = True
+            if old_file in self.content_provider.files:
+                self.current_chapter = self.content_provider.files.index(old_file)
+            else:
+                self.current_chapter = 0
+                scroll = 0
+
+        self.header_bar_component.set_title(self.content_provider.book_name)
+        self.header_bar_component.set_subtitle(self.content_provider.book_author)
+        self.header_bar_component.set_chapter_count(self.content_provider.chapter_count)
+        self.header_bar_component.select_chapter(self.current_chapter)
+        self.chapters_tree_component.select_chapter(self.current_chapter)
+        self.info_bar.hide()
+        self.viewer_pool.forget_prerendered()
+        self.update_pagination()
+        if chapter_moved or self.content_provider.chapter_needs(self.current_chapter, changed):
+            chapter_file = self.content_provider.get_chapter_file_path(self.current_chapter)
+            self.viewer_pool.load_path(chapter_file, scroll)
+            self.history.push(self.current_chapter, chapter_file)
+        else:
+            self.content_provider.validate(lambda report: self.__show_validation_report(session, report))
+        self.__prerender_next_chapter()
+        self.__save_position()
+        return False
+
+    def __on_viewer_load_finished(self, viewer, frame):
+        if viewer is not self.viewer or self.comic_mode or not self.content_provider.status:
+            return
+        if frame.get_uri() == "about:blank":
+            return
+        # Layout may still be adjusting scroll, snapshot goes away once that's done
+        GLib.idle_add(self.__hide_snapshot)
+        session = self.content_provider.session
+        self.content_provider.validate(lambda report: self.__show_validation_report(session, report))
+
+    def __show_validation_report(self, session, report):
+        """
+        Displays problems found in book in info bar
+        :param session: BookSession that was validated
+        :param report: ValidationReport
+        """
+        if session is not self.content_provider.session or report.valid:
+            return False
+        text = _("Some files of this book are missing or damaged, it may not display correctly.")
+        text += "\n" + "\n".join(report.problems[:MAX_REPORTED_PROBLEMS])
+        if len(report.problems) > MAX_REPORTED_PROBLEMS:
+            text += "\n" + _("And %d more.") % (len(report.problems) - MAX_REPORTED_PROBLEMS)
+        self.info_bar_label.set_text(text)
+        self.info_bar_label.set_tooltip_text("\n".join(report.problems))
+        self.info_bar.show()
+        return False
+
+    def __show_highlights(self, viewer, frame):
+        """
+        Marks highlights of chapter viewer finished loading
+        """
+        if self.comic_mode or not self.content_provider.status:
+            return
+        uri = frame.get_uri()
+        if uri is None or not uri.startswith("file://"):
+            return
+        chapter = self.content_provider.uri_to_chapter(uri)
+        if chapter is None:
+            return
+        ranges = [(annotation.start_path, annotation.start_offset, annotation.end_path, annotation.end_offset)
+                  for annotation in self.annotation_store.chapter_annotations(self.content_provider.book_md5,
+                                                                              chapter)
+                  if annotation.kind == annotation_store_module.HIGHLIGHT]
+        # Chapter restored from page cache has its marks already
+        if ranges:
+            viewer.show_highlights(ranges)
+
+    def __refresh_highlights(self):
+        """
+        Marks highlights again in every viewer, to be used when a highlight is added or removed
+        """
+        for pooled_viewer in self.viewer_pool.viewers:
+            if pooled_viewer.page_finished and pooled_viewer.get_main_frame().get_uri() is not None:
+                pooled_viewer.show_highlights([])
+                self.__show_highlights(pooled_viewer, pooled_viewer.get_main_frame())
+
+    @property
+    def __can_annotate(self):
+        """
+        Tells if viewer shows current chapter itself, annotations can't be made in files outside reading order
+        :return True if annotations of current chapter can be added:
+        """
+        if self.current_chapter is None:
+            return False
+        uri = self.viewer.get_main_frame().get_uri()
+        return uri is not None and self.content_provider.uri_to_chapter(uri) == self.current_chapter
+
+    def __add_annotation(self, kind, start_path, start_offset, end_path, end_offset, text):
+        """
+        Saves annotation of current chapter and lists it
+        """
+        if not self.__can_annotate:
+            return
+        annotation = annotation_store_module.Annotation(None, self.content_provider.book_md5, self.current_chapter,
+                                                        kind, start_path, start_offset, end_path, end_offset,
+                                                        text, None)
+        self.annotation_store.add(annotation)
+        self.annotations_list_component.add_annotation(annotation)
+
+    def __on_highlight_activate(self, widget):
+        anchors = self.viewer.get_selection_anchors()
+        if anchors is None:
+            return
+        self.__add_annotation(annotation_store_module.HIGHLIGHT, *anchors)
+        self.__refresh_highlights()
+
+    def __on_add_bookmark_activate(self, widget):
+        anchor = self.viewer.get_position_anchor()
+        if anchor is None:
+            return
+        path, offset, text = anchor
+        self.__add_annotation(annotation_store_module.BOOKMARK, path, offset, None, None, text)
+
+    def __on_annotation_activated(self, annotations_list_component, annotation):
+        if not self.content_provider.status or annotation.book_md5 != self.content_provider.book_md5:
+            return
+        if annotation.chapter == self.current_chapter and not self.navigator.busy:
+            self.viewer.show_anchor(annotation.start_path, annotation.start_offset)
+            return
+        if not 0 <= annotation.chapter < self.content_provider.chapter_count:
+            return
+        chapter_file = self.content_provider.get_chapter_file_path(annotation.chapter)
+        self.navigator.navigate(navigation.NavigationRequest(annotation.chapter, chapter_file,
+                                                             (annotation.start_path, annotation.start_offset)))
+
+    def __on_annotation_removed(self, annotations_list_component, annotation):
+        self.annotation_store.remove(annotation)
+        if annotation.kind == annotation_store_module.HIGHLIGHT:
+            self.__refresh_highlights()
+
+    def __update_recent_books(self):
+        """
+        Lists books that are still open in the background in header bar menu
+        """
+        self.header_bar_component.set_recent_books([(session.book_name, session.file_path)
+                                                    for session in self.content_provider.hot_sessions])
+
     def show_menu(self):
         """
         Displays right click context menu
         """
         if self.content_provider.status:
+            can_annotate = self.__can_annotate
+            self.highlight_menu_item.set_sensitive(can_annotate and self.viewer.has_selection())
+            self.bookmark_menu_item.set_sensitive(can_annotate)
             self.menu.popup(None, None, None, None, 0, Gtk.get_current_event_time())
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import os
+import sqlite3
+import time
+from xdg.BaseDirectory import xdg_data_home
+
+# Bookmarks and highlights are kept in $XDG_DATA_HOME/easy-ebook-viewer/annotations.sqlite, not in cache, they
+# are user's own data. Every annotation is anchored to a chapter (position in spine), an element path (indexes
+# of element children from <html> down, ie. "1/4/2") and an offset in text of that element, so it points to the
+# same text regardless of viewer size, zoom or theme. Annotations are indexed by book and chapter, displaying a
+# chapter reads only the annotations it has.
+
+BOOKMARK = 0
+HIGHLIGHT = 1
+
+DEFAULT_PATH = os.path.join(xdg_data_home, "easy-ebook-viewer", "annotations.sqlite")
+
+# Milliseconds sqlite waits for another instance writing to database
+LOCK_TIMEOUT = 5000
+
+
+class Annotation:
+    def __init__(self, annotation_id, book_md5, chapter, kind, start_path, start_offset, end_path, end_offset,
+                 text, created):
+        """
+        Bookmark or highlight of a book
+        :param annotation_id: Row id, None until annotation is saved
+        :param book_md5: MD5 hash of book content
+        :param chapter: Chapter (spine position) annotation is in
+        :param kind: BOOKMARK or HIGHLIGHT
+        :param start_path: Path of element annotation starts in
+        :param start_offset: Offset in text of start element
+        :param end_path: Path of element highlight ends in, None for bookmarks
+        :param end_offset: Offset in text of end element, None for bookmarks
+        :param text: Highlighted text, or beginning of bookmarked paragraph
+        :param created: Time annotation was made, seconds since epoch
+        """
+        self.id = annotation_id
+        self.book_md5 = book_md5
+        self.chapter = chapter
+        self.kind = kind
+        self.start_path = start_path
+        self.start_offset = start_offset
+        self.end_path = end_path
+        self.end_offset = end_offset
+        self.text = text
+        self.created = created
+
+    @property
+    def sort_key(self):
+        """
+        Returns key that sorts annotations of a book in reading order
+        :return tuple:
+        """
+        path = tuple(int(index) for index in self.start_path.split("/") if index)
+        return self.chapter, path, self.start_offset
+
+
+class AnnotationStore:
+    def __init__(self, path):
+        """
+        Saves bookmarks and highlights of all books in an indexed sqlite table
+        :param path: Path to database file, created when missing, ":memory:" for a database that is not saved
+        """
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.__connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT / 1000)
+        with self.__connection:
+            self.__connection.execute("CREATE TABLE IF NOT EXISTS annotations ("
+                                      "id INTEGER PRIMARY KEY, "
+                                      "book TEXT NOT NULL, "
+                                      "chapter INTEGER NOT NULL, "
+                                      "kind INTEGER NOT NULL, "
+                                      "start_path TEXT NOT NULL, "
+                                      "start_offset INTEGER NOT NULL, "
+                                      "end_path TEXT, "
+                                      "end_offset INTEGER, "
+                                      "text TEXT NOT NULL, "
+                                      "created REAL NOT NULL)")
+            self.__connection.execute("CREATE INDEX IF NOT EXISTS annotations_by_chapter "
+                                      "ON annotations (book, chapter)")
+
+    def add(self, annotation):
+        """
+        Saves new annotation and sets its id
+        :param annotation: Annotation
+        """
+        if annotation.created is None:
+            annotation.created = time.time()
+        with self.__connection:
+            cursor = self.__connection.execute(
+                "INSERT INTO annotations (book, chapter, kind, start_path, start_offset, end_path, end_offset, "
+                "text, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (annotation.book_md5, annotation.chapter, annotation.kind, annotation.start_path,
+                 annotation.start_offset, annotation.end_path, annotation.end_offset, annotation.text,
+                 annotation.created))
+        annotation.id = cursor.lastrowid
+
+    def remove(self, annotation):
+        """
+        Deletes annotation
+        :param annotation: Saved Annotation
+        """
+        with self.__connection:
+            self.__connection.execute("DELETE FROM annotations WHERE id = ?", (annotation.id,))
+
+    def move_book(self, old_book_md5, new_book_md5, chapters):
+        """
+        Moves annotations to another version of a book, chapters that moved in its reading order are renumbered.
+        Annotations of chapters new version does not have stay with previous version, they are not lost.
+        :param old_book_md5: MD5 hash of previous book content
+        :param new_book_md5: MD5 hash of new book content
+        :param chapters: Dictionary chapter number in previous version: chapter number in new version
+        :return number of annotations left with previous version:
+        """
+        if old_book_md5 == new_book_md5:
+            return 0
+        with self.__connection:
+            rows = self.__connection.execute("SELECT DISTINCT chapter FROM annotations WHERE book = ?",
+                                             (old_book_md5,)).fetchall()
+            for chapter, in rows:
+                if chapter in chapters:
+                    self.__connection.execute("UPDATE annotations SET book = ?, chapter = ? WHERE book = ? AND chapter = ?",
+                                              (new_book_md5, chapters[chapter], old_book_md5, chapter))
+            return self.__connection.execute("SELECT COUNT(*) FROM annotations WHERE book = ?",
+                                             (old_book_md5,)).fetchone()[0]
+
+    def chapter_annotations(self, book_md5, chapter):
+        """
+        Returns annotations of a single chapter, looked up by index
+        :param book_md5: MD5 hash of book content
+        :param chapter: Chapter number
+        :return list of Annotations in reading order:
+        """
+        return self.__select("WHERE book = ? AND chapter = ?", (book_md5, chapter))
+
+    def book_annotations(self, book_md5):
+        """
+        Returns all annotations of a book
+        :param book_md5: MD5 hash of book content
+        :return list of Annotations in reading order:
+        """
+        return self.__select("WHERE book = ?", (book_md5,))
+
+    def close(self):
+        self.__connection.close()
+
+    def __select(self, condition, parameters):
+        rows = self.__connection.execute(
+            "SELECT id, book, chapter, kind, start_path, start_offset, end_path, end_offset, text, created "
+            "FROM annotations " + condition, parameters)
+        return sorted((Annotation(*row) for row in rows), key=lambda annotation: annotation.sort_key)
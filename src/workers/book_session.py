@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import hashlib
+import os
+
+from workers.history import History
+
+# Rough memory taken by a session (package data, history, lookups) and by every chapters index entry
+# together with its tree view row, used to keep recently opened books within memory budget
+SESSION_MEMORY = 64 * 1024
+NAVPOINT_MEMORY = 2 * 1024
+
+
+def calculate_book_md5(file_path):
+    """
+    Calculates unique MD5 hash based on book content, identifies book in config and in cache
+    :param file_path: Path to book file, or to directory of unpacked book
+    :return hexadecimal MD5 hash of book content:
+    """
+    if os.path.isdir(file_path):
+        # Content of unpacked book keeps changing while it's being worked on, its location does not
+        return hashlib.md5(("directory:" + os.path.realpath(file_path)).encode("utf-8")).hexdigest()
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        while True:
+            piece = f.read(28 * md5.block_size)
+            if not piece:
+                break
+            md5.update(piece)
+    return md5.hexdigest()
+
+
+class BookSession:
+    def __init__(self, file_path, book_md5, cache_manager, cache_entry, download=None):
+        """
+        Everything that belongs to one open book, released as a whole by close()
+        :param file_path: Path to book file, or to directory of unpacked book
+        :param book_md5: MD5 hash of book content
+        :param cache_manager: CacheManager cache entry was acquired from, None for unpacked book
+        :param cache_entry: CacheEntry book is extracted into, None for unpacked book that is read in place
+        :param download: Download book file comes from, None for book that is not from a catalog
+        """
+        self.file_path = file_path
+        self.file_stat = self.__stat(file_path)
+        self.book_md5 = book_md5
+        self.__cache_manager = cache_manager
+        self.cache_entry = cache_entry
+        self.unpacked = cache_entry is None
+        # Downloaded book is read while it's downloading, its file does not change afterwards
+        self.download = download
+        self.cache_path = file_path if self.unpacked else cache_entry.path
+        self.__closed = False
+        self.extractor = None
+        # Member names whose dependencies were already queued for extraction
+        self.ensured = set()
+
+        # Directory of OPF file inside of book, chapter paths are relative to it
+        self.oebps = ""
+        self.book_name = ""
+        self.book_author = ""
+        # The 'button' navigation in the header bar uses this. It is based on the 'spine' in the content.opf file
+        self.files = []
+        # The treeview navigation uses this. It is based on the NCX file.
+        self.index = None
+        # Central directory of book archive, member name: (CRC-32, size), and members package is read from
+        self.members = {}
+        self.package_members = set()
+        # Package as declared in OPF and NCX files, item id: (href, media type), spine item ids and NCX links
+        self.manifest = {}
+        self.spine = []
+        self.toc_targets = []
+        # Obfuscated fonts, member name: (key, number of obfuscated bytes), and FontDeobfuscator when there are any
+        self.obfuscated_fonts = {}
+        self.fonts = None
+        # BookValidator checking book in the background, None until validation is started
+        self.validator = None
+
+        # Back / forward navigation between visited pages of this book
+        self.history = History()
+        # State UI components keep for this book (ie. chapters tree model), goes away with the session
+        self.views = {}
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    def is_current(self, file_path):
+        """
+        Tells if session was opened from given file and file did not change since, without reading it
+        :param file_path:
+        :return True if session can be reused for file:
+        """
+        if self.download is not None:
+            # File appears only once download is done
+            return not self.closed and self.file_path == file_path
+        return not self.closed and self.file_path == file_path and self.file_stat == self.__stat(file_path)
+
+    @property
+    def content_version(self):
+        """
+        Returns what identifies content of book for data derived from it (ie. page maps). MD5 of unpacked book only
+        tells where it is, size and modification time of its files it was opened with are added to it.
+        :return string:
+        """
+        if self.unpacked and self.file_stat is not None:
+            return "%s-%s" % (self.book_md5, self.file_stat[:12])
+        return self.book_md5
+
+    def refresh_stat(self):
+        """
+        Remembers current size and modification time of book file, to be used when file was rewritten unchanged
+        """
+        self.file_stat = self.__stat(self.file_path)
+
+    @property
+    def memory_estimate(self):
+        """
+        Returns approximate memory session keeps alive
+        :return bytes:
+        """
+        navpoints = 0
+        pending = [self.index] if self.index is not None else []
+        while pending:
+            navpoint = pending.pop()
+            navpoints += 1
+            pending.extend(navpoint.children)
+        return SESSION_MEMORY + navpoints * NAVPOINT_MEMORY
+
+    def close(self):
+        """
+        Stops background extraction, lets go of cache directory and drops everything parsed from book
+        """
+        if self.extractor is not None:
+            self.extractor.cancel()
+            self.extractor = None
+        if self.validator is not None:
+            self.validator.cancel()
+            self.validator = None
+        if self.cache_entry is not None:
+            self.__cache_manager.release(self.cache_entry)
+            self.cache_entry = None
+        self.__closed = True
+        self.download = None
+        self.ensured = set()
+        self.members = {}
+        self.files = []
+        self.index = None
+        self.manifest = {}
+        self.spine = []
+        self.toc_targets = []
+        self.obfuscated_fonts = {}
+        self.fonts = None
+        self.history.clear()
+        self.views = {}
+
+    @staticmethod
+    def __stat(file_path):
+        """
+        Returns size and modification time of book file, for unpacked book a hash of those of all its files since
+        editing a file in place does not change modification time of directory
+        :param file_path:
+        :return (size, modification time), hexadecimal hash for unpacked book, None when it can't be read:
+        """
+        try:
+            if not os.path.isdir(file_path):
+                stat = os.stat(file_path)
+                return stat.st_size, stat.st_mtime_ns
+            md5 = hashlib.md5()
+            for directory, directory_names, file_names in os.walk(file_path):
+                directory_names.sort()
+                for file_name in sorted(file_names):
+                    path = os.path.join(directory, file_name)
+                    stat = os.stat(path)
+                    md5.update(("%s:%d:%d\n" % (os.path.relpath(path, file_path), stat.st_size,
+                                                 stat.st_mtime_ns)).encode("utf-8", "surrogateescape"))
+            return md5.hexdigest()
+        except OSError:
+            return None
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import fcntl
+import os
+import shutil
+import threading
+import time
+
+# Every book gets its own directory in <cacheDir>/books/<book md5>/ next to two lock files:
+#
+#  - <book md5>.lock is held shared by every instance that has the book open, cleanup takes it
+#    exclusively, so it never removes a book somebody is reading. Its mtime is the last access time.
+#  - <book md5>.fill is held exclusively by the instance extracting the book, others wait for it
+#    and then use the files it extracted.
+#
+# A finished entry contains a COMPLETE_MARKER file with the total size of the entry in bytes.
+# Entries without it are partial (extraction was cancelled or crashed) and get extracted again.
+#
+# Books of one publisher tend to embed the same fonts, stylesheets and images. Such files are kept once
+# in <cacheDir>/objects/<key>/<sha256>. Key is CRC-32 and size of the content, which the zip central directory
+# tells without reading the file, it only finds candidates: CRC-32 collisions are easy to craft, so a member is
+# linked only when SHA-256 of its inflated content matches the object. Otherwise a book downloaded from a catalog
+# could replace fonts and images of every other book. Book directories hardlink objects, so files in cache must
+# never be modified in place. Objects no book links to anymore are removed by cleanup.
+#
+# Chapters cleaned up for display are kept in <cacheDir>/transformed/<book md5>/, de-obfuscated fonts in
+# <cacheDir>/fonts/<book md5>/ and books downloaded from catalogs in <cacheDir>/downloads/<book md5>/, they go
+# away with the book. Books that are not extracted (unpacked directories)
+# have no entry, their cleaned chapters and fonts are removed once they are older than max age.
+
+COMPLETE_MARKER = ".complete"
+
+# Files worth keeping once for all books, markup is unique to every book
+SHARED_EXTENSIONS = (".css", ".ttf", ".otf", ".woff", ".woff2", ".jpg", ".jpeg", ".png", ".gif", ".svg",
+                     ".webp", ".bmp", ".mp3", ".m4a", ".mp4", ".ogg")
+
+# Smaller files take a single disk block anyway
+MIN_SHARED_SIZE = 4096
+
+
+def directory_size(path):
+    """
+    Returns disk space taken by files in a directory tree, hardlinked files count only their share
+    :param path:
+    :return size in bytes:
+    """
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                stat = os.lstat(os.path.join(root, name))
+                size += stat.st_size // max(1, stat.st_nlink)
+            except OSError:
+                pass
+    return size
+
+
+def lock_file(path, operation):
+    """
+    Opens (creating if needed) and locks a lock file, retries when file was removed while waiting for the lock
+    :param path: Path to lock file
+    :param operation: fcntl.LOCK_SH or fcntl.LOCK_EX, optionally with fcntl.LOCK_NB
+    :return file descriptor or None when non-blocking lock could not be taken:
+    """
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, operation)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        # Cleanup unlinks lock files of removed entries, make sure we didn't lock such an orphan
+        try:
+            if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def unlock_file(fd):
+    """
+    Releases lock taken with lock_file
+    :param fd:
+    """
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+class CacheEntry:
+    def __init__(self, path, lock_fd):
+        """
+        Cache directory of one book, valid until released
+        :param path: Directory book is extracted to
+        :param lock_fd: Shared lock of entry
+        """
+        self.path = path
+        self.lock_fd = lock_fd
+        self.fill_fd = None
+        # Extraction may finish on a worker thread while the book is being closed
+        self.fill_lock = threading.Lock()
+
+    @property
+    def complete(self):
+        """
+        Returns True when book is fully extracted
+        :return boolean:
+        """
+        return os.path.exists(os.path.join(self.path, COMPLETE_MARKER))
+
+
+class ObjectStore:
+    def __init__(self, path):
+        """
+        Extracted files kept once by their content, book directories hardlink them
+        :param path: Directory objects are kept in
+        """
+        self.__path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    @staticmethod
+    def key(member):
+        """
+        Returns key of archive member content, CRC-32 and size come from central directory so nothing is read
+        :param member: ZipInfo
+        :return key or None when member is not worth sharing:
+        """
+        if member.is_dir() or member.file_size < MIN_SHARED_SIZE or \
+                not member.filename.lower().endswith(SHARED_EXTENSIONS):
+            return None
+        return "%08x-%d" % (member.CRC, member.file_size)
+
+    def __object_path(self, key, digest):
+        return os.path.join(self.__path, key[:2], key, digest)
+
+    def candidates(self, key):
+        """
+        Returns objects content may be, their SHA-256 still has to be compared with the one of content
+        :param key: Key of content
+        :return set of hexadecimal SHA-256 digests, empty when there is none:
+        """
+        try:
+            return set(os.listdir(os.path.join(self.__path, key[:2], key)))
+        except OSError:
+            return set()
+
+    def link(self, key, digest, target_path):
+        """
+        Hardlinks stored object to target path
+        :param key: Key of content
+        :param digest: Hexadecimal SHA-256 of inflated content
+        :param target_path: Path that does not exist yet
+        :return True when object was stored and got linked, False when it has to be extracted:
+        """
+        try:
+            os.link(self.__object_path(key, digest), target_path)
+            return True
+        except OSError:
+            return False
+
+    def add(self, key, digest, file_path):
+        """
+        Stores extracted file, the file itself becomes the object so nothing is copied
+        :param key: Key of content
+        :param digest: Hexadecimal SHA-256 of extracted file
+        :param file_path: Extracted file with verified content
+        """
+        object_path = self.__object_path(key, digest)
+        try:
+            os.makedirs(os.path.dirname(object_path), mode=0o700, exist_ok=True)
+            os.link(file_path, object_path)
+        except OSError:
+            # Stored by another book in the meantime or file system without hardlinks, nothing is shared then
+            pass
+
+    def cleanup(self):
+        """
+        Removes objects no book links to anymore
+        :return number of bytes freed:
+        """
+        freed = 0
+        for root, dirs, files in os.walk(self.__path, topdown=False):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.lstat(path)
+                    if stat.st_nlink == 1:
+                        os.unlink(path)
+                        freed += stat.st_size
+                except OSError:
+                    pass
+            if root != self.__path:
+                try:
+                    # Directory of a key without objects
+                    os.rmdir(root)
+                except OSError:
+                    pass
+        return freed
+
+
+class CacheManager:
+    def __init__(self, cache_path, max_size, max_age):
+        """
+        Manages per book cache directories shared safely between application instances
+        :param cache_path: Root cache folder
+        :param max_size: Size in bytes cleanup shrinks cache to
+        :param max_age: Seconds after which unused books are removed
+        """
+        self.__books_path = os.path.join(cache_path, "books")
+        os.makedirs(self.__books_path, mode=0o700, exist_ok=True)
+        os.chmod(cache_path, 0o700)
+        self.store = ObjectStore(os.path.join(cache_path, "objects"))
+        self.transformed_path = os.path.join(cache_path, "transformed")
+        self.fonts_path = os.path.join(cache_path, "fonts")
+        self.downloads_path = os.path.join(cache_path, "downloads")
+        self.__max_size = max_size
+        self.__max_age = max_age
+
+    def acquire(self, book_md5):
+        """
+        Opens cache entry of a book, entry won't be removed by any instance until it's released
+        :param book_md5:
+        :return CacheEntry:
+        """
+        lock_path = os.path.join(self.__books_path, book_md5 + ".lock")
+        fd = lock_file(lock_path, fcntl.LOCK_SH)
+        # Marks entry as most recently used
+        os.utime(lock_path)
+        path = os.path.join(self.__books_path, book_md5)
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        return CacheEntry(path, fd)
+
+    def release(self, entry):
+        """
+        Closes cache entry, aborting extraction if it was still in progress
+        :param entry:
+        """
+        self.finish_fill(entry, False)
+        if entry.lock_fd is not None:
+            unlock_file(entry.lock_fd)
+            entry.lock_fd = None
+
+    def begin_fill(self, entry):
+        """
+        Checks if book needs to be extracted, waits if another instance is extracting it right now
+        :param entry:
+        :return True when caller must extract the book (and call finish_fill), False when it's already there:
+        """
+        fd = lock_file(entry.path + ".fill", fcntl.LOCK_EX)
+        if entry.complete:
+            unlock_file(fd)
+            return False
+        # Leftovers of a cancelled extraction
+        shutil.rmtree(entry.path, ignore_errors=True)
+        os.makedirs(entry.path, mode=0o700, exist_ok=True)
+        entry.fill_fd = fd
+        return True
+
+    def finish_fill(self, entry, success):
+        """
+        Ends extraction started with begin_fill, safe to call more than once
+        :param entry:
+        :param success: True marks entry complete so other instances can use it as is
+        """
+        with entry.fill_lock:
+            fd = entry.fill_fd
+            if fd is None:
+                return
+            entry.fill_fd = None
+            if success:
+                with open(os.path.join(entry.path, COMPLETE_MARKER), "w") as marker:
+                    marker.write(str(directory_size(entry.path)))
+            unlock_file(fd)
+
+    def cleanup(self):
+        """
+        Removes books unused for longer than max age and least recently used books until cache fits max size,
+        books that are open in any instance are never removed
+        """
+        entries = []
+        for name in os.listdir(self.__books_path):
+            path = os.path.join(self.__books_path, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                last_access = os.stat(path + ".lock").st_mtime
+            except FileNotFoundError:
+                last_access = 0
+            try:
+                with open(os.path.join(path, COMPLETE_MARKER)) as marker:
+                    size = int(marker.read())
+            except (IOError, ValueError):
+                # Partial entry, nobody is going to use it as is
+                size = None
+            entries.append((last_access, size, path))
+
+        # Oldest first
+        entries.sort(key=lambda entry: entry[0])
+        total_size = sum(size for last_access, size, path in entries if size is not None)
+        now = time.time()
+        for last_access, size, path in entries:
+            if size is not None and total_size <= self.__max_size and now - last_access <= self.__max_age:
+                continue
+            if self.__remove(path):
+                total_size -= size or 0
+
+        for path in (self.transformed_path, self.fonts_path, self.downloads_path):
+            self.__remove_orphaned(path, now)
+        freed = self.store.cleanup()
+        if freed:
+            print("Removed %.1f MiB of files no book uses from cache" % (freed / 2 ** 20))
+
+    def __remove(self, path):
+        """
+        Removes cache entry if no instance has it open
+        :param path: Entry directory
+        :return True when entry was removed:
+        """
+        fd = lock_file(path + ".lock", fcntl.LOCK_EX | fcntl.LOCK_NB)
+        if fd is None:
+            return False
+        try:
+            print("Removing from cache: " + path)
+            shutil.rmtree(path, ignore_errors=True)
+            for derived_path in (self.transformed_path, self.fonts_path, self.downloads_path):
+                shutil.rmtree(os.path.join(derived_path, os.path.basename(path)), ignore_errors=True)
+            for suffix in (".fill", ".lock"):
+                try:
+                    os.unlink(path + suffix)
+                except FileNotFoundError:
+                    pass
+        finally:
+            unlock_file(fd)
+        return True
+
+    def __remove_orphaned(self, derived_path, now):
+        """
+        Removes files derived from books that have no cache entry and were not used for longer than max age
+        :param derived_path: Directory with a subdirectory for every book, ie. cleaned chapters
+        :param now: Current time
+        """
+        try:
+            names = os.listdir(derived_path)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(derived_path, name)
+            if os.path.isdir(os.path.join(self.__books_path, name)):
+                continue
+            try:
+                if now - os.stat(path).st_mtime <= self.__max_age:
+                    continue
+            except OSError:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import base64
+import binascii
+import codecs
+import hashlib
+import mimetypes
+import os
+import re
+import shutil
+import threading
+import urllib.parse
+from workers.encoding import decode_document
+
+# Chapters are cleaned up once before WebKit sees them, cleaned chapter is kept in
+# <cacheDir>/transformed/<book md5>/<pipeline version>/<chapter key>.html and every later load reads it straight
+# away. Pipeline version changes whenever a transform is added, removed or changed, so chapters cleaned by an
+# older pipeline are never shown. Chapter key covers path, size and modification time of the chapter file, an
+# unpacked book edited in place gets its chapters cleaned again.
+#
+# Cleaned chapters are displayed with URI of the original file, links and stylesheets resolve as before.
+
+# Base64 images shorter than this are left inline, moving them out would not save anything
+MIN_DATA_IMAGE_SIZE = 4096
+
+# Tables nested this deep get fixed table layout, automatic layout of them is measured over and over
+MAX_TABLE_DEPTH = 3
+
+SCRIPT_TAG = re.compile(r"<script\b([^>]*?)(/?)>", re.IGNORECASE)
+SCRIPT_ATTRIBUTE = re.compile(r"(\s)(src|type)(\s*=)", re.IGNORECASE)
+DATA_IMAGE = re.compile(r"data:(image/[A-Za-z0-9.+-]+);base64,([A-Za-z0-9+/=\s]{%d,})" % MIN_DATA_IMAGE_SIZE)
+STYLE_ATTRIBUTE = re.compile(r"""(\sstyle\s*=\s*)("[^"]*"|'[^']*')""", re.IGNORECASE)
+STYLE_ELEMENT = re.compile(r"(<style\b[^>]*>)(.*?)(</style\s*>)", re.IGNORECASE | re.DOTALL)
+FIXED_POSITION = re.compile(r"position\s*:\s*fixed", re.IGNORECASE)
+TABLE_TAG = re.compile(r"<(/?)table\b", re.IGNORECASE)
+HEAD_END = re.compile(r"</head\s*>", re.IGNORECASE)
+
+NESTED_TABLES_CSS = "<style>%s { table-layout: fixed !important; }</style>" % " ".join(["table"] * MAX_TABLE_DEPTH)
+
+
+def temporary_file_path(file_path):
+    """
+    Returns name file is written under before it is renamed to file path, unique to thread and process
+    :param file_path:
+    :return path:
+    """
+    return "%s.%d-%d.tmp" % (file_path, os.getpid(), threading.get_ident())
+
+
+class Transform:
+    """
+    Step of chapter pipeline, bump version whenever output of apply changes
+    """
+    name = "transform"
+    version = 1
+
+    def apply(self, text, output_path):
+        """
+        Returns transformed chapter
+        :param text: Chapter markup
+        :param output_path: Directory transform can write files chapter refers to
+        :return chapter markup:
+        """
+        return text
+
+
+class NeutralizeScripts(Transform):
+    """
+    Turns scripts into inert text blocks, viewer runs none of them but WebKit still fetches and compiles them.
+    Script elements and their text stay where they are, annotations count them in element paths and text offsets.
+    """
+    name = "neutralize-scripts"
+
+    def apply(self, text, output_path):
+        def neutralize(match):
+            attributes = SCRIPT_ATTRIBUTE.sub(lambda attribute: attribute.group(1) + "data-" + attribute.group(2) +
+                                              attribute.group(3), match.group(1))
+            return '<script type="text/plain"%s%s>' % (attributes, match.group(2))
+
+        return SCRIPT_TAG.sub(neutralize, text)
+
+
+class ExtractDataImages(Transform):
+    """
+    Moves big base64 images out to files, WebKit then decodes them only when they are displayed
+    """
+    name = "extract-data-images"
+
+    def apply(self, text, output_path):
+        def extract(match):
+            try:
+                data = base64.b64decode("".join(match.group(2).split()), validate=True)
+            except (binascii.Error, ValueError):
+                return match.group(0)
+            extension = mimetypes.guess_extension(match.group(1)) or ".bin"
+            file_path = os.path.join(output_path, "images", hashlib.md5(data).hexdigest() + extension)
+            if not os.path.exists(file_path):
+                os.makedirs(os.path.dirname(file_path), mode=0o700, exist_ok=True)
+                temporary_path = temporary_file_path(file_path)
+                with open(temporary_path, "wb") as file:
+                    file.write(data)
+                os.replace(temporary_path, file_path)
+            return "file://" + urllib.parse.quote(file_path)
+
+        return DATA_IMAGE.sub(extract, text)
+
+
+class NeutralizeLayout(Transform):
+    """
+    Defuses publisher styles that make layout slow, fixed positioning and deeply nested tables
+    """
+    name = "neutralize-layout"
+
+    def apply(self, text, output_path):
+        # Only inside of styles, text of the chapter may talk about CSS
+        text = STYLE_ATTRIBUTE.sub(lambda match: match.group(1) + FIXED_POSITION.sub("position: static",
+                                                                                    match.group(2)), text)
+        text = STYLE_ELEMENT.sub(lambda match: match.group(1) + FIXED_POSITION.sub("position: static",
+                                                                                  match.group(2)) + match.group(3),
+                                 text)
+        depth = deepest = 0
+        for match in TABLE_TAG.finditer(text):
+            depth = max(depth - 1, 0) if match.group(1) else depth + 1
+            deepest = max(deepest, depth)
+        if deepest >= MAX_TABLE_DEPTH:
+            text = HEAD_END.sub(lambda match: NESTED_TABLES_CSS + match.group(0), text, count=1)
+        return text
+
+
+DEFAULT_TRANSFORMS = (NeutralizeScripts(), ExtractDataImages(), NeutralizeLayout())
+
+
+class ChapterTransformer:
+    def __init__(self, path, scheduler, transforms=DEFAULT_TRANSFORMS):
+        """
+        Runs chapters through transforms in the background and caches the result on disk
+        :param path: Directory cleaned chapters of all books are kept in
+        :param scheduler: Scheduler transforms run on
+        :param transforms: Transforms applied in order
+        """
+        self.__path = path
+        self.__transforms = transforms
+        description = ",".join("%s:%d" % (transform.name, transform.version) for transform in transforms)
+        self.version = hashlib.md5(description.encode("utf-8")).hexdigest()[:12]
+        self.__scheduler = scheduler
+        # Books whose directory has been marked as used and checked for output of older pipelines
+        self.__books_checked = set()
+
+    def output_path(self, book_md5):
+        """
+        Returns directory cleaned chapters of a book are kept in
+        :param book_md5:
+        :return path:
+        """
+        return os.path.join(self.__path, book_md5, self.version)
+
+    def transform(self, book_md5, book_path, chapter_path):
+        """
+        Returns cleaned chapter, runs transforms only when it is not cached yet
+        :param book_md5: MD5 hash of book content
+        :param book_path: Directory book is extracted in
+        :param chapter_path: Chapter file, inside of book directory
+        :return path of cleaned chapter, or of chapter itself when it could not be transformed:
+        """
+        try:
+            stat = os.stat(chapter_path)
+            key = "%s:%d:%d" % (os.path.relpath(chapter_path, book_path), stat.st_size, stat.st_mtime_ns)
+            output_path = self.output_path(book_md5)
+            transformed_path = os.path.join(output_path, hashlib.md5(key.encode("utf-8")).hexdigest() + ".html")
+            self.__prepare_book(book_md5)
+            if os.path.exists(transformed_path):
+                return transformed_path
+
+            os.makedirs(output_path, mode=0o700, exist_ok=True)
+            with open(chapter_path, "rb") as file:
+                text = decode_document(file.read())
+            for transform in self.__transforms:
+                text = transform.apply(text, output_path)
+            # Byte order mark makes it read as UTF-8 whatever encoding original file declared
+            temporary_path = temporary_file_path(transformed_path)
+            with open(temporary_path, "wb") as file:
+                file.write(codecs.BOM_UTF8 + text.encode("utf-8"))
+            os.replace(temporary_path, transformed_path)
+            return transformed_path
+        except (OSError, ValueError) as e:
+            print("Could not transform: ", chapter_path, e)
+            return chapter_path
+
+    def transform_async(self, book_md5, book_path, chapter_path, priority, on_finished, prepare=None):
+        """
+        Cleans chapter on a worker thread
+        :param book_md5: MD5 hash of book content
+        :param book_path: Directory book is extracted in
+        :param chapter_path: Chapter file, inside of book directory
+        :param priority: Priority class of scheduler
+        :param on_finished: Called on UI thread with path of cleaned chapter
+        :param prepare: Called on the worker thread first, ie. to wait until chapter is extracted
+        :return Task, cancelling it drops chapter that did not start transforming yet:
+        """
+        def transform():
+            if prepare is not None:
+                prepare()
+            return self.transform(book_md5, book_path, chapter_path)
+
+        return self.__scheduler.submit(transform, priority, book=book_md5, on_finished=on_finished)
+
+    def __prepare_book(self, book_md5):
+        """
+        Marks cleaned chapters of a book as used, once per run, and removes output of older pipelines
+        :param book_md5:
+        """
+        if book_md5 in self.__books_checked:
+            return
+        self.__books_checked.add(book_md5)
+        book_output_path = os.path.join(self.__path, book_md5)
+        try:
+            os.utime(book_output_path)
+            names = os.listdir(book_output_path)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name != self.version:
+                shutil.rmtree(os.path.join(book_output_path, name), ignore_errors=True)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import bisect
+import heapq
+
+# Changed rows reported right away, counted from the first row on screen. As long as it's more than a screen holds,
+# rows past them are either below the screen or pushed below it by rows that appear before them.
+SCREEN_ROWS = 100
+# Pending rows reported at once, between chunks GTK gets to handle input and drawing
+PENDING_CHUNK = 500
+
+
+class ChaptersFilter:
+    def __init__(self):
+        """
+        Decides which rows of chapters index are shown for what user typed and which rows tree model has to be told
+        about. Rows are numbered in order they were added, parents before their children.
+        """
+        # Per row number: case folded text and row number of parent (-1 for top level)
+        self.folded_texts = []
+        self.parents = []
+        # Row numbers shown by filter, None when nothing is filtered out
+        self.visible_rows = None
+        self.query = ""
+        self.matches = None
+        # Rows whose change was not reported yet, reported a chunk at a time by take_pending()
+        self.pending_rows = set()
+        self.__pending_order = None
+        # First row shown on screen when filter was last changed
+        self.__first_visible = 0
+
+    def append(self, text, parent_row):
+        """
+        Adds a row, parents have to be added before their children
+        :param text: Text of row
+        :param parent_row: Row number of parent, -1 for top level
+        :return row number:
+        """
+        row = len(self.parents)
+        self.folded_texts.append((text or "").casefold())
+        self.parents.append(parent_row)
+        return row
+
+    def is_visible(self, row):
+        return self.visible_rows is None or row in self.visible_rows
+
+    def filter(self, query, visible_range=None):
+        """
+        Shows only rows whose text contains query and their ancestors
+        Only rows that can be on screen are reported right away, the rest is left pending
+        :param query: Text to look for, empty shows all rows
+        :param visible_range: (first, last) row number shown on screen, None reports every changed row right away
+        :return sorted row numbers whose visibility has to be reported now:
+        """
+        query = query.strip().casefold()
+        if query == self.query:
+            return []
+        if not query:
+            matches = None
+            visible_rows = None
+        else:
+            # Rows matching longer query are among rows matching the shorter one
+            if self.matches is not None and self.query in query:
+                candidates = self.matches
+            else:
+                candidates = range(len(self.folded_texts))
+            folded_texts = self.folded_texts
+            matches = [row for row in candidates if query in folded_texts[row]]
+            visible_rows = set()
+            for row in matches:
+                while row >= 0 and row not in visible_rows:
+                    visible_rows.add(row)
+                    row = self.parents[row]
+
+        previous_rows = self.visible_rows
+        self.query = query
+        self.matches = matches
+        self.visible_rows = visible_rows
+
+        # Showing all rows or hiding all but some changes every row that was not among them
+        if previous_rows is None and visible_rows is None:
+            changed_rows = []
+        elif previous_rows is None:
+            changed_rows = [row for row in range(len(self.parents)) if row not in visible_rows]
+        elif visible_rows is None:
+            changed_rows = [row for row in range(len(self.parents)) if row not in previous_rows]
+        else:
+            changed_rows = sorted(previous_rows ^ visible_rows)
+
+        self.__pending_order = None
+        if visible_range is None:
+            rows = sorted(self.pending_rows.union(changed_rows)) if self.pending_rows else changed_rows
+            self.pending_rows = set()
+            return rows
+        first, last = visible_range
+        self.__first_visible = first
+        start = bisect.bisect_left(changed_rows, first)
+        # Rows left pending by previous filtering are on screen the way they were before
+        stale_rows = heapq.nsmallest(SCREEN_ROWS, (row for row in self.pending_rows if first <= row <= last))
+        rows = sorted(set(changed_rows[start:start + SCREEN_ROWS]).union(stale_rows))[:SCREEN_ROWS]
+        # Pending rows stay pending even when they changed back, tree model still has them the way they were before
+        self.pending_rows.update(changed_rows)
+        self.pending_rows.difference_update(rows)
+        return rows
+
+    def take_pending(self, count):
+        """
+        Takes rows whose change was not reported yet, rows below the screen first
+        :param count: Number of rows to take at most
+        :return sorted row numbers:
+        """
+        if self.__pending_order is None:
+            # Popped from the end, so rows below the screen come first and rows above it last
+            first = self.__first_visible
+            self.__pending_order = sorted(self.pending_rows, key=lambda row: (row < first, row), reverse=True)
+        rows = []
+        while self.__pending_order and len(rows) < count:
+            rows.append(self.__pending_order.pop())
+        self.pending_rows.difference_update(rows)
+        return sorted(rows)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import collections
+import os
+import re
+import threading
+import zipfile
+
+import gi
+
+gi.require_version('GdkPixbuf', '2.0')
+from gi.repository import GdkPixbuf, GLib
+from workers.book_session import calculate_book_md5
+from workers.scheduler import INTERACTIVE, PREFETCH
+
+# A comic archive (CBZ) is just a zip of images, one image per page, pages ordered by file name.
+# Pages are read straight from the archive, nothing is extracted to disk. Decoding and scaling a big
+# JPEG takes long enough to be noticed on every page turn, so pages around the current one are decoded
+# ahead of time on background threads (GdkPixbuf releases the GIL) and kept in a memory bounded cache.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp")
+
+# Pages decoded ahead of the current one, in order of importance
+PREFETCH_OFFSETS = (1, 2, -1)
+
+
+def natural_sort_key(name):
+    """
+    Sort key that orders "page2.jpg" before "page10.jpg"
+    :param name:
+    :return key:
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name.casefold())]
+
+
+class PixbufCache:
+    def __init__(self, memory_budget):
+        """
+        Least recently used cache of decoded pages bounded by memory they take
+        :param memory_budget: Bytes of pixel data cache may hold
+        """
+        self.__memory_budget = memory_budget
+        self.__memory_used = 0
+        self.__pixbufs = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            pixbuf = self.__pixbufs.get(key)
+            if pixbuf is not None:
+                self.__pixbufs.move_to_end(key)
+            return pixbuf
+
+    def put(self, key, pixbuf):
+        size = pixbuf.get_rowstride() * pixbuf.get_height()
+        with self.__lock:
+            if key in self.__pixbufs:
+                return
+            self.__pixbufs[key] = pixbuf
+            self.__memory_used += size
+            # Always keeps the newest page, even if it alone is over budget
+            while self.__memory_used > self.__memory_budget and len(self.__pixbufs) > 1:
+                old_key, old_pixbuf = self.__pixbufs.popitem(last=False)
+                self.__memory_used -= old_pixbuf.get_rowstride() * old_pixbuf.get_height()
+
+    def clear(self):
+        with self.__lock:
+            self.__pixbufs.clear()
+            self.__memory_used = 0
+
+
+class ComicProvider:
+    def __init__(self, window):
+        """
+        Manages comic archives and provides decoded pages
+        :param window: Main application window reference, serves as communication hub
+        """
+        self.__window = window
+        self.__ready = False
+        self.__file_path = None
+        self.__local = threading.local()
+        self.__scheduler = window.scheduler
+        self.__futures = {}
+        self.__futures_lock = threading.Lock()
+        self.__cache = PixbufCache(int(window.config_provider.config["Application"]["comicCacheMemory"])
+                                   * 1024 * 1024)
+        self.book_name = ""
+        self.book_md5 = None
+        self.pages = []
+
+    def prepare_book(self, file_path):
+        """
+        Lists pages of comic archive
+        :param file_path:
+        :return True when file is a comic archive, False otherwise:
+        """
+        self.__ready = False
+        # Pages of previous comic still waiting to be decoded are not needed anymore
+        with self.__futures_lock:
+            for future in self.__futures.values():
+                future.cancel()
+            self.__futures = {}
+        if self.book_md5 is not None:
+            self.__scheduler.cancel_book(self.book_md5)
+        self.__cache.clear()
+
+        try:
+            with zipfile.ZipFile(file_path) as zip_file:
+                names = zip_file.namelist()
+        except (zipfile.BadZipFile, OSError):
+            return False
+
+        # ePub files contain images too, but they are not comics
+        if "META-INF/container.xml" in names:
+            return False
+        pages = sorted((name for name in names if name.lower().endswith(IMAGE_EXTENSIONS)), key=natural_sort_key)
+        if not pages:
+            return False
+        try:
+            book_md5 = calculate_book_md5(file_path)
+        except OSError:
+            return False
+
+        self.pages = pages
+        self.__file_path = file_path
+        self.book_name = os.path.splitext(os.path.basename(file_path))[0]
+        self.book_md5 = book_md5
+        if self.book_md5 not in self.__window.config_provider.config:
+            self.__window.config_provider.add_book_to_config(self.book_md5)
+        self.__ready = True
+        return True
+
+    @property
+    def status(self):
+        """
+        Returns boolean status of comic loading
+        :return comic status:
+        """
+        return self.__ready
+
+    @property
+    def page_count(self):
+        return len(self.pages)
+
+    def get_page(self, number, width, on_finished):
+        """
+        Returns decoded page scaled to width when it was decoded ahead of time, otherwise it's decoded in the
+        background and handed to on_finished, like chapters are
+        :param number: Page number
+        :param width: Width in pixels
+        :param on_finished: Called on UI thread with GdkPixbuf.Pixbuf decoded later, None if it could not be decoded
+        :return GdkPixbuf.Pixbuf or None when page is being decoded:
+        """
+        pixbuf = self.__cache.get((number, width))
+        if pixbuf is None and self.__schedule(number, width, INTERACTIVE, on_finished) is None:
+            # Got decoded in the meantime
+            pixbuf = self.__cache.get((number, width))
+        self.prefetch(number, width)
+        return pixbuf
+
+    def prefetch(self, number, width):
+        """
+        Starts decoding pages around given one in the background
+        :param number: Current page number
+        :param width: Width in pixels
+        """
+        for offset in PREFETCH_OFFSETS:
+            if 0 <= number + offset < self.page_count:
+                self.__schedule(number + offset, width, PREFETCH)
+
+    def __schedule(self, number, width, priority, on_finished=None):
+        """
+        Queues page for decoding unless it's decoded or being decoded already, page waiting to be prefetched is
+        moved up when it's needed right now
+        :param on_finished: Called on UI thread with decoded page, None when nobody waits for it
+        :return Task of GdkPixbuf.Pixbuf or None if page is in cache:
+        """
+        key = (number, width)
+        with self.__futures_lock:
+            if self.__cache.get(key) is not None:
+                return None
+            future = self.__futures.get(key)
+            if future is None:
+                # Task keeps archive and page name it was queued for, another comic may be opened meanwhile
+                file_path = self.__file_path
+                name = self.pages[number]
+                future = self.__scheduler.submit(lambda: self.__decode(file_path, name, number, width), priority,
+                                                 book=self.book_md5, on_finished=on_finished)
+                self.__futures[key] = future
+            else:
+                future.promote(priority)
+                if on_finished is not None:
+                    # Task is taken out of futures before it returns, so the one found here hands result over
+                    future.on_finished = on_finished
+            return future
+
+    def __decode(self, file_path, name, number, width):
+        """
+        Reads page from archive, decodes and scales it, runs on a worker thread
+        :return GdkPixbuf.Pixbuf or None if page could not be decoded:
+        """
+        try:
+            return self.__decode_page(file_path, name, number, width)
+        except (GLib.Error, KeyError, OSError, zipfile.BadZipFile) as e:
+            print("Could not decode page: ", name, e)
+            return None
+        finally:
+            with self.__futures_lock:
+                if self.__file_path == file_path:
+                    self.__futures.pop((number, width), None)
+
+    def __decode_page(self, file_path, name, number, width):
+        # Each thread keeps its own handle of current archive
+        if getattr(self.__local, "file_path", None) != file_path:
+            if getattr(self.__local, "zip_file", None) is not None:
+                self.__local.zip_file.close()
+            self.__local.zip_file = zipfile.ZipFile(file_path)
+            self.__local.file_path = file_path
+        data = self.__local.zip_file.read(name)
+
+        loader = GdkPixbuf.PixbufLoader()
+        loader.write(data)
+        loader.close()
+        pixbuf = loader.get_pixbuf().apply_embedded_orientation()
+        if width > 0 and pixbuf.get_width() != width:
+            height = max(1, round(pixbuf.get_height() * width / pixbuf.get_width()))
+            pixbuf = pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+
+        # A newer book might have been opened meanwhile
+        if file_path == self.__file_path:
+            self.__cache.put((number, width), pixbuf)
+        return pixbuf
@@ -16,7 +16,11 @@
 import configparser
 import getpass
 import os
-from xdg.BaseDirectory import xdg_config_home
+from xdg.BaseDirectory import xdg_config_home, xdg_cache_home
+
+# Cache used to live in a single folder in /tmp that was wiped whenever a book was opened
+LEGACY_CACHE_DIR = "/tmp/easy-ebook-viewer-cache-" + getpass.getuser() + "/"
+DEFAULT_CACHE_DIR = os.path.join(xdg_cache_home, "easy-ebook-viewer") + "/"
 
 
 class ConfigProvider:
@@ -41,10 +45,20 @@ class ConfigProvider:
         """
         Creates new Main configuration and saves it to file
         """
-        self.config["Application"] = {"cacheDir": "/tmp/easy-ebook-viewer-cache-" + getpass.getuser() + "/",
+        self.config["Application"] = {"cacheDir": DEFAULT_CACHE_DIR,
+                                      "cacheSize": "512",
+                                      "cacheMaxAge": "30",
+                                      "pageCacheSize": "10",
+                                      "viewerPoolMemory": "120",
+                                      "comicCacheMemory": "256",
+                                      "hotBooks": "4",
+                                      "hotBooksMemory": "32",
                                       "javascript": "False",
                                       "caret": "False",
-                                      "stylesheet": "Day"}
+                                      "stylesheet": "Day",
+                                      "paginated": "False",
+                                      "watchBook": "False",
+                                      "opdsCatalog": ""}
         self.save_configuration()
 
     def __validate_configuration(self):
@@ -55,8 +69,29 @@ class ConfigProvider:
         if "Application" not in self.config:
             self.config["Application"] = {}
             was_valid = False
-        if "cacheDir" not in self.config['Application']:
-            self.config["Application"]["cacheDir"] = "/tmp/easy-ebook-viewer-cache-" + getpass.getuser() + "/"
+        if "cacheDir" not in self.config['Application'] or self.config["Application"]["cacheDir"] == LEGACY_CACHE_DIR:
+            self.config["Application"]["cacheDir"] = DEFAULT_CACHE_DIR
+            was_valid = False
+        if "cacheSize" not in self.config['Application']:
+            self.config["Application"]["cacheSize"] = "512"
+            was_valid = False
+        if "cacheMaxAge" not in self.config['Application']:
+            self.config["Application"]["cacheMaxAge"] = "30"
+            was_valid = False
+        if "pageCacheSize" not in self.config['Application']:
+            self.config["Application"]["pageCacheSize"] = "10"
+            was_valid = False
+        if "viewerPoolMemory" not in self.config['Application']:
+            self.config["Application"]["viewerPoolMemory"] = "120"
+            was_valid = False
+        if "comicCacheMemory" not in self.config['Application']:
+            self.config["Application"]["comicCacheMemory"] = "256"
+            was_valid = False
+        if "hotBooks" not in self.config['Application']:
+            self.config["Application"]["hotBooks"] = "4"
+            was_valid = False
+        if "hotBooksMemory" not in self.config['Application']:
+            self.config["Application"]["hotBooksMemory"] = "32"
             was_valid = False
         if "javascript" not in self.config['Application']:
             self.config["Application"]["javascript"] = "False"
@@ -67,6 +102,15 @@ class ConfigProvider:
         if "stylesheet" not in self.config['Application']:
             self.config["Application"]["stylesheet"] = "Day"
             was_valid = False
+        if "paginated" not in self.config['Application']:
+            self.config["Application"]["paginated"] = "False"
+            was_valid = False
+        if "watchBook" not in self.config['Application']:
+            self.config["Application"]["watchBook"] = "False"
+            was_valid = False
+        if "opdsCatalog" not in self.config['Application']:
+            self.config["Application"]["opdsCatalog"] = ""
+            was_valid = False
         if not was_valid:  # Something changed?
             self.save_configuration()
 
@@ -83,20 +127,22 @@ class ConfigProvider:
         :param book_md5:
         """
         self.config[book_md5] = {}
-        self.config[book_md5]["bookmarks"] = "0"
         self.config[book_md5]["chapter"] = "0"
         self.config[book_md5]["position"] = "0.0"
+        self.config[book_md5]["page"] = "0"
         self.save_configuration()
 
-    def save_chapter_position(self, book_md5, chapter, pos):
+    def save_chapter_position(self, book_md5, chapter, pos, page=0):
         """
         Helper method to easily save book chapter position and scroll offset
         :param book_md5:
         :param chapter:
         :param pos:
+        :param page: Page of chapter in paginated mode
         """
         self.config[book_md5]["chapter"] = str(chapter)
         self.config[book_md5]["position"] = str(pos)
+        self.config[book_md5]["page"] = str(page)
         self.save_configuration()
 
     def save_last_book(self, file):
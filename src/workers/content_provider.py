@@ -14,15 +14,26 @@
 # Fifth Floor, Boston, MA 02110-1301, USA.
 
 
+import collections
 import functools
-import hashlib
 import os
-import shutil
-import urllib
+import posixpath
+import urllib.parse
 import zipfile
 import itertools
+from html.parser import HTMLParser
+from xml.etree.ElementTree import ParseError
 
 from workers.xml2obj import *
+from workers.extractor import Extractor
+from workers.cache_manager import CacheManager
+from workers.chapter_transformer import ChapterTransformer
+from workers.scheduler import MAINTENANCE
+from workers.font_obfuscation import ENCRYPTION_MEMBER, FontDeobfuscator, obfuscation_keys, stylesheet_urls
+from workers.book_session import BookSession, calculate_book_md5
+from workers.download import DownloadCache
+from workers.history import History
+from workers.validator import BookValidator, member_name
 
 # What happens here is:
 # 1. Read META-INF/container.xml that every ePub should have
@@ -36,6 +47,44 @@ from workers.xml2obj import *
 # 9. Compare list from NCX with OPF list and append not chaptered files
 # Every file path is created like this: path to tmp folder + path to OPF file location + path to file read from OPF/NCX
 # Bonus: do bunch of other stuff like setting data based on uri, telling when book loaded etc.
+#
+# Files are extracted in the background while all of the above happens. Every step waits only for the files
+# it needs right now: container.xml, then OPF and NCX, then the chapter reader resumes at and files it links to.
+# The rest is extracted in spine order, anything viewer asks for in the meantime jumps the queue.
+# Book from a catalog may still be downloading, then extraction reads parts of it over range requests.
+
+
+def child_nodes(node, name):
+    """
+    Returns child elements parsed by xml2obj as a list, no matter if there are none, one or many of them
+    :param node: Parent node, may be None or text when element is empty
+    :param name: Name of child elements
+    :return list of nodes:
+    """
+    children = getattr(node, name, None) if node else None
+    if not children:
+        return []
+    return list(children) if isinstance(children, list) else [children]
+
+
+# Collects files a chapter needs to be displayed (stylesheets, images etc.), links to other chapters are skipped
+class DependencyParser(HTMLParser):
+    # Attributes of each tag that point to a dependency
+    ATTRIBUTES = {"link": ("href",), "img": ("src",), "image": ("href", "xlink:href"), "script": ("src",),
+                  "source": ("src",), "audio": ("src",), "video": ("src", "poster"), "embed": ("src",),
+                  "iframe": ("src",), "object": ("data",)}
+
+    def __init__(self):
+        super().__init__()
+        self.urls = []
+
+    def handle_starttag(self, tag, attrs):
+        names = self.ATTRIBUTES.get(tag.lower(), ())
+        for name, value in attrs:
+            if name.lower() in names and value:
+                self.urls.append(value)
+
+    handle_startendtag = handle_starttag
 
 
 # Takes a 'navPoint' node (or a 'navMap' node) returned by xml2obj and recursivly constructs a hierarchy of NavPoints
@@ -47,9 +96,14 @@ class NavPoint:
             self.content = node.content.src         # e.g.: "Text/ch15.html#part3"
             self.file = self.content.split('#')[0]  # e.g.: "Text/ch15.html"
             self.has_anchor = len(self.content.split('#')) > 1
-            self.file_number = self.files.index(self.file)
+            # Links to files that are not chapters are removed by prune()
+            self.file_number = self.files.index(self.file) if self.file in self.files else None
         else:
             self.text = "" # Only the root node ('navMap') does not have 'text' or 'content'
+            self.content = ""
+            self.file = None
+            self.has_anchor = False
+            self.file_number = None
 
         # The next part looks complex, and that's because it is...
         #
@@ -94,6 +148,19 @@ class NavPoint:
                     self.children.append(new_child)
                     prev_child = new_child
 
+    def prune(self):
+        """
+        Removes children that don't lead to a chapter, their own children take their place
+        """
+        children = []
+        for child in self.children:
+            child.prune()
+            if child.file_number is None:
+                children.extend(child.children)
+            else:
+                children.append(child)
+        self.children = children
+
     # This was useful when writing this class
     def print(self):
         self.__print_recursive(0)
@@ -113,56 +180,147 @@ class ContentProvider:
         :param window: Main application window reference, serves as communication hub
         """
         self.__window = window
-        # Checks if cache folder exists
-        self.__cache_path = self.__window.config_provider.config["Application"]["cacheDir"]
-        if not os.path.exists(self.__cache_path):
-            os.mkdir(self.__cache_path)  # If not create it
+        # Creates cache folder if needed, every book gets its own directory inside
+        config = self.__window.config_provider.config["Application"]
+        self.__cache_manager = CacheManager(os.path.expanduser(config["cacheDir"]),
+                                            int(config["cacheSize"]) * 1024 * 1024,
+                                            int(config["cacheMaxAge"]) * 24 * 60 * 60)
+        # Chapters are cleaned up on worker threads before they are displayed
+        self.__transformer = ChapterTransformer(self.__cache_manager.transformed_path, window.scheduler)
+        # Books from catalogs, opened while they download
+        self.downloads = DownloadCache(self.__cache_manager.downloads_path, window.fetcher, window.scheduler)
+        self.__cleanup_task = None
         self.__ready = False
-        self.book_name = ""
+        # State of currently open book, None when no book is open
+        self.session = None
+        # Sessions of recently open books kept around so switching back to them is instant, least recent first
+        self.__hot_sessions = collections.OrderedDict()
+        self.__hot_books = int(config["hotBooks"])
+        self.__hot_books_memory = int(config["hotBooksMemory"]) * 1024 * 1024
+
+    @property
+    def files(self):
+        return self.session.files if self.session is not None else []
+
+    @property
+    def index(self):
+        return self.session.index if self.session is not None else None
 
-        # The 'button' navigation in the header bar uses this. It is based on the 'spine' in the content.opf file
-        self.files = []
-        # The treeview navigation uses this. It is based on the NCX file.
-        self.index = None
+    @property
+    def book_name(self):
+        return self.session.book_name if self.session is not None else ""
 
+    @property
+    def book_author(self):
+        return self.session.book_author if self.session is not None else ""
 
+    @property
+    def book_md5(self):
+        return self.session.book_md5 if self.session is not None else None
 
-    def prepare_book(self, file_path):
+    def prepare_book(self, file_path, download=None):
         """
         Loads book meta data and chapters
         :param file_path:
+        :param download: Download book is read from while it's downloading, file_path is where it ends up
         :return True when book loaded successfully, False when loading failed:
         """
 
-        # Clears any old files from the cache
-        if os.path.exists(self.__cache_path):
-            shutil.rmtree(self.__cache_path)
+        # Old book stays hot, it's released once it falls out of hot set
+        self.suspend_book()
+
+        # Book downloaded from a catalog keeps MD5 it was first opened with, whichever way it's opened again
+        if download is None:
+            download = self.downloads.find(file_path)
+
+        # Recently open book is ready as is, file does not even need to be hashed
+        for md5, session in self.__hot_sessions.items():
+            if session.is_current(file_path):
+                del self.__hot_sessions[md5]
+                self.session = session
+                self.__ready = True
+                print("Switched to hot book: " + file_path)
+                return True
+
+        # Calculates MD5 of book (for use in bookmarks and as cache key)
+        if download is not None:
+            md5 = download.book_md5
+        else:
+            try:
+                md5 = calculate_book_md5(file_path)
+            except IOError:
+                return False
+
+        # Same book opened from another file, hot session of it would only hold second lock on the same cache entry
+        stale_session = self.__hot_sessions.pop(md5, None)
+        if stale_session is not None:
+            stale_session.close()
 
-        # Extracts new book
-        try:
-            zipfile.ZipFile(file_path).extractall(path=self.__cache_path)
-        except:
-            # Is not zip file
-            self.__ready = False
+        # Unpacked book is read in place, there is nothing to extract or copy
+        if os.path.isdir(file_path):
+            self.session = BookSession(file_path, md5, None, None)
+            if not self.__parse_package():
+                self.close_book()
+                return False
+            self.__ready = True
+            return True
+
+        # Opens cache directory of book, other instances may have it open or be extracting it too
+        cache_entry = self.__cache_manager.acquire(md5)
+        self.session = BookSession(file_path, md5, self.__cache_manager, cache_entry, download)
+        session = self.session
+
+        # Starts extracting new book in the background unless it's cached already
+        if self.__cache_manager.begin_fill(cache_entry):
+            try:
+                # Book that is still downloading is read over range requests
+                opener = download.open if download is not None and not download.complete else None
+                session.extractor = Extractor(file_path, session.cache_path, store=self.__cache_manager.store,
+                                              opener=opener)
+                session.extractor.on_finished = lambda success: self.__cache_manager.finish_fill(cache_entry,
+                                                                                                 success)
+                session.extractor.wait_for(["META-INF/container.xml"])
+            except:
+                # Is not zip file
+                self.close_book()
+                return False
+
+        if not self.__parse_package():
+            self.close_book()
             return False
 
-        # Sets permissions
-        os.system("chmod 700 " + self.__cache_path)
+        # Trims cache without delaying the book
+        if self.__cleanup_task is None or self.__cleanup_task.done():
+            self.__cleanup_task = self.__window.scheduler.submit(self.__cache_manager.cleanup, MAINTENANCE)
+
+        # End of preparations
+        self.__ready = True
+        return True
 
+    def __parse_package(self):
+        """
+        Reads metadata, reading order and chapters index of current session's book
+        :return True when book has something to display:
+        """
+        session = self.session
         # Finds opf file
-        if os.path.exists(os.path.join(self.__cache_path, "META-INF/container.xml")):
+        if os.path.exists(os.path.join(session.cache_path, "META-INF/container.xml")):
+
+            # Waits for OPF file
+            try:
+                if session.extractor is not None:
+                    session.extractor.wait_for([self.__get_opf_file_path])
+            except zipfile.BadZipFile:
+                return False
 
             # Gets metadata
             metadata = self.__get_metadata
 
-            # Calculates MD5 of book (for use in bookmarks)
-            md5 = self.__calculate_book_md5(self.__window.filename)
-
             # Sets metadata
             try:
-                self.book_name = str(bytes.decode(str(metadata.metadata.dc_title).encode("utf-8")))
+                session.book_name = str(bytes.decode(str(metadata.metadata.dc_title).encode("utf-8")))
             except AttributeError:
-                self.book_name = _("Unknown book")
+                session.book_name = _("Unknown book")
 
             try:
                 raw_author = str(bytes.decode(str(metadata.metadata.dc_creator).encode("utf-8")))
@@ -177,41 +335,186 @@ class ContentProvider:
                     processed_author += self.find_between(raw_author, "data:'", "'")
                     raw_author = raw_author[raw_author.index("data:") + len("data:"):]
                 if processed_author == "":
-                    self.book_author = str(bytes.decode(str(metadata.metadata.dc_creator).encode("utf-8")))
+                    session.book_author = str(bytes.decode(str(metadata.metadata.dc_creator).encode("utf-8")))
                 else:
-                    self.book_author = processed_author
+                    session.book_author = processed_author
             except AttributeError:
-                self.book_author = _("Unknown author(s)")
-
-            self.book_md5 = md5.hexdigest()
+                session.book_author = _("Unknown author(s)")
 
             # Adds book to config (for use in bookmarks)
             if self.book_md5 not in self.__window.config_provider.config:
                 self.__window.config_provider.add_book_to_config(self.book_md5)
 
             # Get oebps
-            self.__oebps = self.__get_oebps
+            session.oebps = self.__get_oebps
 
             # Loads titles and file paths
             self.__load_titles_and_files()
+            if self.chapter_count == 0:
+                # Book has nothing to display
+                return False
 
-            # Validates files
-            #self.__validate_files(metadata)
-
-            # End of preparations
-            self.__ready = True
+            # Chapter reader resumes at comes first, remaining chapters are extracted in spine order
+            if session.extractor is not None:
+                session.extractor.reorder([session.extractor.member_name(self.get_chapter_file_path(i))
+                                          for i in range(self.chapter_count)])
+            resume_chapter = int(self.__window.config_provider.config[self.book_md5]["chapter"])
+            if 0 <= resume_chapter < self.chapter_count and session.extractor is not None:
+                # It's waited for by the task cleaning it up for display, not here
+                session.extractor.promote([session.extractor.member_name(self.get_chapter_file_path(resume_chapter))])
             return True
         else:  # Else returns False to indicate errors
-            self.__ready = False
             return False
 
+    def reload_book(self):
+        """
+        Brings open book up to date after its file was rebuilt. Only members whose CRC or size changed are
+        extracted again, the rest is linked from previous cache entry. Package is parsed again only when OPF, NCX
+        or the list of members changed.
+        :return set of names of changed members, None when file can't be read yet (ie. it's still being written):
+        """
+        old_session = self.session
+        if old_session is None or old_session.unpacked:
+            return None
+        # Downloaded book file is only ever written by its download
+        if old_session.download is not None:
+            return set()
+        file_path = old_session.file_path
+        try:
+            with zipfile.ZipFile(file_path) as zip_file:
+                members = {member.filename: (member.CRC, member.file_size) for member in zip_file.infolist()}
+            md5 = calculate_book_md5(file_path)
+        except (zipfile.BadZipFile, OSError):
+            return None
+        changed = {name for name, info in members.items() if old_session.members.get(name) != info}
+        changed |= set(old_session.members) - set(members)
+        if md5 == old_session.book_md5:
+            old_session.refresh_stat()
+            return set()
+
+        # Members that did not change and are extracted already don't have to be inflated again
+        previous = [name for name in members if name not in changed and
+                    (old_session.extractor is None or old_session.extractor.is_extracted(name))]
+
+        stale_session = self.__hot_sessions.pop(md5, None)
+        if stale_session is not None:
+            stale_session.close()
+        cache_entry = self.__cache_manager.acquire(md5)
+        session = BookSession(file_path, md5, self.__cache_manager, cache_entry)
+        if self.__cache_manager.begin_fill(cache_entry):
+            try:
+                session.extractor = Extractor(file_path, session.cache_path, store=self.__cache_manager.store,
+                                              previous=(old_session.cache_path, previous))
+                session.extractor.on_finished = lambda success: self.__cache_manager.finish_fill(cache_entry,
+                                                                                                 success)
+                session.extractor.wait_for(["META-INF/container.xml"])
+            except (zipfile.BadZipFile, OSError):
+                session.close()
+                return None
+
+        # New version of book starts where the old one was
+        config_provider = self.__window.config_provider
+        if md5 not in config_provider.config:
+            config_provider.config[md5] = dict(config_provider.config[old_session.book_md5])
+            config_provider.save_configuration()
+
+        self.session = session
+        if changed & old_session.package_members or set(members) != set(old_session.members):
+            if not self.__parse_package():
+                session.close()
+                self.session = old_session
+                return None
+        else:
+            session.members = members
+            for name in ("oebps", "book_name", "book_author", "files", "index", "manifest", "spine",
+                         "toc_targets", "package_members", "obfuscated_fonts"):
+                setattr(session, name, getattr(old_session, name))
+            self.__open_fonts(session)
+            if "chapters" in old_session.views:
+                session.views["chapters"] = old_session.views["chapters"]
+            if session.extractor is not None:
+                session.extractor.reorder([session.extractor.member_name(self.get_chapter_file_path(i))
+                                          for i in range(self.chapter_count)])
+
+        # Pages visited in old version are still there, just in another directory
+        session.history = old_session.history
+        session.history.relocate(old_session.cache_path, session.cache_path)
+        old_session.history = History()
+        old_session.close()
+        self.__window.scheduler.cancel_book(old_session.book_md5)
+        print("Reloaded %s: %d changed files" % (file_path, len(changed)))
+        return changed
+
+    def chapter_needs(self, chapter, names):
+        """
+        Tells if chapter or any file it links to is among given members
+        :param chapter: Chapter number
+        :param names: Member names
+        :return True when chapter is affected:
+        """
+        session = self.session
+        name = posixpath.normpath(posixpath.join(session.oebps, self.files[chapter]))
+        if name in names:
+            return True
+        return any(dependency in names for dependency in self.__get_dependencies(session, name))
+
+    def wait_for_cleanup(self):
+        """
+        Blocks until cache cleanup started by opening a book is done, for batch jobs measuring what is left behind
+        """
+        if self.__cleanup_task is not None:
+            self.__cleanup_task.wait()
+
+    def extract_all(self):
+        """
+        Blocks until every file of current book is extracted, raises zipfile.BadZipFile if any failed
+        """
+        if self.session is not None and self.session.extractor is not None:
+            self.session.extractor.extract_all()
+
+    def close_book(self):
+        """
+        Closes session of current book, nothing of it is kept afterwards
+        """
+        self.__ready = False
+        if self.session is not None:
+            self.session.close()
+            self.__window.scheduler.cancel_book(self.session.book_md5)
+            self.session = None
+
+    def suspend_book(self):
+        """
+        Moves session of current book to hot set, evicts least recently open books that don't fit in anymore
+        """
+        self.__ready = False
+        if self.session is not None:
+            self.__hot_sessions.pop(self.session.book_md5, None)
+            self.__hot_sessions[self.session.book_md5] = self.session
+            self.session = None
+        memory = sum(session.memory_estimate for session in self.__hot_sessions.values())
+        while self.__hot_sessions and (len(self.__hot_sessions) > self.__hot_books or
+                                       memory > self.__hot_books_memory):
+            md5, session = self.__hot_sessions.popitem(last=False)
+            memory -= session.memory_estimate
+            session.close()
+            self.__window.scheduler.cancel_book(md5)
+            print("Evicted hot book: " + session.file_path)
+
+    @property
+    def hot_sessions(self):
+        """
+        Returns sessions of recently open books other than current one
+        :return list of BookSessions, most recent first:
+        """
+        return list(reversed(self.__hot_sessions.values()))
+
     @property
     def __get_opf_file_path(self):
         """
         Finds and returns OPF file path
         :return OPF file path:
         """
-        container_data = xml2obj(open(os.path.join(self.__cache_path, "META-INF/container.xml"), "r"))
+        container_data = xml2obj(open(os.path.join(self.session.cache_path, "META-INF/container.xml"), "r"))
         return container_data.rootfiles.rootfile.full_path
 
     @property
@@ -224,7 +527,7 @@ class ContentProvider:
         # Gets OPF file path
         opf_file_path = self.__get_opf_file_path
         # Loads OPF file and parse it
-        return xml2obj(open(os.path.join(self.__cache_path, opf_file_path), "r"))
+        return xml2obj(open(os.path.join(self.session.cache_path, opf_file_path), "r"))
 
     @property
     def __get_oebps(self):
@@ -244,62 +547,93 @@ class ContentProvider:
         # Gets metadata object
         metadata = self.__get_metadata
         # Finds NCX file
-        for x in metadata.manifest.item:
+        for x in child_nodes(metadata.manifest, "item"):
             if x.media_type == "application/x-dtbncx+xml":
-                return os.path.join(self.__cache_path, self.__get_oebps, x.href)
-
-    def __calculate_book_md5(self, file_path):
-        """
-        Calculates and returns unique MD5 hash based on book content to be used in config
-        :param file_path:
-        :return MD5 hash of book content:
-        """
-        md5 = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            while True:
-                piece = f.read(28 * md5.block_size)
-                if not piece:
-                    break
-                md5.update(piece)
-        f.close()
-        return md5
+                return os.path.join(self.session.cache_path, self.__get_oebps, x.href)
 
     def __load_titles_and_files(self):
         """
-        Loads titles and chapter file paths
+        Loads titles and chapter file paths, chapters missing in archive are left out
         """
+        session = self.session
         ncx_file_path = self.__get_ncx_file_path
         metadata = self.__get_metadata
-        self.chapter_links = []
-        chapter_order = []
-        for x in metadata.spine.itemref:
-            self.files.append([y.href for y in metadata.manifest.item if y.id == x.idref][0])
-
-        self.titles = []
-        if os.access(ncx_file_path, os.R_OK):  # Checks if NCX is accessible
+        # Files package is read from, book has to be parsed again when they change
+        session.package_members = {"META-INF/container.xml", posixpath.normpath(self.__get_opf_file_path)}
+        if ncx_file_path is not None:
+            session.package_members.add(os.path.relpath(ncx_file_path, session.cache_path).replace(os.sep, "/"))
+        # Only central directory is checked here, the rest is done by validate() in the background
+        session.members = self.__read_central_directory()
+        members = session.members
+        if ENCRYPTION_MEMBER in members:
+            session.package_members.add(ENCRYPTION_MEMBER)
+            self.__load_obfuscated_fonts()
+        available = lambda href: member_name(session.oebps, href) in members
+
+        session.manifest = {x.id: (x.href, x.media_type) for x in child_nodes(metadata.manifest, "item")}
+        session.spine = [x.idref for x in child_nodes(metadata.spine, "itemref")]
+        files = session.files
+        for idref in session.spine:
+            if idref in session.manifest and available(session.manifest[idref][0]):
+                files.append(session.manifest[idref][0])
+        if not files:
+            # Nothing in reading order can be read, generates one from documents in manifest
+            files.extend(href for href, media_type in session.manifest.values()
+                         if media_type == "application/xhtml+xml" and available(href))
+
+        if ncx_file_path is not None:
+            self.ensure_extracted(ncx_file_path)
+        if ncx_file_path is not None and os.access(ncx_file_path, os.R_OK):  # Checks if NCX is accessible
             # Parse NCX file
             ncx_tree = xml2obj(open(ncx_file_path))
-            self.index = NavPoint(self.files, ncx_tree.navMap)
+            # Chapters listed only in NCX go after the spine
+            pending = child_nodes(ncx_tree.navMap, "navPoint")
+            while pending:
+                node = pending.pop(0)
+                pending.extend(child_nodes(node, "navPoint"))
+                if node.content and node.content.src:
+                    session.toc_targets.append(node.content.src)
+                    file = node.content.src.split('#')[0]
+                    if file not in files and available(file):
+                        files.append(file)
+            session.index = NavPoint(files, ncx_tree.navMap)
+            session.index.prune()
             # self.index.print()
 
-    def __validate_files(self, metadata):
-        """
-        Validates files and reloads them if necessary
-        :param metadata:
-        """
-        # TODO: This is the most terrible way to validate anything. Needs real re-write
-        # Why is it checking only one path, why does it asume any of files links from manifest are correct?
-        if not os.path.exists(os.path.join(self.__cache_path, self.__oebps, self.chapter_links[0])):
-            # Reloads files
-            self.chapter_links = []
-            for x in metadata.manifest.item:
-                if x.media_type == "application/xhtml+xml":
-                    self.chapter_links.append(x.href)
-            self.titles = []
-            i = 1
-            while not len(self.titles) == len(self.chapter_links):
-                self.titles.append(_("Chapter %s") % (str(i)))
-                i += 1
+    def __read_central_directory(self):
+        """
+        Returns CRC and size of every file in book archive
+        :return dictionary of member name: (CRC-32, size), CRC-32 is None for unpacked book:
+        """
+        if self.session.unpacked:
+            members = {}
+            for root, dirs, files in os.walk(self.session.cache_path):
+                for name in files:
+                    path = os.path.join(root, name)
+                    try:
+                        size = os.path.getsize(path)
+                    except OSError:
+                        continue
+                    members[os.path.relpath(path, self.session.cache_path).replace(os.sep, "/")] = (None, size)
+            return members
+        if self.session.extractor is not None:
+            return {member.filename: (member.CRC, member.file_size) for member in self.session.extractor.members}
+        try:
+            with zipfile.ZipFile(self.session.file_path) as zip_file:
+                return {member.filename: (member.CRC, member.file_size) for member in zip_file.infolist()}
+        except (zipfile.BadZipFile, OSError):
+            return {}
+
+    def validate(self, on_finished):
+        """
+        Starts checking current book for missing and damaged files in the background, once per book
+        :param on_finished: Called on UI thread with ValidationReport
+        """
+        session = self.session
+        if session is None or session.validator is not None:
+            return
+        session.validator = BookValidator(session)
+        session.validator.start(self.__window.scheduler, on_finished)
 
     @property
     def chapter_count(self):
@@ -323,11 +657,165 @@ class ContentProvider:
         :param number:
         :return chapter file:
         """
-        return os.path.join(self.__cache_path, self.__oebps, self.files[number])
+        return os.path.join(self.session.cache_path, self.session.oebps, self.files[number])
 
 
     def complete_chapter_file_path(self, partial_file_path):
-        return os.path.join(self.__cache_path, self.__oebps, partial_file_path)
+        return os.path.join(self.session.cache_path, self.session.oebps, partial_file_path)
+
+    def ensure_extracted(self, path, session=None):
+        """
+        Blocks until file and files it links to are extracted, moves them to the front of extraction queue
+        :param path: Path or file:// uri inside of cache folder, anchors are ignored
+        :param session: BookSession file belongs to, current one when None
+        """
+        session = session or self.session
+        if session is None or session.extractor is None:
+            return
+        if path.startswith("file://"):
+            path = urllib.parse.unquote(path[len("file://"):])
+        name = session.extractor.member_name(path.split('#')[0])
+        if name is None or name in session.ensured:
+            return
+        try:
+            session.extractor.wait_for([name])
+            session.ensured.add(name)
+            session.extractor.wait_for(self.__get_dependencies(session, name))
+        except zipfile.BadZipFile as e:
+            print("Could not extract: ", path, e)
+
+    def ensure_resource(self, uri):
+        """
+        Makes sure file WebKit is about to read is extracted. Files chapter links to were extracted before it was
+        shown, so this only waits for the others (ie. fonts and images stylesheets refer to), and for nothing else.
+        :param uri: file:// uri inside of cache folder
+        """
+        session = self.session
+        if session is None or session.extractor is None:
+            return
+        name = session.extractor.member_name(urllib.parse.unquote(uri[len("file://"):]).split('#')[0])
+        if name is None or name in session.ensured or session.extractor.is_extracted(name):
+            return
+        try:
+            session.extractor.wait_for([name])
+        except zipfile.BadZipFile as e:
+            print("Could not extract: ", uri, e)
+
+    def transform_chapter(self, path, priority, on_finished):
+        """
+        Cleans chapter of current book for display in the background, cleaned chapter is cached
+        :param path: Path of extracted chapter file
+        :param priority: Priority class of scheduler, depends on whether the user waits for the chapter
+        :param on_finished: Called on UI thread with path of file to display, right away when path is not in the book
+        :return Task or None:
+        """
+        session = self.session
+        if session is None or not path.startswith(os.path.join(session.cache_path, "")):
+            on_finished(path)
+            return None
+        if session.fonts is not None:
+            self.__window.scheduler.submit(lambda: self.__prepare_fonts(session, path), priority,
+                                           book=session.book_md5)
+        # Book might still be extracting, chapter and files it links to are waited for on the worker
+        return self.__transformer.transform_async(session.book_md5, session.cache_path, path, priority, on_finished,
+                                                  lambda: self.ensure_extracted(path, session))
+
+    def resource_uri(self, uri):
+        """
+        Returns uri WebKit should read a file of current book from, obfuscated fonts are read de-obfuscated
+        :param uri: file:// uri of extracted file
+        :return uri:
+        """
+        session = self.session
+        if session is None or session.fonts is None:
+            return uri
+        path = urllib.parse.unquote(uri[len("file://"):]).split('#')[0]
+        name = os.path.relpath(path, session.cache_path).replace(os.sep, "/")
+        if not session.fonts.is_obfuscated(name):
+            return uri
+        # Chapter referred to font in a way that was not seen ahead of time, it's quick enough to do right now
+        font_path = session.fonts.font_path(name)
+        return "file://" + urllib.parse.quote(font_path) if font_path is not None else uri
+
+    def __load_obfuscated_fonts(self):
+        """
+        Reads which fonts of current book are obfuscated and how
+        """
+        session = self.session
+        try:
+            if session.extractor is not None:
+                session.extractor.wait_for([ENCRYPTION_MEMBER])
+            session.obfuscated_fonts = obfuscation_keys(os.path.join(session.cache_path, ENCRYPTION_MEMBER),
+                                                        os.path.join(session.cache_path, self.__get_opf_file_path))
+        except (zipfile.BadZipFile, OSError, ParseError) as e:
+            print("Could not read obfuscated fonts: ", e)
+            session.obfuscated_fonts = {}
+        self.__open_fonts(session)
+
+    def __open_fonts(self, session):
+        if session.obfuscated_fonts:
+            session.fonts = FontDeobfuscator(session.cache_path,
+                                             os.path.join(self.__cache_manager.fonts_path, session.book_md5),
+                                             session.obfuscated_fonts)
+        else:
+            session.fonts = None
+
+    def __prepare_fonts(self, session, chapter_path):
+        """
+        De-obfuscates fonts chapter refers to in its styles and stylesheets, runs on a worker thread
+        :param session: BookSession chapter belongs to
+        :param chapter_path: Path of extracted chapter file
+        """
+        name = os.path.relpath(chapter_path, session.cache_path).replace(os.sep, "/")
+        stylesheets = [name] + [dependency for dependency in self.__get_dependencies(session, name)
+                                if dependency.lower().endswith(".css")]
+        for stylesheet in stylesheets:
+            if session.closed:
+                return
+            try:
+                if session.extractor is not None:
+                    session.extractor.wait_for([stylesheet])
+                with open(os.path.join(session.cache_path, stylesheet), encoding="utf-8", errors="replace") as file:
+                    urls = stylesheet_urls(file.read())
+            except (zipfile.BadZipFile, OSError):
+                continue
+            for url in urls:
+                parts = urllib.parse.urlsplit(url)
+                if parts.scheme or parts.netloc or not parts.path:
+                    continue
+                font = posixpath.normpath(posixpath.join(posixpath.dirname(stylesheet),
+                                                         urllib.parse.unquote(parts.path)))
+                if session.fonts is not None and session.fonts.is_obfuscated(font):
+                    try:
+                        if session.extractor is not None:
+                            session.extractor.wait_for([font])
+                    except zipfile.BadZipFile:
+                        continue
+                    session.fonts.font_path(font)
+
+    def __get_dependencies(self, session, name):
+        """
+        Finds files (stylesheets, images etc.) that given HTML file needs to be displayed
+        :param session: BookSession file belongs to
+        :param name: Member name of HTML file
+        :return list of member names:
+        """
+        if not name.lower().endswith((".html", ".htm", ".xhtml", ".xml")):
+            return []
+        parser = DependencyParser()
+        try:
+            with open(os.path.join(session.cache_path, name), encoding="utf-8", errors="replace") as file:
+                parser.feed(file.read())
+        except IOError:
+            return []
+        dependencies = []
+        for url in parser.urls:
+            parts = urllib.parse.urlsplit(url)
+            if parts.scheme or parts.netloc or not parts.path:
+                continue
+            dependencies.append(posixpath.normpath(posixpath.join(posixpath.dirname(name),
+                                                                  urllib.parse.unquote(parts.path))))
+        return dependencies
 
     def uri_to_chapter(self, uri):
         """
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+
+from workers.scheduler import PREFETCH
+
+# Books from catalogs are downloaded into <cacheDir>/downloads/<book md5>/book.epub. Book MD5 of a download
+# is calculated from its URL and the validator server sent (ETag, Last-Modified or length), the same way unpacked
+# books are keyed by their directory, so reading position and extracted files can be found before the whole file
+# is there.
+#
+# When server supports range requests, book is opened while it's still downloading. The file is split into
+# blocks, zip reader fetches the blocks it needs (central directory at the end of the file, then OPF, then the
+# chapter reader resumes at) and the rest is fetched in order in the background. Partially downloaded file is
+# book.epub.part, it's renamed once every block is there. Servers without range support get the whole file
+# downloaded before the book opens.
+
+BOOK_NAME = "book.epub"
+METADATA_NAME = "download.json"
+
+BLOCK_SIZE = 64 * 1024
+# Blocks fetched at once by background download
+SEQUENTIAL_BLOCKS = 16
+
+MISSING = 0
+FETCHING = 1
+PRESENT = 2
+
+
+class RangeReader(io.RawIOBase):
+    def __init__(self, download):
+        """
+        Seekable file object reading a book that is being downloaded, reads block until data is there
+        :param download: Download
+        """
+        super(RangeReader, self).__init__()
+        self.__download = download
+        self.__position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.__position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += self.__download.length
+        if offset < 0:
+            raise OSError("Negative seek position")
+        self.__position = offset
+        return offset
+
+    def readinto(self, buffer):
+        data = self.__download.read(self.__position, len(buffer))
+        buffer[:len(data)] = data
+        self.__position += len(data)
+        return len(data)
+
+
+class Download:
+    def __init__(self, fetcher, url, directory, book_md5, length):
+        """
+        Book file downloaded block by block, blocks can be read as soon as they arrive
+        :param fetcher: HttpFetcher
+        :param url: URL of book
+        :param directory: Directory book is downloaded to
+        :param book_md5: MD5 book is known by
+        :param length: Size of book in bytes, None when server did not tell
+        """
+        self.__fetcher = fetcher
+        self.url = url
+        self.book_md5 = book_md5
+        self.path = os.path.join(directory, BOOK_NAME)
+        self.__part_path = self.path + ".part"
+        self.__condition = threading.Condition()
+        self.__scheduler = None
+        self.__task = None
+        self.__stopped = False
+        # Why background download stopped, None while it's running or done
+        self.__error = None
+        # Bytes that came over network
+        self.bytes_fetched = 0
+
+        if os.path.exists(self.path):
+            self.length = os.path.getsize(self.path)
+            self.__fd = os.open(self.path, os.O_RDONLY)
+            self.__blocks = bytearray([PRESENT]) * self.__block_count()
+        else:
+            self.length = length
+            self.__fd = os.open(self.__part_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+            if length is not None:
+                os.ftruncate(self.__fd, length)
+            self.__blocks = bytearray(self.__block_count())
+        self.__missing = self.__blocks.count(MISSING)
+
+    @property
+    def complete(self):
+        with self.__condition:
+            return self.__missing == 0 and self.length is not None
+
+    @property
+    def progress(self):
+        """
+        Returns how much of book is downloaded
+        :return fraction between 0 and 1:
+        """
+        with self.__condition:
+            if self.length is None:
+                return 0.0
+            blocks = len(self.__blocks)
+            return (blocks - self.__missing) / blocks if blocks else 1.0
+
+    def open(self):
+        """
+        Opens book for reading, can be called while book is downloading
+        :return seekable binary file object:
+        """
+        return io.BufferedReader(RangeReader(self), BLOCK_SIZE)
+
+    def start(self, scheduler):
+        """
+        Downloads blocks nobody asked for yet in background, in order, a few at a time
+        :param scheduler: Scheduler download runs on
+        """
+        self.__scheduler = scheduler
+        self.__schedule()
+
+    def fill(self, response):
+        """
+        Downloads whole book from response, used when server does not support range requests
+        :param response: http.client.HTTPResponse with whole file as body
+        """
+        offset = 0
+        while True:
+            chunk = response.read(BLOCK_SIZE * SEQUENTIAL_BLOCKS)
+            if not chunk:
+                break
+            os.pwrite(self.__fd, chunk, offset)
+            offset += len(chunk)
+        with self.__condition:
+            self.bytes_fetched += offset
+            if self.length is not None and offset != self.length:
+                raise http.client.IncompleteRead(b"", self.length - offset)
+            self.length = offset
+            self.__blocks = bytearray([PRESENT]) * self.__block_count()
+            self.__missing = 0
+            self.__finish()
+
+    def read(self, offset, size):
+        """
+        Reads part of book, blocks until it's downloaded, fetching it first when nobody fetches it yet
+        :param offset:
+        :param size: Number of bytes, fewer are returned at the end of book
+        :return bytes:
+        """
+        size = max(0, min(size, self.length - offset))
+        if size == 0:
+            return b""
+        first = offset // BLOCK_SIZE
+        last = (offset + size - 1) // BLOCK_SIZE
+        while True:
+            with self.__condition:
+                missing = [block for block in range(first, last + 1) if self.__blocks[block] == MISSING]
+                if not missing:
+                    if all(self.__blocks[block] == PRESENT for block in range(first, last + 1)):
+                        break
+                    # Somebody else is fetching them, they are marked missing again if that fails
+                    self.__condition.wait()
+                    continue
+                # Fetches first run of missing blocks, whole runs are asked for in one request
+                start = missing[0]
+                end = start
+                while end + 1 <= last and self.__blocks[end + 1] == MISSING:
+                    end += 1
+                self.__mark(start, end, FETCHING)
+            self.__fetch(start, end)
+        return os.pread(self.__fd, size, offset)
+
+    def wait(self, timeout=None):
+        """
+        Waits for download to finish
+        :param timeout: Seconds to wait, None to wait as long as it takes
+        :return True when book is completely downloaded:
+        """
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__missing == 0 or self.__error is not None, timeout)
+            return self.__missing == 0
+
+    def cancel(self):
+        """
+        Stops background download, blocks that are asked for are still fetched
+        """
+        with self.__condition:
+            self.__stopped = True
+            if self.__task is not None:
+                self.__task.cancel()
+                self.__task = None
+
+    def __block_count(self):
+        return (self.length + BLOCK_SIZE - 1) // BLOCK_SIZE if self.length is not None else 0
+
+    def __mark(self, start, end, state):
+        for block in range(start, end + 1):
+            self.__blocks[block] = state
+
+    def __fetch(self, start, end):
+        """
+        Fetches blocks marked FETCHING by caller and stores them
+        :param start: First block
+        :param end: Last block, included
+        """
+        try:
+            data = self.__fetcher.read_range(self.url, start * BLOCK_SIZE,
+                                             min(self.length, (end + 1) * BLOCK_SIZE) - 1)
+            os.pwrite(self.__fd, data, start * BLOCK_SIZE)
+        except (OSError, http.client.HTTPException) as e:
+            with self.__condition:
+                self.__mark(start, end, MISSING)
+                self.__condition.notify_all()
+            print("Could not download: ", self.url, e)
+            raise OSError(str(e))
+        with self.__condition:
+            self.__mark(start, end, PRESENT)
+            self.__missing -= end - start + 1
+            self.bytes_fetched += len(data)
+            if self.__missing == 0:
+                self.__finish()
+            self.__condition.notify_all()
+
+    def __schedule(self):
+        """
+        Queues fetching of next missing blocks
+        """
+        with self.__condition:
+            if self.__missing == 0 or self.__stopped:
+                return
+            self.__task = self.__scheduler.submit(self.__fetch_next, PREFETCH)
+
+    def __fetch_next(self):
+        """
+        Fetches next run of missing blocks in background, queues the following run when done
+        """
+        with self.__condition:
+            if self.__stopped:
+                return
+            try:
+                start = self.__blocks.index(MISSING)
+            except ValueError:
+                # Rest is being fetched by readers
+                return
+            end = start
+            while end + 1 < len(self.__blocks) and end + 1 - start < SEQUENTIAL_BLOCKS and \
+                    self.__blocks[end + 1] == MISSING:
+                end += 1
+            self.__mark(start, end, FETCHING)
+        try:
+            self.__fetch(start, end)
+        except OSError as e:
+            with self.__condition:
+                # Readers asking for missing blocks will try again
+                self.__error = str(e)
+                self.__condition.notify_all()
+            return
+        self.__schedule()
+
+    def __finish(self):
+        """
+        Moves completely downloaded file to its place, lock is held by caller
+        """
+        os.fsync(self.__fd)
+        os.replace(self.__part_path, self.path)
+        print("Downloaded %s (%.1f MiB)" % (self.url, self.length / 2 ** 20))
+        self.__condition.notify_all()
+
+
+class DownloadCache:
+    def __init__(self, path, fetcher, scheduler):
+        """
+        Books downloaded from catalogs, kept in cache next to extracted books
+        :param path: Directory downloads are kept in
+        :param fetcher: HttpFetcher
+        :param scheduler: Scheduler background downloads run on
+        """
+        self.__path = path
+        self.__fetcher = fetcher
+        self.__scheduler = scheduler
+        self.__lock = threading.Lock()
+        # Downloads of this instance by book MD5, so a book opened twice is downloaded once
+        self.__downloads = {}
+
+    def open(self, url):
+        """
+        Asks server about book and starts downloading it unless it's downloaded already, blocks until book can be
+        read. Server without range support sends the whole book right away.
+        :param url: URL of book
+        :return Download, raises OSError when book can't be downloaded:
+        """
+        with self.__fetcher.open(url, {"Range": "bytes=0-0"}) as response:
+            validator = response.getheader("ETag") or response.getheader("Last-Modified") or ""
+            length = None
+            content_range = response.getheader("Content-Range") or ""
+            if response.status == 206 and "/" in content_range and not content_range.endswith("*"):
+                length = int(content_range.rsplit("/", 1)[1])
+                response.read()
+                ranged = True
+            else:
+                if response.getheader("Content-Length") is not None:
+                    length = int(response.getheader("Content-Length"))
+                ranged = False
+            md5 = hashlib.md5(("url:%s\n%s\n%s" % (response.url, validator, length)).encode("utf-8")).hexdigest()
+
+            with self.__lock:
+                download = self.__downloads.get(md5)
+                if download is not None and download.complete and not os.path.exists(download.path):
+                    # Cache cleanup removed the book since, it's downloaded again
+                    del self.__downloads[md5]
+                    download = None
+                if download is not None:
+                    return download
+                directory = os.path.join(self.__path, md5)
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+                # Used directory is kept by cleanup as long as extracted book is
+                os.utime(directory)
+                with open(os.path.join(directory, METADATA_NAME), "w") as file:
+                    json.dump({"url": response.url, "book_md5": md5}, file)
+                download = Download(self.__fetcher, response.url, directory, md5, length if ranged else None)
+                self.__downloads[md5] = download
+
+            if download.complete:
+                print("Downloaded already: " + url)
+                return download
+            if ranged:
+                download.start(self.__scheduler)
+                return download
+            try:
+                if response.status == 200:
+                    download.fill(response)
+                else:
+                    # Server sent a range of unknown length, the whole book is asked for again
+                    with self.__fetcher.open(url) as full_response:
+                        download.fill(full_response)
+            except:
+                with self.__lock:
+                    del self.__downloads[md5]
+                raise
+        return download
+
+    def find(self, file_path):
+        """
+        Returns download a book file in cache comes from, so it keeps the MD5 it was first opened with
+        :param file_path: Path of book
+        :return Download or None when file was not downloaded from a catalog:
+        """
+        directory = os.path.dirname(os.path.realpath(file_path))
+        if os.path.dirname(directory) != os.path.realpath(self.__path) or \
+                os.path.basename(file_path) != BOOK_NAME or not os.path.exists(file_path):
+            return None
+        try:
+            with open(os.path.join(directory, METADATA_NAME)) as file:
+                metadata = json.load(file)
+        except (OSError, ValueError):
+            return None
+        with self.__lock:
+            download = self.__downloads.get(metadata["book_md5"])
+            if download is None:
+                download = Download(self.__fetcher, metadata["url"], directory, metadata["book_md5"], None)
+                self.__downloads[metadata["book_md5"]] = download
+        return download
+
+    def cancel(self):
+        """
+        Stops all background downloads, partially downloaded books are downloaded again next time
+        """
+        with self.__lock:
+            for download in self.__downloads.values():
+                download.cancel()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import codecs
+import re
+
+# Chapters are XHTML, their encoding is declared the same way XML parsers and browsers look for it:
+# byte order mark first, then XML declaration, then <meta charset>. ePub requires UTF-8 or UTF-16,
+# so UTF-8 is assumed when nothing is declared.
+
+BOMS = [(codecs.BOM_UTF32_LE, "utf-32-le"), (codecs.BOM_UTF32_BE, "utf-32-be"),
+        (codecs.BOM_UTF8, "utf-8"), (codecs.BOM_UTF16_LE, "utf-16-le"), (codecs.BOM_UTF16_BE, "utf-16-be")]
+
+XML_DECLARATION = re.compile(rb"""^\s*<\?xml[^>]*?encoding\s*=\s*["']([A-Za-z0-9._:-]+)["']""")
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?([A-Za-z0-9._:-]+)""", re.IGNORECASE)
+
+# Only the beginning of a file is searched for declarations
+SNIFF_SIZE = 1024
+
+
+def detect_encoding(data):
+    """
+    Detects encoding of HTML or XML document
+    :param data: Raw bytes of document
+    :return (Python codec name, number of BOM bytes to skip):
+    """
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding, len(bom)
+
+    head = data[:SNIFF_SIZE]
+    for pattern in (XML_DECLARATION, META_CHARSET):
+        match = pattern.search(head)
+        if match:
+            try:
+                return codecs.lookup(match.group(1).decode("ascii")).name, 0
+            except LookupError:
+                break
+    return "utf-8", 0
+
+
+def decode_document(data):
+    """
+    Decodes HTML or XML document using the encoding it declares
+    :param data: Raw bytes of document
+    :return document text:
+    """
+    encoding, skip = detect_encoding(data)
+    return data[skip:].decode(encoding, errors="replace")
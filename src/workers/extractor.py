@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import hashlib
+import heapq
+import os
+import threading
+import time
+import zipfile
+import zlib
+
+# zlib releases the GIL while inflating, so members of one archive can be inflated
+# in parallel by plain threads. Every thread opens its own ZipFile handle, that way
+# no two threads ever share a file position.
+#
+# Members wait in a priority queue, lowest priority value is extracted first:
+#  - promoted members (something is waiting for them right now) go to the front,
+#    the most recent promotion first
+#  - reordered members (ie. the spine) follow in the order given
+#  - everything else is extracted in archive order
+
+# Size of the chunks copied from the archive to disk
+CHUNK_SIZE = 256 * 1024
+
+# Priority bases of the three queue sections described above
+PRIORITY_ORDERED = 1 << 40
+PRIORITY_ARCHIVE = 1 << 50
+
+# Member states
+PENDING = 0
+RUNNING = 1
+DONE = 2
+FAILED = 3
+
+
+def member_target_path(destination, member):
+    """
+    Returns path member will be extracted to, sanitized the same way ZipFile.extractall does it
+    :param destination: Directory archive is extracted to
+    :param member: ZipInfo of member
+    :return path of extracted member:
+    """
+    arcname = member.filename.replace('/', os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(x for x in arcname.split(os.path.sep) if x not in invalid_path_parts)
+    return os.path.join(destination, arcname)
+
+
+class Extractor:
+    def __init__(self, file_path, destination, workers=None, store=None, previous=None, opener=None):
+        """
+        Extracts zip members in priority order on a bounded pool of threads
+        :param file_path: Path to zip archive
+        :param destination: Directory to extract archive to
+        :param workers: Maximum number of extracting threads, defaults to number of CPUs
+        :param store: ObjectStore members are linked from instead of being written when it has them
+        :param previous: (directory, member names) of an older version of archive extracted before, listed members
+        did not change and are linked from there
+        :param opener: Returns a new seekable file object of archive, used instead of file path when archive is not
+        on disk yet (ie. it's being downloaded)
+        """
+        self.__file_path = file_path
+        self.__opener = opener
+        self.__destination = destination
+        self.__store = store
+        self.__previous_directory, previous_names = previous or (None, ())
+        self.__previous_names = set(previous_names)
+        self.__workers = workers or min(8, os.cpu_count() or 1)
+        self.__local = threading.local()
+        self.__threads = []
+
+        # Guards everything below, notified whenever a member finishes
+        self.__condition = threading.Condition()
+        self.__queue = []
+        self.__front = 0
+        self.__cancelled = False
+
+        # Called from an extracting thread with True (every member extracted) or False once queue is done
+        self.on_finished = None
+
+        with self.__open_archive() as zip_file:
+            members = [member for member in zip_file.infolist()]
+        self.__members = {member.filename: member for member in members}
+        self.__states = {member.filename: PENDING for member in members}
+        self.__errors = {}
+        for i, member in enumerate(members):
+            heapq.heappush(self.__queue, (PRIORITY_ARCHIVE + i, member.filename))
+
+        # Maps extracted paths back to member names, used to answer requests coming from the viewer
+        self.__paths = {os.path.normpath(member_target_path(destination, member)): member.filename
+                        for member in members}
+
+        # Throughput statistics
+        self.bytes_extracted = 0
+        self.files_extracted = 0
+        self.bytes_linked = 0
+        self.files_linked = 0
+        self.seconds = 0.0
+        self.__start_time = None
+
+    @property
+    def names(self):
+        """
+        Returns names of all archive members
+        :return list of member names:
+        """
+        return list(self.__members)
+
+    @property
+    def members(self):
+        """
+        Returns central directory of archive
+        :return list of ZipInfos:
+        """
+        return list(self.__members.values())
+
+    def member_name(self, path):
+        """
+        Returns name of member that gets extracted to given path
+        :param path: Path inside of destination directory
+        :return member name or None if path is not part of archive:
+        """
+        return self.__paths.get(os.path.normpath(path))
+
+    def start(self):
+        """
+        Starts extracting threads, returns immediately
+        """
+        with self.__condition:
+            if self.__threads or self.__cancelled:
+                return
+            self.__start_time = time.perf_counter()
+            for i in range(self.__workers):
+                thread = threading.Thread(target=self.__work, name="extractor-%d" % i, daemon=True)
+                self.__threads.append(thread)
+                thread.start()
+
+    def reorder(self, names):
+        """
+        Moves members behind promoted ones but ahead of the rest of archive, in given order
+        :param names: Member names
+        """
+        with self.__condition:
+            for i, name in enumerate(names):
+                if self.__states.get(name) == PENDING:
+                    heapq.heappush(self.__queue, (PRIORITY_ORDERED + i, name))
+
+    def promote(self, names):
+        """
+        Moves members to front of the queue, in given order
+        :param names: Member names
+        """
+        with self.__condition:
+            self.__front -= len(names)
+            for i, name in enumerate(names):
+                if self.__states.get(name) == PENDING:
+                    heapq.heappush(self.__queue, (self.__front + i, name))
+
+    def wait_for(self, names):
+        """
+        Promotes members and blocks until they are extracted, raises zipfile.BadZipFile if any failed
+        :param names: Member names, names that are not part of archive are ignored
+        """
+        names = [name for name in names if name in self.__states]
+        self.promote(names)
+        self.start()
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__cancelled or
+                                      all(self.__states[name] >= DONE for name in names))
+            for name in names:
+                if self.__states[name] == FAILED:
+                    raise zipfile.BadZipFile(self.__errors[name])
+
+    def is_extracted(self, name):
+        """
+        Returns True when member was successfully extracted
+        :param name: Member name
+        :return boolean:
+        """
+        with self.__condition:
+            return self.__states.get(name) == DONE
+
+    def extract_all(self):
+        """
+        Extracts every member of archive and blocks until done, raises zipfile.BadZipFile when a member fails
+        """
+        self.wait_for(self.names)
+
+    def cancel(self):
+        """
+        Drops every pending member and waits for running ones, extractor can't be restarted afterwards
+        """
+        with self.__condition:
+            self.__cancelled = True
+            self.__queue = []
+            self.__condition.notify_all()
+        for thread in self.__threads:
+            thread.join()
+
+    @property
+    def throughput(self):
+        """
+        Returns throughput of extraction so far
+        :return bytes per second:
+        """
+        if self.seconds == 0:
+            return 0.0
+        return self.bytes_extracted / self.seconds
+
+    def __work(self):
+        """
+        Body of extracting thread, takes members from queue until it's empty
+        """
+        try:
+            while True:
+                with self.__condition:
+                    name = None
+                    while self.__queue and not self.__cancelled:
+                        priority, candidate = heapq.heappop(self.__queue)
+                        # Promoted members leave stale duplicate entries behind, skip them
+                        if self.__states[candidate] == PENDING:
+                            name = candidate
+                            self.__states[name] = RUNNING
+                            break
+                    if name is None:
+                        return
+
+                try:
+                    size, linked = self.__extract_member(self.__members[name])
+                    error = None
+                except (OSError, zipfile.BadZipFile, zlib.error) as e:
+                    size, linked = 0, False
+                    error = str(e)
+                    print("Could not extract: ", name, error)
+
+                with self.__condition:
+                    if error is None:
+                        self.__states[name] = DONE
+                        if linked:
+                            self.files_linked += 1
+                            self.bytes_linked += size
+                        else:
+                            self.files_extracted += 1
+                            self.bytes_extracted += size
+                    else:
+                        self.__states[name] = FAILED
+                        self.__errors[name] = error
+                    self.seconds = time.perf_counter() - self.__start_time
+                    finished = all(state >= DONE for state in self.__states.values())
+                    if finished:
+                        print("Extracted %d files (%.1f MiB) in %.3f s, %.1f MiB/s on %d threads, "
+                              "%d shared files (%.1f MiB) linked from cache" %
+                              (self.files_extracted, self.bytes_extracted / 2 ** 20, self.seconds,
+                               self.throughput / 2 ** 20, self.__workers,
+                               self.files_linked, self.bytes_linked / 2 ** 20))
+                    self.__condition.notify_all()
+                if finished and self.on_finished is not None:
+                    self.on_finished(all(state == DONE for state in self.__states.values()))
+        finally:
+            handle = getattr(self.__local, "zip_file", None)
+            if handle is not None:
+                handle.close()
+
+    def __open_archive(self):
+        """
+        Opens archive, every thread needs its own ZipFile and file object
+        :return ZipFile:
+        """
+        return zipfile.ZipFile(self.__opener() if self.__opener is not None else self.__file_path)
+
+    def __extract_member(self, member):
+        """
+        Inflates single member to disk and verifies its CRC, links it from object store instead when possible
+        :param member: ZipInfo of member
+        :return (size of member, True if it was linked and not written):
+        """
+        target_path = member_target_path(self.__destination, member)
+        if member.is_dir():
+            os.makedirs(target_path, exist_ok=True)
+            return 0, False
+
+        if member.filename in self.__previous_names:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            try:
+                os.link(member_target_path(self.__previous_directory, member), target_path)
+                return member.file_size, True
+            except OSError:
+                pass
+
+        handle = getattr(self.__local, "zip_file", None)
+        if handle is None:
+            handle = self.__open_archive()
+            self.__local.zip_file = handle
+
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        key = self.__store.key(member) if self.__store is not None else None
+        if key is not None:
+            candidates = self.__store.candidates(key)
+            # Member is only linked to an object with the same content, comparing CRC-32 is not enough for that.
+            # Content is hashed without being written, writing is what linking saves.
+            if candidates:
+                digest = self.__inflate(handle, member, None)
+                if digest in candidates and self.__store.link(key, digest, target_path):
+                    return member.file_size, True
+
+        with open(target_path, "wb") as target:
+            digest = self.__inflate(handle, member, target)
+        if key is not None:
+            self.__store.add(key, digest, target_path)
+        return member.file_size, False
+
+    @staticmethod
+    def __inflate(handle, member, target):
+        """
+        Inflates member and verifies its CRC
+        :param handle: ZipFile
+        :param member: ZipInfo
+        :param target: File to write content to, None to only hash it
+        :return hexadecimal SHA-256 of content:
+        """
+        crc = 0
+        sha256 = hashlib.sha256()
+        with handle.open(member) as source:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                crc = zlib.crc32(chunk, crc)
+                sha256.update(chunk)
+                if target is not None:
+                    target.write(chunk)
+        if crc != member.CRC:
+            raise zipfile.BadZipFile("Bad CRC-32 for file %r" % member.filename)
+        return sha256.hexdigest()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import hashlib
+import os
+import posixpath
+import re
+import threading
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ElementTree
+
+# Publishers obfuscate embedded fonts so they can't be simply copied out of the book. META-INF/encryption.xml
+# lists obfuscated files, beginning of every such file is XORed with a key derived from book identifier:
+#
+#  - IDPF: first 1040 bytes, key is SHA-1 of unique identifier of the package with whitespace removed
+#  - Adobe: first 1024 bytes, key are the 16 bytes of UUID in book identifier (urn:uuid:...)
+#
+# Files in cache are hardlinked between books and must not be modified, fonts are de-obfuscated into
+# <cacheDir>/fonts/<book md5>/ and WebKit is pointed there instead.
+
+IDPF_ALGORITHM = "http://www.idpf.org/2008/embedding"
+ADOBE_ALGORITHM = "http://ns.adobe.com/pdf/enc#RC"
+
+IDPF_LENGTH = 1040
+ADOBE_LENGTH = 1024
+
+ENCRYPTION_MEMBER = "META-INF/encryption.xml"
+
+# Stylesheet references in CSS, ie. url("../fonts/a.otf")
+CSS_URL = re.compile(r"""url\(\s*["']?([^"')]+)["']?\s*\)""", re.IGNORECASE)
+
+
+def local_name(element):
+    return element.tag.rsplit("}", 1)[-1]
+
+
+def read_encryption(file_path):
+    """
+    Lists obfuscated files declared in encryption.xml, files encrypted any other way are left out
+    :param file_path: Path to extracted encryption.xml
+    :return dictionary member name: algorithm:
+    """
+    algorithms = {}
+    for data in ElementTree.parse(file_path).getroot().iter():
+        if local_name(data) != "EncryptedData":
+            continue
+        algorithm = None
+        uri = None
+        for element in data.iter():
+            if local_name(element) == "EncryptionMethod":
+                algorithm = element.get("Algorithm")
+            elif local_name(element) == "CipherReference":
+                uri = element.get("URI")
+        if algorithm in (IDPF_ALGORITHM, ADOBE_ALGORITHM) and uri:
+            algorithms[posixpath.normpath(urllib.parse.unquote(uri)).lstrip("/")] = algorithm
+    return algorithms
+
+
+def read_identifiers(opf_path):
+    """
+    Reads identifiers of the book from OPF file
+    :param opf_path: Path to extracted OPF file
+    :return (unique identifier, list of all identifiers):
+    """
+    package = ElementTree.parse(opf_path).getroot()
+    unique_id = package.get("unique-identifier")
+    unique_identifier = None
+    identifiers = []
+    for element in package.iter():
+        if local_name(element) == "identifier" and element.text:
+            identifiers.append(element.text.strip())
+            if unique_id is not None and element.get("id") == unique_id:
+                unique_identifier = element.text
+    return unique_identifier, identifiers
+
+
+def idpf_key(unique_identifier):
+    """
+    :param unique_identifier: Unique identifier of package
+    :return key bytes:
+    """
+    identifier = "".join(character for character in unique_identifier if character not in " \t\r\n")
+    return hashlib.sha1(identifier.encode("utf-8")).digest()
+
+
+def adobe_key(identifiers):
+    """
+    :param identifiers: Identifiers of the book, first one that is a UUID is used
+    :return key bytes or None when book has no UUID:
+    """
+    for identifier in identifiers:
+        value = identifier.strip()
+        for prefix in ("urn:uuid:", "uuid:"):
+            if value.lower().startswith(prefix):
+                value = value[len(prefix):]
+        try:
+            return uuid.UUID(value).bytes
+        except ValueError:
+            continue
+    return None
+
+
+def obfuscation_keys(encryption_path, opf_path):
+    """
+    Finds obfuscated fonts of a book and keys to de-obfuscate them
+    :param encryption_path: Path to extracted encryption.xml
+    :param opf_path: Path to extracted OPF file
+    :return dictionary member name: (key, number of obfuscated bytes):
+    """
+    algorithms = read_encryption(encryption_path)
+    if not algorithms:
+        return {}
+    unique_identifier, identifiers = read_identifiers(opf_path)
+    keys = {IDPF_ALGORITHM: (idpf_key(unique_identifier), IDPF_LENGTH) if unique_identifier else None,
+            ADOBE_ALGORITHM: (adobe_key(identifiers), ADOBE_LENGTH)}
+    fonts = {}
+    for name, algorithm in algorithms.items():
+        key = keys[algorithm]
+        if key is None or key[0] is None:
+            print("No key to de-obfuscate: " + name)
+            continue
+        fonts[name] = key
+    return fonts
+
+
+def deobfuscate(data, key, length):
+    """
+    XORs beginning of data with key, applying it twice gives the original data back
+    :param data: File content
+    :param key: Key bytes
+    :param length: Number of obfuscated bytes at the beginning
+    :return de-obfuscated content:
+    """
+    head = bytes(byte ^ key[i % len(key)] for i, byte in enumerate(data[:length]))
+    return head + data[length:]
+
+
+def stylesheet_urls(text):
+    """
+    Returns urls stylesheet or style element refers to
+    :param text: CSS
+    :return list of urls:
+    """
+    return CSS_URL.findall(text)
+
+
+class FontDeobfuscator:
+    def __init__(self, book_path, output_path, fonts):
+        """
+        De-obfuscates fonts of one book on first use, every font is processed once and kept on disk
+        :param book_path: Directory book is extracted in
+        :param output_path: Directory de-obfuscated fonts are kept in
+        :param fonts: Dictionary member name: (key, number of obfuscated bytes)
+        """
+        self.__book_path = book_path
+        self.__output_path = output_path
+        self.__fonts = fonts
+        # Worker thread and resource requests may ask for the same font at once
+        self.__lock = threading.Lock()
+
+    def is_obfuscated(self, name):
+        return name in self.__fonts
+
+    def font_path(self, name):
+        """
+        Returns path of de-obfuscated font, de-obfuscates it when it's asked for the first time
+        :param name: Member name of obfuscated font
+        :return path or None when font could not be read:
+        """
+        key, length = self.__fonts[name]
+        output_path = os.path.join(self.__output_path, *name.split("/"))
+        with self.__lock:
+            if os.path.exists(output_path):
+                return output_path
+            try:
+                with open(os.path.join(self.__book_path, *name.split("/")), "rb") as file:
+                    data = file.read()
+                os.makedirs(os.path.dirname(output_path), mode=0o700, exist_ok=True)
+                # Another instance may be writing the same font
+                temporary_path = "%s.%d.tmp" % (output_path, os.getpid())
+                with open(temporary_path, "wb") as file:
+                    file.write(deobfuscate(data, key, length))
+                os.replace(temporary_path, output_path)
+            except OSError as e:
+                print("Could not de-obfuscate: ", name, e)
+                return None
+            print("De-obfuscated font: " + name)
+            return output_path
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+
+class HistoryEntry:
+    def __init__(self, chapter, path):
+        """
+        Single visited page
+        :param chapter: Chapter number
+        :param path: Path of chapter file, may contain anchor
+        """
+        self.chapter = chapter
+        self.path = path
+        # Vertical scroll position, page number (int) in paginated mode
+        self.scroll = 0.0
+
+
+class History:
+    def __init__(self, limit=100):
+        """
+        Back / forward navigation stack, works like the one in web browsers
+        :param limit: Maximum number of remembered pages, oldest are forgotten first
+        """
+        self.__limit = limit
+        self.__entries = []
+        self.__current = -1
+
+    @property
+    def current(self):
+        """
+        Returns page that is currently displayed
+        :return HistoryEntry or None:
+        """
+        if self.__current < 0:
+            return None
+        return self.__entries[self.__current]
+
+    @property
+    def can_go_back(self):
+        return self.__current > 0
+
+    @property
+    def can_go_forward(self):
+        return self.__current < len(self.__entries) - 1
+
+    def clear(self):
+        """
+        Forgets all pages, to be used when another book is opened
+        """
+        self.__entries = []
+        self.__current = -1
+
+    def relocate(self, old_directory, new_directory):
+        """
+        Moves all pages to another directory, to be used when book is extracted again somewhere else
+        :param old_directory:
+        :param new_directory:
+        """
+        for entry in self.__entries:
+            if entry.path.startswith(old_directory):
+                entry.path = new_directory + entry.path[len(old_directory):]
+
+    def push(self, chapter, path):
+        """
+        Records navigation to a new page, drops pages that were ahead of current one
+        :param chapter: Chapter number
+        :param path: Path of chapter file, may contain anchor
+        """
+        current = self.current
+        if current is not None and current.path == path:
+            return
+        del self.__entries[self.__current + 1:]
+        self.__entries.append(HistoryEntry(chapter, path))
+        if len(self.__entries) > self.__limit:
+            del self.__entries[:len(self.__entries) - self.__limit]
+        self.__current = len(self.__entries) - 1
+
+    def set_scroll(self, scroll):
+        """
+        Updates scroll position of current page
+        :param scroll: Vertical scroll position, page number in paginated mode
+        """
+        if self.current is not None:
+            self.current.scroll = scroll
+
+    def back(self):
+        """
+        Moves one page back
+        :return HistoryEntry to display or None if there is nothing to go back to:
+        """
+        if not self.can_go_back:
+            return None
+        self.__current -= 1
+        return self.current
+
+    def forward(self):
+        """
+        Moves one page forward
+        :return HistoryEntry to display or None if there is nothing to go forward to:
+        """
+        if not self.can_go_forward:
+            return None
+        self.__current += 1
+        return self.current
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import contextlib
+import http.client
+import threading
+import urllib.parse
+
+# Catalogs, covers and books are fetched over HTTP/1.1 keep-alive connections. Connections to every server are
+# pooled: a request takes an idle connection when there is one and puts it back once its body was read, at most
+# CONNECTIONS_PER_SERVER requests go to one server at once. Requests themselves run on Scheduler workers, so a
+# feed the user asked for goes ahead of covers and covers go ahead of background downloads.
+
+CONNECTIONS_PER_SERVER = 4
+TIMEOUT = 30
+MAX_REDIRECTS = 5
+USER_AGENT = "Easy eBook Viewer"
+
+# Errors of a kept-alive connection the server closed in the meantime, request is sent again on a new one
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError,
+                           BrokenPipeError)
+
+
+class HttpError(OSError):
+    def __init__(self, url, status, reason):
+        """
+        Server answered with an error status, or with something else than it was asked for
+        :param url:
+        :param status: HTTP status code
+        :param reason: Reason phrase or description of the problem
+        """
+        super(HttpError, self).__init__("%s: %d %s" % (url, status, reason))
+        self.url = url
+        self.status = status
+
+
+class Response:
+    def __init__(self, url, status, headers, body):
+        """
+        Response with its whole body read
+        :param url: URL response came from, after redirects
+        :param status: HTTP status code
+        :param headers: http.client.HTTPMessage
+        :param body: bytes
+        """
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class HttpFetcher:
+    def __init__(self, scheduler, connections=CONNECTIONS_PER_SERVER, timeout=TIMEOUT):
+        """
+        Fetches over pooled keep-alive connections
+        :param scheduler: Scheduler asynchronous requests run on
+        :param connections: Maximal number of connections to one server
+        :param timeout: Seconds to wait for server
+        """
+        self.__scheduler = scheduler
+        self.__connections = connections
+        self.__timeout = timeout
+        self.__lock = threading.Lock()
+        # (scheme, host and port): idle connections, and semaphore limiting connections to that server
+        self.__idle = {}
+        self.__slots = {}
+        # Statistics
+        self.requests = 0
+        self.connections_opened = 0
+
+    def request(self, url, headers=None, method="GET"):
+        """
+        Sends request and reads whole response, blocks until done
+        :param url: http:// or https:// URL
+        :param headers: Dictionary of additional request headers
+        :param method:
+        :return Response, raises HttpError on error status and OSError when server can't be reached:
+        """
+        with self.open(url, headers, method) as response:
+            return Response(response.url, response.status, response.headers, response.read())
+
+    def read_range(self, url, start, end):
+        """
+        Reads part of a file
+        :param url:
+        :param start: Offset of first byte
+        :param end: Offset of last byte, included
+        :return bytes, raises HttpError when server sent something else than the range:
+        """
+        with self.open(url, {"Range": "bytes=%d-%d" % (start, end)}) as response:
+            if response.status != 206:
+                raise HttpError(url, response.status, "Server does not support range requests")
+            data = response.read()
+        if len(data) != end - start + 1:
+            raise HttpError(url, 206, "Expected %d bytes, got %d" % (end - start + 1, len(data)))
+        return data
+
+    def fetch(self, url, priority, on_finished, book=None):
+        """
+        Fetches URL on a Scheduler worker, returns immediately
+        :param url:
+        :param priority: Priority class of request
+        :param on_finished: Called on UI thread with (Response, None) or (None, error message)
+        :param book: MD5 of book request belongs to
+        :return Task:
+        """
+        def fetch():
+            try:
+                return self.request(url), None
+            except (OSError, http.client.HTTPException) as e:
+                print("Could not fetch: ", url, e)
+                return None, str(e)
+
+        return self.__scheduler.submit(fetch, priority, book=book, on_finished=on_finished)
+
+    @contextlib.contextmanager
+    def open(self, url, headers=None, method="GET"):
+        """
+        Sends request and follows redirects, response body is to be read while in with block. Connection goes back
+        to pool when body was read completely, otherwise it's closed.
+        :param url:
+        :param headers: Dictionary of additional request headers
+        :param method:
+        :return context manager of http.client.HTTPResponse with url attribute set to final URL:
+        """
+        for redirect in range(MAX_REDIRECTS + 1):
+            key, connection, response = self.__send(url, headers or {}, method)
+            try:
+                if response.status in (301, 302, 303, 307, 308) and response.getheader("Location"):
+                    response.read()
+                    url = urllib.parse.urljoin(url, response.getheader("Location"))
+                    if response.status == 303:
+                        method = "GET"
+                    continue
+                if response.status >= 400:
+                    response.read()
+                    raise HttpError(url, response.status, response.reason)
+                response.url = url
+                yield response
+                return
+            finally:
+                self.__release(key, connection, response)
+        raise HttpError(url, 310, "Too many redirects")
+
+    def close(self):
+        """
+        Closes idle connections, connections in use are closed once their request is done
+        """
+        with self.__lock:
+            idle = self.__idle
+            self.__idle = {}
+        for connections in idle.values():
+            for connection in connections:
+                connection.close()
+
+    def __send(self, url, headers, method):
+        """
+        Sends request over idle connection to server, or over a new one
+        :return (server key, connection, http.client.HTTPResponse):
+        """
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise HttpError(url, 400, "Not an HTTP URL")
+        key = (parts.scheme, parts.netloc)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        request_headers = {"User-Agent": USER_AGENT, "Accept-Encoding": "identity"}
+        request_headers.update(headers)
+
+        with self.__lock:
+            slots = self.__slots.setdefault(key, threading.BoundedSemaphore(self.__connections))
+        slots.acquire()
+        try:
+            while True:
+                with self.__lock:
+                    idle = self.__idle.get(key)
+                    connection = idle.pop() if idle else None
+                reused = connection is not None
+                if connection is None:
+                    connection_class = http.client.HTTPSConnection if parts.scheme == "https" \
+                        else http.client.HTTPConnection
+                    connection = connection_class(parts.netloc, timeout=self.__timeout)
+                    with self.__lock:
+                        self.connections_opened += 1
+                try:
+                    connection.request(method, path, headers=request_headers)
+                    response = connection.getresponse()
+                except STALE_CONNECTION_ERRORS:
+                    connection.close()
+                    if reused:
+                        continue
+                    raise
+                except:
+                    connection.close()
+                    raise
+                with self.__lock:
+                    self.requests += 1
+                return key, connection, response
+        except:
+            slots.release()
+            raise
+
+    def __release(self, key, connection, response):
+        """
+        Puts connection back to pool if it can carry another request
+        """
+        if response.isclosed() and not response.will_close:
+            with self.__lock:
+                self.__idle.setdefault(key, []).append(connection)
+        else:
+            connection.close()
+        self.__slots[key].release()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+
+# OPDS catalogs are Atom feeds. Navigation feeds list other feeds (ie. "New books", "By author"), acquisition
+# feeds list books with links to download them and to their covers. Long feeds are split into pages linked
+# by rel="next".
+
+ATOM_NAMESPACE = "{http://www.w3.org/2005/Atom}"
+DC_NAMESPACE = "{http://purl.org/dc/terms/}"
+
+ACQUISITION_REL = "http://opds-spec.org/acquisition"
+IMAGE_REL = "http://opds-spec.org/image"
+THUMBNAIL_REL = "http://opds-spec.org/image/thumbnail"
+CATALOG_TYPE = "application/atom+xml"
+
+EPUB_TYPE = "application/epub+zip"
+
+
+class Entry:
+    def __init__(self):
+        """
+        Book or feed listed in a feed
+        """
+        self.id = ""
+        self.title = ""
+        self.author = ""
+        self.summary = ""
+        # Absolute URLs, None when entry has no such link
+        self.feed_url = None
+        self.book_url = None
+        self.cover_url = None
+        self.thumbnail_url = None
+
+
+class Feed:
+    def __init__(self, url):
+        """
+        Page of OPDS catalog
+        :param url: URL feed was fetched from
+        """
+        self.url = url
+        self.title = ""
+        self.entries = []
+        # Absolute URLs of related feeds, None when there is no such feed
+        self.next_url = None
+        self.up_url = None
+        self.start_url = None
+
+
+def child_text(element, tag):
+    child = element.find(tag)
+    return (child.text or "").strip() if child is not None else ""
+
+
+def parse_feed(data, url):
+    """
+    Parses OPDS feed, links are made absolute
+    :param data: Content of feed
+    :param url: URL feed was fetched from
+    :return Feed, raises ElementTree.ParseError when feed is not XML:
+    """
+    root = ElementTree.fromstring(data)
+    if root.tag != ATOM_NAMESPACE + "feed":
+        raise ElementTree.ParseError("Not an Atom feed")
+    feed = Feed(url)
+    feed.title = child_text(root, ATOM_NAMESPACE + "title")
+    for link in root.findall(ATOM_NAMESPACE + "link"):
+        href = link.get("href")
+        if not href:
+            continue
+        rel = link.get("rel", "")
+        if rel == "next":
+            feed.next_url = urllib.parse.urljoin(url, href)
+        elif rel == "up":
+            feed.up_url = urllib.parse.urljoin(url, href)
+        elif rel == "start":
+            feed.start_url = urllib.parse.urljoin(url, href)
+
+    for element in root.findall(ATOM_NAMESPACE + "entry"):
+        entry = Entry()
+        entry.id = child_text(element, ATOM_NAMESPACE + "id")
+        entry.title = child_text(element, ATOM_NAMESPACE + "title")
+        authors = [child_text(author, ATOM_NAMESPACE + "name") for author in element.findall(ATOM_NAMESPACE + "author")]
+        if not any(authors):
+            authors = [creator.text.strip() for creator in element.findall(DC_NAMESPACE + "creator") if creator.text]
+        entry.author = ", ".join(author for author in authors if author)
+        entry.summary = child_text(element, ATOM_NAMESPACE + "summary") or \
+            child_text(element, ATOM_NAMESPACE + "content")
+        for link in element.findall(ATOM_NAMESPACE + "link"):
+            href = link.get("href")
+            if not href:
+                continue
+            href = urllib.parse.urljoin(url, href)
+            rel = link.get("rel", "")
+            media_type = link.get("type", "").split(";")[0].strip()
+            # Acquisition relations have subtypes, ie. /open-access, /borrow
+            if rel.startswith(ACQUISITION_REL) and media_type == EPUB_TYPE:
+                entry.book_url = entry.book_url or href
+            elif rel == THUMBNAIL_REL or rel == "x-stanza-cover-image-thumbnail":
+                entry.thumbnail_url = href
+            elif rel == IMAGE_REL or rel == "x-stanza-cover-image":
+                entry.cover_url = href
+            elif media_type == CATALOG_TYPE and not rel.startswith(ACQUISITION_REL):
+                entry.feed_url = entry.feed_url or href
+        feed.entries.append(entry)
+    return feed
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import os
+import posixpath
+import re
+import sys
+import threading
+import time
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+import zipfile
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from workers.opds import ACQUISITION_REL, EPUB_TYPE, THUMBNAIL_REL, IMAGE_REL
+
+# Stand-in OPDS catalog serving a directory of ePub files, to try catalog browsing and opening books while they
+# download without a real catalog. Served over HTTP/1.1 keep-alive with range requests, latency and bandwidth
+# of a slow network can be simulated.
+#
+#   /              navigation feed
+#   /all?page=N    acquisition feed of all books, PAGE_SIZE books per page
+#   /books/NAME    book file
+#   /covers/NAME   cover image of book
+
+PAGE_SIZE = 50
+# Bandwidth is limited by sleeping after every chunk sent
+CHUNK_SIZE = 16 * 1024
+
+ATOM = "http://www.w3.org/2005/Atom"
+DC = "http://purl.org/dc/terms/"
+OPF = "{http://www.idpf.org/2007/opf}"
+DC_ELEMENTS = "{http://purl.org/dc/elements/1.1/}"
+CATALOG_TYPE = "application/atom+xml;profile=opds-catalog"
+
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class CatalogBook:
+    def __init__(self, path):
+        """
+        Book served by catalog, metadata is read from its OPF file
+        :param path: Path to ePub file
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        self.title = os.path.splitext(self.name)[0]
+        self.author = ""
+        self.identifier = "urn:easy-ebook-viewer:" + urllib.parse.quote(self.name)
+        self.cover_member = None
+        self.cover_type = None
+        stat = os.stat(path)
+        self.size = stat.st_size
+        self.etag = '"%x-%x"' % (stat.st_size, stat.st_mtime_ns)
+        self.modified = formatdate(stat.st_mtime, usegmt=True)
+        try:
+            self.__read_metadata()
+        except (zipfile.BadZipFile, OSError, KeyError, ElementTree.ParseError) as e:
+            print("Could not read metadata: ", path, e)
+
+    def __read_metadata(self):
+        with zipfile.ZipFile(self.path) as zip_file:
+            container = ElementTree.fromstring(zip_file.read("META-INF/container.xml"))
+            opf_name = next(element.get("full-path") for element in container.iter()
+                            if element.tag.endswith("rootfile"))
+            package = ElementTree.fromstring(zip_file.read(opf_name))
+            title = package.find(".//" + DC_ELEMENTS + "title")
+            if title is not None and title.text:
+                self.title = title.text.strip()
+            self.author = ", ".join(creator.text.strip() for creator in package.iter(DC_ELEMENTS + "creator")
+                                    if creator.text)
+            identifier = package.find(".//" + DC_ELEMENTS + "identifier")
+            if identifier is not None and identifier.text:
+                self.identifier = identifier.text.strip()
+
+            # ePub 3 marks cover in manifest, ePub 2 names it in <meta name="cover">
+            items = {item.get("id"): item for item in package.iter(OPF + "item")}
+            cover = next((item for item in items.values() if "cover-image" in (item.get("properties") or "")), None)
+            if cover is None:
+                meta = next((meta for meta in package.iter(OPF + "meta") if meta.get("name") == "cover"), None)
+                cover = items.get(meta.get("content")) if meta is not None else None
+            if cover is not None and cover.get("href"):
+                self.cover_member = posixpath.normpath(posixpath.join(posixpath.dirname(opf_name),
+                                                                      urllib.parse.unquote(cover.get("href"))))
+                self.cover_type = cover.get("media-type") or "image/jpeg"
+
+
+class CatalogServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, address=("127.0.0.1", 8080), latency=0.0, rate=None):
+        """
+        Serves ePub files of a directory as OPDS catalog
+        :param directory: Directory with ePub files
+        :param address: (host, port) to listen on, port 0 picks a free one
+        :param latency: Seconds every response is delayed by
+        :param rate: Bytes per second sent to every connection, None for no limit
+        """
+        super(CatalogServer, self).__init__(address, CatalogRequestHandler)
+        self.latency = latency
+        self.rate = rate
+        self.books = [CatalogBook(os.path.join(directory, name)) for name in sorted(os.listdir(directory))
+                      if name.lower().endswith(".epub") and os.path.isfile(os.path.join(directory, name))]
+        self.books_by_name = {book.name: book for book in self.books}
+        # Statistics
+        self.__lock = threading.Lock()
+        self.requests = 0
+        self.range_requests = 0
+        self.bytes_sent = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d/" % (host, port)
+
+    def count(self, ranged, size):
+        with self.__lock:
+            self.requests += 1
+            self.range_requests += 1 if ranged else 0
+            self.bytes_sent += size
+
+
+class CatalogRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "EasyEbookViewerCatalog/1.0"
+
+    def do_HEAD(self):
+        self.__handle(False)
+
+    def do_GET(self):
+        self.__handle(True)
+
+    def log_message(self, format, *args):
+        print("[catalog] %s %s" % (self.address_string(), format % args), file=sys.stderr)
+
+    def __handle(self, with_body):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        parts = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(parts.query)
+        path = urllib.parse.unquote(parts.path)
+        if path == "/":
+            self.__send_feed(self.__navigation_feed(), "navigation", with_body)
+        elif path == "/all":
+            try:
+                page = max(1, int(query.get("page", ["1"])[0]))
+            except ValueError:
+                page = 1
+            self.__send_feed(self.__acquisition_feed(page), "acquisition", with_body)
+        elif path.startswith("/books/") and path[len("/books/"):] in self.server.books_by_name:
+            self.__send_book(self.server.books_by_name[path[len("/books/"):]], with_body)
+        elif path.startswith("/covers/") and path[len("/covers/"):] in self.server.books_by_name:
+            self.__send_cover(self.server.books_by_name[path[len("/covers/"):]], with_body)
+        else:
+            self.__send(404, "text/plain", b"Not found", with_body)
+
+    def __send(self, status, content_type, body, with_body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if with_body:
+            self.__write(body)
+        self.server.count(False, len(body) if with_body else 0)
+
+    def __write(self, data):
+        """
+        Sends data, no faster than server rate
+        """
+        if self.server.rate is None:
+            self.wfile.write(data)
+            return
+        for start in range(0, len(data), CHUNK_SIZE):
+            chunk = data[start:start + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / self.server.rate)
+
+    def __send_feed(self, feed, kind, with_body):
+        body = ElementTree.tostring(feed, encoding="utf-8", xml_declaration=True)
+        self.__send(200, "%s;kind=%s" % (CATALOG_TYPE, kind), body, with_body)
+
+    def __send_book(self, book, with_body):
+        headers = {"Accept-Ranges": "bytes", "ETag": book.etag, "Last-Modified": book.modified}
+        start, end = 0, book.size - 1
+        status = 200
+        match = RANGE.match(self.headers.get("Range", "").strip())
+        if match and (match.group(1) or match.group(2)):
+            if not match.group(1):
+                # Suffix range, last N bytes
+                start = max(0, book.size - int(match.group(2)))
+            else:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)))
+            if start >= book.size or start > end:
+                self.__send(416, "text/plain", b"", with_body, {"Content-Range": "bytes */%d" % book.size})
+                return
+            status = 206
+            headers["Content-Range"] = "bytes %d-%d/%d" % (start, end, book.size)
+
+        self.send_response(status)
+        self.send_header("Content-Type", EPUB_TYPE)
+        self.send_header("Content-Length", str(end - start + 1))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not with_body:
+            return
+        with open(book.path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = file.read(min(remaining, 256 * 1024))
+                if not chunk:
+                    break
+                self.__write(chunk)
+                remaining -= len(chunk)
+        self.server.count(status == 206, end - start + 1)
+
+    def __send_cover(self, book, with_body):
+        if book.cover_member is None:
+            self.__send(404, "text/plain", b"No cover", with_body)
+            return
+        try:
+            with zipfile.ZipFile(book.path) as zip_file:
+                data = zip_file.read(book.cover_member)
+        except (zipfile.BadZipFile, OSError, KeyError):
+            self.__send(404, "text/plain", b"No cover", with_body)
+            return
+        self.__send(200, book.cover_type, data, with_body, {"Cache-Control": "max-age=3600"})
+
+    def __feed(self, identifier, title):
+        feed = ElementTree.Element("feed", {"xmlns": ATOM, "xmlns:dc": DC})
+        ElementTree.SubElement(feed, "id").text = identifier
+        ElementTree.SubElement(feed, "title").text = title
+        ElementTree.SubElement(feed, "updated").text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        ElementTree.SubElement(feed, "link", {"rel": "start", "href": "/",
+                                              "type": CATALOG_TYPE + ";kind=navigation"})
+        return feed
+
+    def __navigation_feed(self):
+        feed = self.__feed("urn:easy-ebook-viewer:catalog", "Catalog")
+        entry = ElementTree.SubElement(feed, "entry")
+        ElementTree.SubElement(entry, "id").text = "urn:easy-ebook-viewer:catalog:all"
+        ElementTree.SubElement(entry, "title").text = "All books"
+        ElementTree.SubElement(entry, "content", {"type": "text"}).text = "%d books" % len(self.server.books)
+        ElementTree.SubElement(entry, "link", {"rel": "subsection", "href": "/all",
+                                               "type": CATALOG_TYPE + ";kind=acquisition"})
+        return feed
+
+    def __acquisition_feed(self, page):
+        feed = self.__feed("urn:easy-ebook-viewer:catalog:all:%d" % page, "All books")
+        ElementTree.SubElement(feed, "link", {"rel": "up", "href": "/", "type": CATALOG_TYPE + ";kind=navigation"})
+        books = self.server.books[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        if page * PAGE_SIZE < len(self.server.books):
+            ElementTree.SubElement(feed, "link", {"rel": "next", "href": "/all?page=%d" % (page + 1),
+                                                  "type": CATALOG_TYPE + ";kind=acquisition"})
+        for book in books:
+            entry = ElementTree.SubElement(feed, "entry")
+            ElementTree.SubElement(entry, "id").text = book.identifier
+            ElementTree.SubElement(entry, "title").text = book.title
+            if book.author:
+                author = ElementTree.SubElement(entry, "author")
+                ElementTree.SubElement(author, "name").text = book.author
+            ElementTree.SubElement(entry, "updated").text = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+            quoted_name = urllib.parse.quote(book.name)
+            ElementTree.SubElement(entry, "link", {"rel": ACQUISITION_REL + "/open-access", "type": EPUB_TYPE,
+                                                   "href": "/books/" + quoted_name})
+            if book.cover_member is not None:
+                for rel in (IMAGE_REL, THUMBNAIL_REL):
+                    ElementTree.SubElement(entry, "link", {"rel": rel, "type": book.cover_type,
+                                                           "href": "/covers/" + quoted_name})
+        return feed
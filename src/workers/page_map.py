@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import bisect
+import json
+import os
+
+# In paginated mode every chapter is laid out in columns as wide and as high as the viewer, one column is a page.
+# How many pages a chapter takes depends only on book, viewer size, zoom and theme, so number of pages of every
+# chapter is measured once and saved. Page numbers of the whole book are then just running totals of those.
+
+# Page maps older than the newest ones are removed once there are more than this
+MAX_PAGE_MAPS = 200
+
+
+class PageMap:
+    def __init__(self, key, chapter_count, chapter_pages=None):
+        """
+        Number of pages of every chapter of a book laid out in given conditions
+        :param key: String identifying book, viewer size, zoom and theme
+        :param chapter_count: Number of chapters in book
+        :param chapter_pages: Already known page numbers, None for chapters that were not measured yet
+        """
+        self.key = key
+        if chapter_pages is None or len(chapter_pages) != chapter_count:
+            chapter_pages = [None] * chapter_count
+        self.chapter_pages = chapter_pages
+        self.__starts = None
+
+    @property
+    def complete(self):
+        """
+        Tells if every chapter was measured
+        :return True when page numbers of whole book are known:
+        """
+        return None not in self.chapter_pages
+
+    @property
+    def next_unmeasured(self):
+        """
+        Returns chapter that should be measured next
+        :return chapter number or None when page map is complete:
+        """
+        try:
+            return self.chapter_pages.index(None)
+        except ValueError:
+            return None
+
+    def set_chapter_pages(self, chapter, pages):
+        """
+        Records number of pages of a chapter
+        :param chapter: Chapter number
+        :param pages: Number of pages, at least one
+        """
+        self.chapter_pages[chapter] = max(1, pages)
+        self.__starts = None
+
+    @property
+    def __chapter_starts(self):
+        """
+        Returns first page of every chapter, computed once per change
+        :return list of page numbers:
+        """
+        if self.__starts is None:
+            self.__starts = []
+            total = 0
+            for pages in self.chapter_pages:
+                self.__starts.append(total)
+                total += pages
+            self.__starts.append(total)
+        return self.__starts
+
+    @property
+    def page_count(self):
+        """
+        Returns number of pages in book, only to be used when page map is complete
+        :return number of pages:
+        """
+        return self.__chapter_starts[-1]
+
+    def page_of(self, chapter, chapter_page):
+        """
+        Returns page number of page in a chapter
+        :param chapter: Chapter number
+        :param chapter_page: Page number counted from beginning of chapter
+        :return page number counted from beginning of book:
+        """
+        return self.__chapter_starts[chapter] + min(chapter_page, self.chapter_pages[chapter] - 1)
+
+    def locate(self, page):
+        """
+        Finds chapter page belongs to
+        :param page: Page number counted from beginning of book
+        :return (chapter number, page number counted from beginning of chapter):
+        """
+        starts = self.__chapter_starts
+        page = max(0, min(page, self.page_count - 1))
+        chapter = bisect.bisect_right(starts, page) - 1
+        return chapter, page - starts[chapter]
+
+
+class PageMapStore:
+    def __init__(self, path):
+        """
+        Saves page maps so books don't have to be paginated again on every open
+        :param path: Directory page maps are kept in
+        """
+        self.__path = path
+
+    @staticmethod
+    def make_key(book_md5, width, height, zoom, theme):
+        """
+        Creates key of page map
+        :param book_md5: Identity of book content, changes with files of unpacked book
+        :param width: Viewer width in pixels
+        :param height: Viewer height in pixels
+        :param zoom: Viewer zoom level
+        :param theme: Name of stylesheet
+        :return key:
+        """
+        return "%s-%dx%d-%.2f-%s" % (book_md5, width, height, zoom, theme)
+
+    def load(self, key, chapter_count):
+        """
+        Returns saved page map, or an empty one if there is none yet
+        :param key: Key created by make_key()
+        :param chapter_count: Number of chapters in book
+        :return PageMap:
+        """
+        try:
+            with open(os.path.join(self.__path, key + ".json")) as file:
+                chapter_pages = json.load(file)
+        except (IOError, ValueError):
+            chapter_pages = None
+        return PageMap(key, chapter_count, chapter_pages)
+
+    def save(self, page_map):
+        """
+        Saves page map, trims old ones
+        :param page_map: PageMap
+        """
+        try:
+            os.makedirs(self.__path, exist_ok=True)
+            temporary_path = os.path.join(self.__path, page_map.key + ".json.%d" % os.getpid())
+            with open(temporary_path, "w") as file:
+                json.dump(page_map.chapter_pages, file)
+            # Other instances only ever see whole files
+            os.replace(temporary_path, os.path.join(self.__path, page_map.key + ".json"))
+            self.__trim()
+        except OSError as e:
+            print("Could not save page map: ", e)
+
+    def __trim(self):
+        file_paths = [os.path.join(self.__path, name) for name in os.listdir(self.__path) if name.endswith(".json")]
+        if len(file_paths) <= MAX_PAGE_MAPS:
+            return
+        file_paths.sort(key=lambda file_path: os.stat(file_path).st_mtime)
+        for file_path in file_paths[:len(file_paths) - MAX_PAGE_MAPS]:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import functools
+import gc
+import os
+import resource
+import tracemalloc
+import zipfile
+
+# Memory profiling mode, enabled by starting the application with EASY_EBOOK_VIEWER_PROFILE_MEMORY=1.
+# Functions decorated with @profiled take a tracemalloc snapshot and read RSS before and after every call,
+# then print how much memory the call left behind and which lines allocated it.
+
+PROFILE_ENVIRONMENT_VARIABLE = "EASY_EBOOK_VIEWER_PROFILE_MEMORY"
+
+# Number of allocation sites printed per call
+TOP_ALLOCATIONS = 10
+
+
+def rss():
+    """
+    Returns resident set size of this process
+    :return bytes:
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        # Not Linux, peak RSS is the best we can do
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryProfiler:
+    def __init__(self, frames=25):
+        """
+        Reports memory left behind by profiled calls
+        :param frames: Depth of tracebacks stored for every allocation
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+
+    def measure(self, label, function, *args, **kwargs):
+        """
+        Calls function and prints allocation deltas it caused
+        :param label: Name to print in report
+        :param function: Callable to profile
+        :return whatever function returned:
+        """
+        gc.collect()
+        rss_before = rss()
+        snapshot_before = tracemalloc.take_snapshot()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            gc.collect()
+            snapshot_after = tracemalloc.take_snapshot()
+            rss_after = rss()
+            self.__report(label, snapshot_before, snapshot_after, rss_after - rss_before)
+
+    def __report(self, label, snapshot_before, snapshot_after, rss_delta):
+        # Profiler's own bookkeeping is not interesting
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        statistics = snapshot_after.filter_traces(filters).compare_to(snapshot_before.filter_traces(filters),
+                                                                      "lineno")
+        current, peak = tracemalloc.get_traced_memory()
+        print("[memory] %s: RSS %+.1f KiB (now %.1f MiB), Python heap %.1f MiB (peak %.1f MiB)" %
+              (label, rss_delta / 1024, rss() / 2 ** 20, current / 2 ** 20, peak / 2 ** 20))
+        for statistic in statistics[:TOP_ALLOCATIONS]:
+            if statistic.size_diff == 0:
+                break
+            print("[memory]   %s" % statistic)
+
+
+# The profiler in use, None when profiling mode is off
+active_profiler = MemoryProfiler() if os.environ.get(PROFILE_ENVIRONMENT_VARIABLE) == "1" else None
+
+
+def profiled(label):
+    """
+    Decorator that measures memory left behind by every call when profiling mode is on, does nothing otherwise
+    :param label: Name to print in report
+    """
+    def decorator(function):
+        if active_profiler is None:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return active_profiler.measure(label, function, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def write_synthetic_book(file_path, number, chapters=20):
+    """
+    Writes a small but complete ePub, every number gives a book with different content (and MD5)
+    :param file_path: Where to save the book
+    :param number: Book number, ends up in title and text
+    :param chapters: Number of chapters
+    """
+    with zipfile.ZipFile(file_path, "w", zipfile.ZIP_DEFLATED) as book:
+        book.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
+        book.writestr("META-INF/container.xml",
+                      '<?xml version="1.0"?><container><rootfiles>'
+                      '<rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>'
+                      '</rootfiles></container>')
+        manifest = "".join('<item id="c%d" href="Text/ch%d.xhtml" media-type="application/xhtml+xml"/>' % (i, i)
+                           for i in range(chapters))
+        spine = "".join('<itemref idref="c%d"/>' % i for i in range(chapters))
+        book.writestr("OEBPS/content.opf",
+                      '<?xml version="1.0"?><package><metadata><dc:title>Synthetic book %d</dc:title>'
+                      '<dc:creator>Easy eBook Viewer</dc:creator></metadata><manifest>'
+                      '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>%s</manifest>'
+                      '<spine toc="ncx">%s</spine></package>' % (number, manifest, spine))
+        nav_points = "".join('<navPoint id="n%d"><navLabel><text>Chapter %d</text></navLabel>'
+                             '<content src="Text/ch%d.xhtml"/></navPoint>' % (i, i + 1, i) for i in range(chapters))
+        book.writestr("OEBPS/toc.ncx", '<?xml version="1.0"?><ncx><navMap>%s</navMap></ncx>' % nav_points)
+        for i in range(chapters):
+            book.writestr("OEBPS/Text/ch%d.xhtml" % i,
+                          '<?xml version="1.0" encoding="utf-8"?><html><body><h1>Chapter %d</h1>%s</body></html>' %
+                          (i + 1, "<p>Book %d, paragraph %d.</p>" % (number, i) * 200))
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import CancelledError
+
+# Background work of the whole application runs on one bounded pool of threads. Every task has a priority
+# class, a worker always takes the most important task that is waiting, so a chapter the user asked for is
+# never stuck behind validation of a book or cache cleanup. Tasks belong to a book and are dropped together
+# when the book is closed. Results are handed to the UI thread by marshal function, GLib.idle_add in the
+# application, so callers never touch widgets from a worker.
+#
+# Extraction keeps its own threads, they are tied to open zip handles and wait on each other's members.
+
+INTERACTIVE = 0
+PREFETCH = 1
+INDEXING = 2
+MAINTENANCE = 3
+
+PRIORITY_NAMES = ("interactive", "prefetch", "indexing", "maintenance")
+
+# Tasks of this priority class and less important ones never take the last worker
+RESERVED_WORKERS_PRIORITY = INDEXING
+
+QUEUED = 0
+RUNNING = 1
+DONE = 2
+CANCELLED = 3
+
+
+class Task:
+    def __init__(self, scheduler, function, priority, book, on_finished):
+        """
+        Unit of background work, returned by Scheduler.submit
+        :param scheduler: Scheduler task is queued in
+        :param function: Callable without arguments
+        :param priority: Priority class
+        :param book: MD5 of book task belongs to, None for tasks of no book
+        :param on_finished: Called on UI thread with result, None when nobody waits for result
+        """
+        self.__scheduler = scheduler
+        self.function = function
+        self.priority = priority
+        self.book = book
+        self.on_finished = on_finished
+        self.state = QUEUED
+        self.submitted = time.monotonic()
+        self.started = None
+        self.__event = threading.Event()
+        self.__result = None
+        self.__error = None
+
+    @property
+    def cancelled(self):
+        """
+        Tells if task was cancelled, long running functions check it to stop early
+        :return True once cancelled:
+        """
+        return self.state == CANCELLED
+
+    def cancel(self):
+        """
+        Drops task if it did not start yet, running task only gets its cancelled flag set
+        """
+        self.__scheduler.cancel(self)
+
+    def promote(self, priority):
+        """
+        Moves task to a more important priority class if it is still queued
+        :param priority:
+        """
+        self.__scheduler.promote(self, priority)
+
+    def done(self):
+        return self.__event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for task to finish
+        :param timeout: Seconds to wait, None to wait as long as it takes
+        :return whatever function returned, raises what it raised or CancelledError:
+        """
+        if not self.__event.wait(timeout):
+            raise TimeoutError()
+        if self.state == CANCELLED and self.started is None:
+            raise CancelledError()
+        if self.__error is not None:
+            raise self.__error
+        return self.__result
+
+    def wait(self, timeout=None):
+        """
+        Waits for task to finish or to be dropped, does not raise
+        :param timeout: Seconds to wait, None to wait as long as it takes
+        """
+        self.__event.wait(timeout)
+
+    def _finish(self, result, error):
+        self.__result = result
+        self.__error = error
+        self.__event.set()
+
+
+class PriorityStatistics:
+    def __init__(self):
+        """
+        Latency of tasks of one priority class
+        """
+        self.queued = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.total_run = 0.0
+        self.max_run = 0.0
+
+
+class Scheduler:
+    def __init__(self, workers=None, marshal=None):
+        """
+        Runs background tasks by priority on a bounded pool of threads
+        :param workers: Maximal number of worker threads, by default one per CPU up to four
+        :param marshal: Called as marshal(function, argument) to run function on UI thread, None runs it on the
+        worker thread
+        """
+        self.__max_workers = workers or min(4, os.cpu_count() or 1)
+        self.__marshal = marshal
+        self.__heap = []
+        self.__running = set()
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+        self.__threads = []
+        self.__idle_workers = 0
+        self.__running_low = 0
+        self.__shut_down = False
+        self.__statistics = [PriorityStatistics() for name in PRIORITY_NAMES]
+
+    def submit(self, function, priority, book=None, on_finished=None):
+        """
+        Queues function to run on a worker thread
+        :param function: Callable without arguments
+        :param priority: INTERACTIVE, PREFETCH, INDEXING or MAINTENANCE
+        :param book: MD5 of book task belongs to, cancel_book drops it
+        :param on_finished: Called on UI thread with result, not called when task was cancelled or failed
+        :return Task:
+        """
+        task = Task(self, function, priority, book, on_finished)
+        with self.__condition:
+            if self.__shut_down:
+                task.state = CANCELLED
+                task._finish(None, None)
+                return task
+            self.__push(task, priority)
+            self.__statistics[priority].queued += 1
+            if self.__idle_workers == 0 and len(self.__threads) < self.__max_workers:
+                thread = threading.Thread(target=self.__work, name="scheduler-%d" % len(self.__threads),
+                                          daemon=True)
+                self.__threads.append(thread)
+                thread.start()
+            self.__condition.notify()
+        return task
+
+    def promote(self, task, priority):
+        """
+        Moves queued task to a more important priority class, ie. when a prefetched page is needed right now
+        :param task:
+        :param priority:
+        """
+        with self.__condition:
+            if task.state != QUEUED or priority >= task.priority:
+                return
+            self.__statistics[task.priority].queued -= 1
+            self.__statistics[priority].queued += 1
+            task.priority = priority
+            # Entry with old priority stays in heap, it is skipped because task is no longer queued by then
+            self.__push(task, priority)
+            self.__condition.notify()
+
+    def cancel(self, task):
+        """
+        Drops queued task, running task only gets its cancelled flag set
+        :param task:
+        """
+        with self.__condition:
+            self.__cancel(task)
+
+    def cancel_book(self, book):
+        """
+        Cancels every task of a book, to be used when book is closed
+        :param book: MD5 of book
+        """
+        with self.__condition:
+            for task in [entry[2] for entry in self.__heap] + list(self.__running):
+                if task.book == book:
+                    self.__cancel(task)
+
+    def shutdown(self, wait=False):
+        """
+        Cancels all tasks, workers exit once their current task is done
+        :param wait: True to block until they exit, ie. before files tasks work with are removed
+        """
+        with self.__condition:
+            self.__shut_down = True
+            for task in [entry[2] for entry in self.__heap] + list(self.__running):
+                self.__cancel(task)
+            self.__heap = []
+            self.__condition.notify_all()
+            threads = list(self.__threads)
+        if wait:
+            for thread in threads:
+                if thread is not threading.current_thread():
+                    thread.join()
+
+    @property
+    def queue_depth(self):
+        """
+        Returns number of waiting tasks of every priority class
+        :return dictionary priority name: number of tasks:
+        """
+        with self.__condition:
+            return {name: statistics.queued for name, statistics in zip(PRIORITY_NAMES, self.__statistics)}
+
+    def report(self):
+        """
+        Returns queue depth and latency of every priority class that ran anything
+        :return text:
+        """
+        lines = []
+        with self.__condition:
+            for name, statistics in zip(PRIORITY_NAMES, self.__statistics):
+                if not statistics.completed and not statistics.queued and not statistics.cancelled:
+                    continue
+                completed = max(1, statistics.completed)
+                lines.append("[scheduler] %s: %d done, %d failed, %d cancelled, %d queued, "
+                             "wait %.1f ms avg / %.1f ms max, run %.1f ms avg / %.1f ms max" %
+                             (name, statistics.completed, statistics.failed, statistics.cancelled, statistics.queued,
+                              statistics.total_wait / completed * 1000, statistics.max_wait * 1000,
+                              statistics.total_run / completed * 1000, statistics.max_run * 1000))
+        return "\n".join(lines)
+
+    def __push(self, task, priority):
+        heapq.heappush(self.__heap, (priority, next(self.__sequence), task))
+
+    def __cancel(self, task):
+        if task.state == QUEUED:
+            self.__statistics[task.priority].queued -= 1
+            self.__statistics[task.priority].cancelled += 1
+            task.state = CANCELLED
+            task._finish(None, None)
+        elif task.state == RUNNING:
+            task.state = CANCELLED
+
+    def __take(self):
+        """
+        Returns most important queued task, blocks until there is one, lock is held by caller
+        :return Task or None when scheduler was shut down:
+        """
+        while True:
+            while self.__heap and self.__heap[0][2].state != QUEUED:
+                heapq.heappop(self.__heap)
+            if self.__shut_down:
+                return None
+            # Background work never takes the last worker, something interactive may come any moment
+            if self.__heap and (self.__heap[0][0] < RESERVED_WORKERS_PRIORITY or
+                                self.__running_low < max(1, self.__max_workers - 1)):
+                priority, sequence, task = heapq.heappop(self.__heap)
+                return task
+            self.__idle_workers += 1
+            self.__condition.wait()
+            self.__idle_workers -= 1
+
+    def __work(self):
+        while True:
+            with self.__condition:
+                task = self.__take()
+                if task is None:
+                    return
+                task.state = RUNNING
+                self.__running.add(task)
+                task.started = time.monotonic()
+                low = task.priority >= RESERVED_WORKERS_PRIORITY
+                if low:
+                    self.__running_low += 1
+                statistics = self.__statistics[task.priority]
+                statistics.queued -= 1
+                wait = task.started - task.submitted
+                statistics.total_wait += wait
+                statistics.max_wait = max(statistics.max_wait, wait)
+
+            result = error = None
+            try:
+                result = task.function()
+            except Exception as e:
+                print("Background task failed: ", e)
+                error = e
+            run = time.monotonic() - task.started
+
+            with self.__condition:
+                self.__running.discard(task)
+                if low:
+                    self.__running_low -= 1
+                    self.__condition.notify()
+                statistics.completed += 1
+                statistics.total_run += run
+                statistics.max_run = max(statistics.max_run, run)
+                if error is not None:
+                    statistics.failed += 1
+                elif task.state == RUNNING:
+                    task.state = DONE
+            task._finish(result, error)
+            if error is None and task.on_finished is not None and not task.cancelled:
+                if self.__marshal is not None:
+                    self.__marshal(self.__deliver, (task, result))
+                else:
+                    try:
+                        task.on_finished(result)
+                    except Exception as e:
+                        print("Handling result of background task failed: ", e)
+
+    @staticmethod
+    def __deliver(data):
+        """
+        Hands result to on_finished on UI thread, unless task was cancelled while result was on its way
+        """
+        task, result = data
+        if not task.cancelled:
+            task.on_finished(result)
+        return False
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import json
+import math
+import threading
+import time
+
+# Session recording, enabled by starting the application with EASY_EBOOK_VIEWER_RECORD=<file>. Every navigation
+# user does is appended to the file as a line of JSON with seconds since recording started:
+#
+#   {"time": 3.52, "action": "next", "via": "key"}
+#
+# Application started with EASY_EBOOK_VIEWER_REPLAY=<file> and EASY_EBOOK_VIEWER_REPLAY_BOOK=<book> does the same
+# navigation again on the given book, measures how long it takes from every action until the page is laid out,
+# writes latency percentiles to EASY_EBOOK_VIEWER_REPLAY_REPORT (or prints them) and quits. Replays of the same
+# session are compared between releases, see "easy-ebook-viewer-cli replay".
+
+RECORD_ENVIRONMENT_VARIABLE = "EASY_EBOOK_VIEWER_RECORD"
+REPLAY_ENVIRONMENT_VARIABLE = "EASY_EBOOK_VIEWER_REPLAY"
+REPLAY_BOOK_ENVIRONMENT_VARIABLE = "EASY_EBOOK_VIEWER_REPLAY_BOOK"
+REPLAY_REPORT_ENVIRONMENT_VARIABLE = "EASY_EBOOK_VIEWER_REPLAY_REPORT"
+
+# Actions and what else is recorded with them
+OPEN = "open"          # book: path of book
+NEXT = "next"          # via: "button" or "key"
+PREVIOUS = "previous"  # via: "button" or "key"
+CHAPTER = "chapter"    # number: what user typed into header bar
+TOC = "toc"            # anchor: content of chapters index entry, chapter: its chapter number
+LINK = "link"          # path: file link led to, relative to book directory, anchor included
+
+ACTIONS = (OPEN, NEXT, PREVIOUS, CHAPTER, TOC, LINK)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class SessionRecorder:
+    def __init__(self, path):
+        """
+        Appends navigation actions to a file
+        :param path: File to record to, None records nothing
+        """
+        self.__file = open(path, "a", encoding="utf-8") if path else None
+        self.__start = time.monotonic()
+        self.__lock = threading.Lock()
+        if self.__file is not None:
+            print("Recording session to: " + path)
+
+    @property
+    def enabled(self):
+        return self.__file is not None
+
+    def record(self, action, **arguments):
+        """
+        Appends action, written right away so nothing is lost when application crashes
+        :param action: One of ACTIONS
+        :param arguments: What replaying action needs
+        """
+        if self.__file is None:
+            return
+        entry = {"time": round(time.monotonic() - self.__start, 3), "action": action}
+        entry.update(arguments)
+        with self.__lock:
+            self.__file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.__file.flush()
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+def read_session(path):
+    """
+    Reads recorded session, lines that are not actions are skipped
+    :param path:
+    :return list of action dictionaries in order they were done:
+    """
+    actions = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(entry, dict) and entry.get("action") in ACTIONS:
+                actions.append(entry)
+    return actions
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile
+    :param values: Sorted list of numbers
+    :param percent: 0 - 100
+    :return value or None for empty list:
+    """
+    if not values:
+        return None
+    rank = max(1, math.ceil(percent / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(latencies):
+    """
+    Summarizes latencies of one kind of action
+    :param latencies: Milliseconds
+    :return dictionary:
+    """
+    values = sorted(latencies)
+    summary = {"count": len(values),
+               "mean": round(sum(values) / len(values), 1) if values else None,
+               "max": round(values[-1], 1) if values else None}
+    for percent in PERCENTILES:
+        value = percentile(values, percent)
+        summary["p%d" % percent] = round(value, 1) if value is not None else None
+    return summary
+
+
+class LatencyReport:
+    def __init__(self):
+        """
+        Latencies measured by replays, from action until page was laid out
+        """
+        # Action: list of milliseconds
+        self.samples = {}
+        self.timeouts = 0
+        self.skipped = 0
+
+    def add(self, action, milliseconds):
+        self.samples.setdefault(action, []).append(milliseconds)
+
+    def merge(self, report):
+        """
+        Adds samples of another replay, ie. of another run of the same session
+        :param report: Dictionary report was saved as
+        """
+        for action, latencies in report.get("samples", {}).items():
+            self.samples.setdefault(action, []).extend(latencies)
+        self.timeouts += report.get("timeouts", 0)
+        self.skipped += report.get("skipped", 0)
+
+    def to_dict(self):
+        """
+        Returns report JSON can serialize, raw samples included so reports can be merged
+        :return dictionary:
+        """
+        return {"actions": {action: summarize(latencies) for action, latencies in sorted(self.samples.items())},
+                "all": summarize([latency for latencies in self.samples.values() for latency in latencies]),
+                "timeouts": self.timeouts,
+                "skipped": self.skipped,
+                "samples": {action: [round(latency, 2) for latency in latencies]
+                            for action, latencies in sorted(self.samples.items())}}
+
+
+def compare(report, baseline):
+    """
+    Compares percentiles of two reports, ie. of current release and of previous one
+    :param report: Dictionary of LatencyReport
+    :param baseline: Dictionary of LatencyReport to compare with
+    :return dictionary action: percentile: relative change (0.1 means 10 % slower), None when not comparable:
+    """
+    changes = {}
+    for action, summary in list(report["actions"].items()) + [("all", report["all"])]:
+        base = baseline["all"] if action == "all" else baseline.get("actions", {}).get(action)
+        if base is None:
+            continue
+        changes[action] = {}
+        for percent in PERCENTILES:
+            key = "p%d" % percent
+            if summary.get(key) is None or not base.get(key):
+                changes[action][key] = None
+            else:
+                changes[action][key] = round(summary[key] / base[key] - 1, 3)
+    return changes
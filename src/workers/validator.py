@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+# Easy eBook Viewer by Michal Daniel
+
+# Easy eBook Viewer is free software; you can redistribute it and/or modify it under the terms
+# of the GNU General Public Licence as published by the Free Software Foundation.
+
+# Easy eBook Viewer is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE.  See the GNU General Public Licence for more details.
+
+# You should have received a copy of the GNU General Public Licence along with
+# Easy eBook Viewer; if not, write to the Free Software Foundation, Inc., 51 Franklin Street,
+# Fifth Floor, Boston, MA 02110-1301, USA.
+
+import posixpath
+import urllib.parse
+import zipfile
+import zlib
+
+from workers.scheduler import INDEXING
+
+# Size of the chunks read from the archive when checking CRCs
+CHUNK_SIZE = 256 * 1024
+
+
+def member_name(oebps, href):
+    """
+    Returns name of archive member a link from OPF or NCX file points to
+    :param oebps: Directory of OPF file inside of archive
+    :param href: Link, may be URL encoded and contain an anchor
+    :return member name:
+    """
+    return posixpath.normpath(posixpath.join(oebps, urllib.parse.unquote(href.split('#')[0])))
+
+
+class ValidationReport:
+    def __init__(self):
+        """
+        Problems found in a book, empty when book is valid
+        """
+        self.problems = []
+
+    @property
+    def valid(self):
+        return not self.problems
+
+
+class BookValidator:
+    def __init__(self, session):
+        """
+        Checks every file OPF and NCX refer to against archive central directory and verifies CRC of every member
+        :param session: BookSession of book to validate
+        """
+        self.__file_path = session.file_path
+        # Book that is still downloading is read over range requests
+        self.__download = session.download
+        self.__book_md5 = session.book_md5
+        self.__oebps = session.oebps
+        self.__manifest = dict(session.manifest)
+        self.__spine = list(session.spine)
+        self.__toc_targets = list(session.toc_targets)
+        self.__unpacked = session.unpacked
+        self.__members = set(session.members)
+        self.__cancelled = False
+        self.__task = None
+        # ValidationReport once validation is done
+        self.report = None
+
+    def start(self, scheduler, on_finished):
+        """
+        Validates book in the background, returns immediately
+        :param scheduler: Scheduler validation runs on
+        :param on_finished: Called on UI thread with ValidationReport, not called when cancelled
+        """
+        self.__task = scheduler.submit(self.run, INDEXING, book=self.__book_md5, on_finished=on_finished)
+
+    def cancel(self):
+        """
+        Stops validation and waits for it to stop
+        """
+        self.__cancelled = True
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task.wait()
+
+    def run(self):
+        """
+        Validates book, blocks until done
+        :return ValidationReport:
+        """
+        report = ValidationReport()
+        if self.__unpacked:
+            # Unpacked book has no checksums, references are checked against files in its directory
+            self.__check_references(report, self.__members)
+        else:
+            try:
+                archive = self.__download.open() if self.__download is not None and \
+                    not self.__download.complete else self.__file_path
+                with zipfile.ZipFile(archive) as zip_file:
+                    members = {member.filename: member for member in zip_file.infolist()}
+                    self.__check_references(report, members)
+                    for member in members.values():
+                        if self.__cancelled:
+                            break
+                        self.__check_crc(report, zip_file, member)
+            except (zipfile.BadZipFile, OSError) as e:
+                report.problems.append(_("Could not read book: %s") % e)
+        self.report = report
+        print("Validated %s: %d problems" % (self.__file_path, len(report.problems)))
+        return report
+
+    def __check_references(self, report, members):
+        """
+        Reports links in OPF and NCX files that point to files archive does not have
+        """
+        for item_id, (href, media_type) in self.__manifest.items():
+            if member_name(self.__oebps, href) not in members:
+                report.problems.append(_("Missing file: %s") % href)
+        for idref in self.__spine:
+            if idref not in self.__manifest:
+                report.problems.append(_("Reading order refers to undeclared item: %s") % idref)
+        if not self.__spine:
+            report.problems.append(_("Reading order is empty"))
+        for href in self.__toc_targets:
+            if member_name(self.__oebps, href) not in members:
+                report.problems.append(_("Table of contents points to missing file: %s") % href)
+
+    def __check_crc(self, report, zip_file, member):
+        """
+        Reads member and compares its checksum with the one in central directory
+        """
+        if member.is_dir():
+            return
+        crc = 0
+        try:
+            with zip_file.open(member) as source:
+                while not self.__cancelled:
+                    chunk = source.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    crc = zlib.crc32(chunk, crc)
+        except (zipfile.BadZipFile, zlib.error, OSError, NotImplementedError) as e:
+            report.problems.append(_("Damaged file: %s (%s)") % (member.filename, e))
+            return
+        if not self.__cancelled and crc != member.CRC:
+            report.problems.append(_("Damaged file: %s (bad CRC-32)") % member.filename)